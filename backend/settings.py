@@ -6,6 +6,7 @@ from pathlib import Path
 from datetime import timedelta
 import os
 import dj_database_url
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -86,6 +87,65 @@ DATABASES = {}
 
 DATABASES["default"] = dj_database_url.parse(os.environ.get("DATABASE_URL"))
  
+# Cache - Redis when REDIS_URL is set, local memory otherwise (dev/tests)
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds a cached anonymous catalog response is kept (see store/cache.py)
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 300))
+
+# Seconds a stored response is replayed for a repeated Idempotency-Key (see store/idempotency.py)
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+# Seconds a cart line holds its stock before the sweep releases it (see store/inventory.py)
+CART_RESERVATION_TTL = int(os.environ.get('CART_RESERVATION_TTL', 900))
+
+# Where live carts are kept: 'database' rows or 'redis' hashes written behind (see store/carts.py)
+CART_STORE = os.environ.get('CART_STORE', 'database')
+
+# Seconds an untouched cart stays in Redis; it must outlive the persist-carts interval
+CART_CACHE_TTL = int(os.environ.get('CART_CACHE_TTL', 7 * 24 * 60 * 60))
+
+# Anonymous carts live in a signed cookie: its lifetime in seconds and line cap (see store/carts.py)
+GUEST_CART_MAX_AGE = int(os.environ.get('GUEST_CART_MAX_AGE', 30 * 24 * 60 * 60))
+GUEST_CART_MAX_LINES = int(os.environ.get('GUEST_CART_MAX_LINES', 50))
+
+# Celery - tasks run inline when no broker is configured (dev/tests)
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', REDIS_URL)
+CELERY_TASK_ALWAYS_EAGER = not CELERY_BROKER_URL
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_BEAT_SCHEDULE = {
+    'release-expired-reservations': {
+        'task': 'store.tasks.release_expired_reservations',
+        'schedule': 60.0,
+    },
+    # Writes changed Redis carts behind to Cart/CartItem rows
+    'persist-carts': {
+        'task': 'store.tasks.persist_carts',
+        'schedule': 30.0,
+    },
+    # Catches stock changes made outside checkout (admin edits, imports)
+    'notify-low-stock': {
+        'task': 'store.tasks.notify_low_stock',
+        'schedule': 300.0,
+    },
+}
+ 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -167,10 +227,16 @@ ACCOUNT_EMAIL_VERIFICATION = 'optional'
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'x-guest-cart')
 
 # Email backend for development
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Staff addresses that receive low-stock alerts (comma-separated; see store/tasks.py)
+LOW_STOCK_ALERT_EMAILS = [
+    address.strip() for address in os.environ.get('LOW_STOCK_ALERT_EMAILS', '').split(',') if address.strip()
+]
+
 # Swagger Settings
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
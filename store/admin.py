@@ -1,9 +1,11 @@
 from decimal import Decimal
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
+from .inventory import rebalance_stripes
+from .lifecycle import transition_orders
 from .models import (
     CustomUser, Category, Product, ProductVariant, ProductImage, 
-    ProductReview, Order, OrderItem, Wishlist, Payment, Cart, CartItem
+    ProductReview, Order, OrderItem, OrderStatusEvent, Wishlist, Payment, Cart, CartItem
 )
 
 @admin.register(CustomUser)
@@ -49,16 +51,31 @@ class ProductAdmin(admin.ModelAdmin):
 
 @admin.register(ProductVariant)
 class ProductVariantAdmin(admin.ModelAdmin):
-    list_display = ('product', 'size', 'price', 'inventory_quantity', 'is_in_stock')
+    list_display = ('product', 'size', 'price', 'inventory_quantity', 'reserved_quantity', 'stripe_count', 'is_in_stock')
     list_filter = ('size', 'product__category')
     search_fields = ('product__name',)
     list_editable = ('price', 'inventory_quantity')  # Allow quick editing
+    actions = ['rebalance_inventory_stripes']
     
     def save_model(self, request, obj, form, change):
         # Ensure price is set
         if obj.price is None:
             obj.price = Decimal('0.00')
         super().save_model(request, obj, form, change)
+        # Striped stock lives in stripes: restocks and stripe changes are spread over them
+        changed = set(form.changed_data)
+        if 'stripe_count' in changed or (obj.is_striped and 'inventory_quantity' in changed):
+            rebalance_stripes(
+                obj, obj.stripe_count,
+                stock=obj.inventory_quantity if 'inventory_quantity' in changed else None
+            )
+
+    @admin.action(description='Rebalance inventory stripes')
+    def rebalance_inventory_stripes(self, request, queryset):
+        variants = queryset.filter(stripe_count__gt=0)
+        for variant in variants:
+            rebalance_stripes(variant)
+        self.message_user(request, f"Rebalanced {len(variants)} striped variant(s)")
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -90,13 +107,51 @@ class OrderItemInline(admin.TabularInline):
         return "N/A"  # For unsaved objects
     display_total_price.short_description = 'Total Price'
 
+class OrderStatusEventInline(admin.TabularInline):
+    model = OrderStatusEvent
+    extra = 0
+    can_delete = False
+    fields = ('from_status', 'to_status', 'actor', 'note', 'created_at')
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'status', 'display_total_amount', 'created_at')
     list_filter = ('status', 'created_at')
     search_fields = ('user__email', 'id')
-    inlines = [OrderItemInline]
-    readonly_fields = ('created_at', 'updated_at')
+    inlines = [OrderItemInline, OrderStatusEventInline]
+    # Status only moves through the lifecycle actions below
+    readonly_fields = ('status', 'created_at', 'updated_at')
+    actions = ['mark_processing', 'mark_shipped', 'mark_delivered', 'mark_cancelled']
+
+    def transition(self, request, queryset, target):
+        result = transition_orders(list(queryset.values_list('pk', flat=True)), target, actor=request.user)
+        self.message_user(request, f"Marked {result.updated} order(s) as {target}")
+        if result.ineligible:
+            self.message_user(
+                request,
+                f"{len(result.ineligible)} order(s) could not be marked as {target} from their current status",
+                level=messages.WARNING
+            )
+
+    @admin.action(description='Mark selected orders as processing')
+    def mark_processing(self, request, queryset):
+        self.transition(request, queryset, 'processing')
+
+    @admin.action(description='Mark selected orders as shipped')
+    def mark_shipped(self, request, queryset):
+        self.transition(request, queryset, 'shipped')
+
+    @admin.action(description='Mark selected orders as delivered')
+    def mark_delivered(self, request, queryset):
+        self.transition(request, queryset, 'delivered')
+
+    @admin.action(description='Cancel selected orders (restocks items)')
+    def mark_cancelled(self, request, queryset):
+        self.transition(request, queryset, 'cancelled')
     
     def display_total_amount(self, obj):
         """Safe display of total amount"""
@@ -0,0 +1,212 @@
+"""
+Versioned response cache and HTTP validators for the catalog endpoints.
+
+Cached entries are keyed by a generation counter per namespace. Writes to
+catalog rows bump the counter (see signals.py), which orphans every entry
+built from the old data instead of having to find and delete them. The same
+counters (plus the time of the last bump) double as ETag / Last-Modified
+validators for list responses. Stock moves that leave the listings alone
+only bump the product's own namespace (see product_namespace).
+"""
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+PRODUCTS = 'products'
+CATEGORIES = 'categories'
+
+
+def product_namespace(slug):
+    """Namespace of one product's detail response, moved by its stock changes"""
+    return f'{PRODUCTS}:{slug}'
+
+
+def _generation_key(namespace):
+    return f'catalog:generation:{namespace}'
+
+
+def _modified_key(namespace):
+    return f'catalog:modified:{namespace}'
+
+
+def get_generation(namespace):
+    """Current generation of a namespace, initialised on first use"""
+    key = _generation_key(namespace)
+    generation = cache.get(key)
+    if generation is None:
+        # Start from the clock so a lost counter never reuses old keys
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(*namespaces):
+    """Invalidate every cached response of the given namespaces"""
+    now = time.time()
+    for namespace in namespaces:
+        try:
+            cache.incr(_generation_key(namespace))
+        except ValueError:
+            get_generation(namespace)
+        cache.set(_modified_key(namespace), now, timeout=None)
+
+
+def get_last_modified(namespace):
+    """When the namespace generation last moved (now, if unknown)"""
+    modified = cache.get(_modified_key(namespace))
+    if modified is None:
+        modified = time.time()
+        cache.add(_modified_key(namespace), modified, timeout=None)
+    return datetime.fromtimestamp(modified, tz=timezone.utc)
+
+
+def normalized_query(request, allowed=None):
+    """Query params as a sorted, hashable structure, optionally limited to `allowed`"""
+    return tuple(sorted(
+        (name, tuple(sorted(values)))
+        for name, values in request.query_params.lists()
+        if (allowed is None or name in allowed) and any(values)
+    ))
+
+
+class CatalogCacheMixin:
+    """
+    Cache list and retrieve responses for anonymous GET requests.
+
+    The key is built from the namespace generation, the view action, the
+    lookup kwargs and the normalized query params that affect the response.
+    """
+    cache_namespace = None
+    cache_query_params = ['search', 'ordering', 'page', 'page_size']
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def is_cacheable(self, request):
+        return request.method == 'GET' and not request.user.is_authenticated
+
+    def get_cache_query_params(self):
+        params = set(self.cache_query_params)
+        filterset_class = getattr(self, 'filterset_class', None)
+        if filterset_class is not None:
+            params.update(filterset_class.base_filters)
+        params.update(getattr(self, 'filterset_fields', None) or [])
+        return params
+
+    def get_cache_generation(self, kwargs):
+        return get_generation(self.cache_namespace)
+
+    def get_cache_key(self, request, kwargs):
+        normalized = normalized_query(request, self.get_cache_query_params())
+        raw = repr((request.get_host(), sorted(kwargs.items()), normalized))
+        digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+        generation = self.get_cache_generation(kwargs)
+        return f'catalog:{self.cache_namespace}:{self.action}:{generation}:{digest}'
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not self.is_cacheable(request):
+            return handler(request, *args, **kwargs)
+
+        key = self.get_cache_key(request, kwargs)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified support for list and retrieve.
+
+    Views return a cheap `(version, last_modified)` from
+    get_resource_version() (a cache generation or a single max-timestamp
+    query). Matching If-None-Match / If-Modified-Since requests get a 304
+    before any serializer runs or related rows are loaded.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_resource_version(self, request, kwargs):
+        """(version, last modified datetime) of the requested resource, or None"""
+        return None
+
+    def get_etag(self, request, kwargs, version):
+        raw = repr((
+            version, self.action, request.get_host(), sorted(kwargs.items()),
+            normalized_query(request), request.accepted_renderer.format,
+        ))
+        return quote_etag(hashlib.md5(raw.encode('utf-8')).hexdigest())
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return handler(request, *args, **kwargs)
+        resource = self.get_resource_version(request, kwargs)
+        if resource is None:
+            return handler(request, *args, **kwargs)
+
+        version, last_modified = resource
+        etag = self.get_etag(request, kwargs, version)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request._request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response.headers['ETag'] = etag
+        if timestamp is not None:
+            response.headers['Last-Modified'] = http_date(timestamp)
+        return response
+
+
+class CategoryMap:
+    """
+    Process-local map of category id -> serialized category (with its active
+    product count), rebuilt in one query whenever the categories generation
+    moves, i.e. after a Category write or a product status/category change.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._categories = {}
+
+    def current(self):
+        generation = get_generation(CATEGORIES)
+        if generation != self._generation:
+            with self._lock:
+                if generation != self._generation:
+                    self._categories = self._build()
+                    self._generation = generation
+        return self._categories
+
+    def _build(self):
+        from django.db.models import Count, Q
+        from .models import Category
+        from .serializers import CategorySerializer
+
+        categories = Category.objects.annotate(
+            product_count=Count('products', filter=Q(products__status='active'))
+        )
+        return {category.id: CategorySerializer(category).data for category in categories}
+
+
+category_map = CategoryMap()
@@ -0,0 +1,585 @@
+"""
+Pluggable cart storage.
+
+CartViewSet, CartItemViewSet and the cart checkout read and write carts
+through get_cart_store(), picked by settings.CART_STORE:
+
+- 'database' (default): lines are CartItem rows and adding to a cart holds
+  stock (see store/inventory.py).
+- 'redis': live carts are Redis hashes ({variant_id: quantity}) and cart
+  writes never touch the database. Changed carts are queued in a dirty set
+  and written behind to Cart/CartItem rows by the persist_carts task. Stock
+  is only checked at checkout, as for striped variants. Without a Redis
+  cache a process-local stand-in is used (dev/tests).
+
+Anonymous visitors get a GuestCart instead, kept in a signed token on the
+client, so browsing causes no cart writes at all.
+"""
+import hashlib
+import logging
+import threading
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+
+from .inventory import InsufficientStock, release, reserve, reserve_many
+from .models import Cart, CartItem, CustomUser, ProductImage, ProductVariant
+
+logger = logging.getLogger(__name__)
+
+# Main image of each line's product, read by CartItemSerializer
+MAIN_IMAGES = Prefetch(
+    'variant__product__images', queryset=ProductImage.objects.filter(is_main=True), to_attr='main_images'
+)
+
+
+def _prepared(model, values):
+    """Database values of {field name: value} for a hand-written statement"""
+    return [model._meta.get_field(name).get_db_prep_value(value, connection) for name, value in values.items()]
+
+
+def _columns(model, names):
+    return ', '.join(connection.ops.quote_name(model._meta.get_field(name).column) for name in names)
+
+
+def upsert_cart(user):
+    """The user's cart, created on first use by a single INSERT ... ON CONFLICT"""
+    values = {'id': uuid.uuid4(), 'user': user.pk, 'created_at': timezone.now()}
+    user_column = connection.ops.quote_name(Cart._meta.get_field('user').column)
+    cart = next(iter(Cart.objects.raw(
+        f"INSERT INTO {connection.ops.quote_name(Cart._meta.db_table)} ({_columns(Cart, values)}) "
+        f"VALUES ({', '.join(['%s'] * len(values))}) "
+        # The no-op update makes RETURNING yield an existing cart as well
+        f"ON CONFLICT ({user_column}) DO UPDATE SET {user_column} = EXCLUDED.{user_column} RETURNING *",
+        _prepared(Cart, values)
+    )))
+    cart.user = user
+    return cart
+
+
+def get_cart(user):
+    """The user's cart: a plain read, upserted only on first use"""
+    cart = Cart.objects.filter(user=user).first() or upsert_cart(user)
+    cart.user = user
+    return cart
+
+
+def upsert_lines(cart, quantities, increment=False):
+    """
+    Write {variant_id: quantity} lines of `cart` in one INSERT ... ON CONFLICT,
+    adding to (`increment`) or replacing the quantities already there, so
+    concurrent writers never lose an update. Returns {variant_id: CartItem}
+    with the resulting quantities.
+    """
+    if not quantities:
+        return {}
+    table = connection.ops.quote_name(CartItem._meta.db_table)
+    quantity = connection.ops.quote_name('quantity')
+    now = timezone.now()
+    rows = [
+        _prepared(CartItem, {
+            'id': uuid.uuid4(), 'cart': cart.pk, 'variant': variant_id, 'quantity': line_quantity, 'created_at': now
+        })
+        for variant_id, line_quantity in quantities.items()
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({_columns(CartItem, ['id', 'cart', 'variant', 'quantity', 'created_at'])}) "
+            f"VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(rows))} "
+            f"ON CONFLICT ({_columns(CartItem, ['cart', 'variant'])}) DO UPDATE SET {quantity} = "
+            f"{f'{table}.{quantity} + EXCLUDED.{quantity}' if increment else f'EXCLUDED.{quantity}'} "
+            f"RETURNING {_columns(CartItem, ['id', 'variant', 'quantity'])}",
+            [value for row in rows for value in row]
+        )
+        returned = cursor.fetchall()
+    to_uuid = CartItem._meta.pk.to_python
+    return {
+        to_uuid(variant_id): CartItem(id=to_uuid(item_id), cart=cart, variant_id=to_uuid(variant_id), quantity=line_quantity)
+        for item_id, variant_id, line_quantity in returned
+    }
+
+
+class DatabaseCartStore:
+    """Carts as Cart/CartItem rows, with stock held per line"""
+    holds_stock = True
+
+    def cart(self, user):
+        return get_cart(user)
+
+    def exists(self, user):
+        return Cart.objects.filter(user=user).exists()
+
+    def loaded_cart(self, user):
+        """The cart with its lines, variants, products and main images loaded"""
+        cart = get_cart(user)
+        prefetch_related_objects([cart], Prefetch(
+            'items', queryset=CartItem.objects.select_related('variant__product').prefetch_related(MAIN_IMAGES)
+        ))
+        return cart
+
+    def items(self, user):
+        """The cart's lines with their cart, variant and product, in one query"""
+        return list(CartItem.objects.filter(cart__user=user).select_related('cart', 'variant__product'))
+
+    def add(self, user, variant, quantity):
+        """Add `quantity` units of `variant`; raises InsufficientStock"""
+        cart = self.cart(user)
+        with transaction.atomic():
+            cart_item = upsert_lines(cart, {variant.pk: quantity}, increment=True)[variant.pk]
+            # Hold the stock now rather than discovering it is gone at checkout
+            reserve(cart, variant, cart_item.quantity)
+        return cart_item
+
+    def apply(self, user, changes, variants):
+        """
+        Apply folded changes (see fold_operations) to the cart's rows.
+
+        Removed lines go in one DELETE, set and added lines in one upsert
+        each, and their holds follow in bulk. Raises InsufficientStock,
+        leaving the cart untouched.
+        """
+        cart = self.cart(user)
+        removed = [variant_id for variant_id, (absolute, quantity) in changes.items() if absolute and not quantity]
+        with transaction.atomic():
+            CartItem.objects.filter(cart=cart, variant_id__in=removed).delete()
+            lines = upsert_lines(cart, {
+                variant_id: quantity for variant_id, (absolute, quantity) in changes.items() if absolute and quantity
+            })
+            lines.update(upsert_lines(cart, {
+                variant_id: quantity for variant_id, (absolute, quantity) in changes.items() if not absolute
+            }, increment=True))
+            quantities = {variant_id: item.quantity for variant_id, item in lines.items()}
+            reserve_many(cart, {**quantities, **dict.fromkeys(removed, 0)}, variants)
+        return cart
+
+    def line_saved(self, user, item):
+        """Keep the line's stock reservation in step with its quantity"""
+        reserve(item.cart, item.variant, item.quantity)
+
+    def line_removed(self, user, item):
+        release(item.cart_id, [item.variant_id])
+
+    def clear(self, user):
+        """Empty the cart and release its holds; False when the user has none"""
+        cart = Cart.objects.filter(user=user).first()
+        if cart is None:
+            return False
+        cart.items.all().delete()
+        release(cart)
+        return True
+
+    def checked_out(self, user):
+        """Empty the cart once ordered (checkout consumed its holds)"""
+        CartItem.objects.filter(cart__user=user).delete()
+
+    def persist(self, user):
+        return None
+
+    def persist_dirty(self, batch_size=500):
+        return 0
+
+
+def line_totals(items):
+    """Cart.totals of lines already in memory"""
+    return {
+        'total_amount': sum((item.total_price for item in items if item.variant.price is not None), Decimal('0.00')),
+        'total_items': sum(item.quantity for item in items),
+    }
+
+
+class LocalHashes:
+    """Process-local stand-in for the few Redis hash and set commands used"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._data.get(key, {}))
+
+    def hexists(self, key, field):
+        with self._lock:
+            return field in self._data.get(key, {})
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        values = dict(mapping or {})
+        if field is not None:
+            values[field] = value
+        with self._lock:
+            self._data.setdefault(key, {}).update({name: str(value) for name, value in values.items()})
+        return len(values)
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            fields = self._data.setdefault(key, {})
+            fields[field] = str(int(fields.get(field, 0)) + amount)
+            return int(fields[field])
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            data = self._data.get(key, {})
+            return sum(data.pop(field, None) is not None for field in fields)
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def expire(self, key, seconds):
+        # Never evicts; carts live as long as the process
+        return key in self._data
+
+    def sadd(self, key, *members):
+        with self._lock:
+            self._data.setdefault(key, set()).update(members)
+
+    def srem(self, key, *members):
+        with self._lock:
+            data = self._data.get(key, set())
+            return sum(member in data and not data.discard(member) for member in members)
+
+    def spop(self, key, count):
+        with self._lock:
+            members = self._data.get(key, set())
+            return [members.pop() for _ in range(min(count, len(members)))]
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_hashes = LocalHashes()
+
+
+def redis_client():
+    """Raw connection of the Redis cache, or the local stand-in"""
+    if settings.CACHES['default']['BACKEND'] == 'django_redis.cache.RedisCache':
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    return local_hashes
+
+
+def line_id(user_id, variant_id):
+    """Stable id of a cart line, so cached lines and their rows agree"""
+    return uuid.uuid5(uuid.NAMESPACE_OID, f'cart:{user_id}:{variant_id}')
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class RedisCartStore:
+    """
+    Carts as Redis hashes, written behind to Cart/CartItem rows.
+
+    A hash holds the LOADED marker once it mirrors the cart's rows, so an
+    evicted or never-cached cart is rebuilt from the database first.
+    """
+    holds_stock = False
+    LOADED = '_loaded'
+    DIRTY = 'carts:dirty'
+
+    def __init__(self, client=None):
+        self.client = client or redis_client()
+
+    def key(self, user_id):
+        return f'cart:{user_id}'
+
+    def cart(self, user):
+        # Cart reads stay out of the write path in this mode
+        return get_cart(user)
+
+    def exists(self, user):
+        return True
+
+    def loaded_cart(self, user):
+        """The cart with its items seeded from the hash, so serializing reads no rows"""
+        cart = self.cart(user)
+        items = self.items(user)
+        prefetch_related_objects(items, MAIN_IMAGES)
+        for item in items:
+            item.cart = cart
+        # The rows may lag the hash, so total the seeded lines instead
+        cart.totals = line_totals(items)
+        # Rendered by CartSerializer in place of the rows
+        cart.loaded_items = items
+        return cart
+
+    def quantities(self, user_id):
+        """{variant_id: quantity} of the cart, loading it from its rows if needed"""
+        key = self.key(user_id)
+        data = self.client.hgetall(key)
+        if not data:
+            data = {
+                str(variant_id): quantity
+                for variant_id, quantity in CartItem.objects.filter(cart__user_id=user_id).values_list(
+                    'variant_id', 'quantity'
+                )
+            }
+            self.client.hset(key, mapping={**data, self.LOADED: 1})
+            self.client.expire(key, settings.CART_CACHE_TTL)
+        return {
+            uuid.UUID(_text(variant_id)): int(quantity)
+            for variant_id, quantity in data.items()
+            if _text(variant_id) != self.LOADED and int(quantity) > 0
+        }
+
+    def items(self, user):
+        """Unsaved CartItem lines with their variant and product, in one query"""
+        quantities = self.quantities(user.pk)
+        variants = ProductVariant.objects.select_related('product').in_bulk(list(quantities))
+        return [
+            CartItem(id=line_id(user.pk, variant_id), variant=variants[variant_id], quantity=quantity)
+            for variant_id, quantity in quantities.items()
+            if variant_id in variants
+        ]
+
+    def touch(self, user_id):
+        """Queue the cart for write-behind and extend its lifetime"""
+        self.client.sadd(self.DIRTY, str(user_id))
+        self.client.expire(self.key(user_id), settings.CART_CACHE_TTL)
+
+    def add(self, user, variant, quantity):
+        key = self.key(user.pk)
+        if not self.client.hexists(key, self.LOADED):
+            self.quantities(user.pk)
+        total = self.client.hincrby(key, str(variant.pk), quantity)
+        self.touch(user.pk)
+        return CartItem(id=line_id(user.pk, variant.pk), variant=variant, quantity=total)
+
+    def apply(self, user, changes, variants):
+        """Apply folded changes (see fold_operations) to the hash"""
+        key = self.key(user.pk)
+        if not self.client.hexists(key, self.LOADED):
+            self.quantities(user.pk)
+        for variant_id, (absolute, quantity) in changes.items():
+            if not absolute:
+                self.client.hincrby(key, str(variant_id), quantity)
+            elif quantity:
+                self.client.hset(key, str(variant_id), quantity)
+            else:
+                self.client.hdel(key, str(variant_id))
+        self.touch(user.pk)
+
+    def line_saved(self, user, item):
+        # The row was written directly; mirror it without queueing a rewrite
+        self.quantities(user.pk)
+        self.client.hset(self.key(user.pk), str(item.variant_id), item.quantity)
+
+    def line_removed(self, user, item):
+        self.quantities(user.pk)
+        self.client.hdel(self.key(user.pk), str(item.variant_id))
+
+    def clear(self, user):
+        self.client.delete(self.key(user.pk))
+        self.client.hset(self.key(user.pk), self.LOADED, 1)
+        self.touch(user.pk)
+        return True
+
+    def checked_out(self, user):
+        self.clear(user)
+
+    def persist(self, user):
+        """Write the cart to its rows now, if it has unwritten changes"""
+        if self.client.srem(self.DIRTY, str(user.pk)):
+            try:
+                self.write(user.pk)
+            except Exception:
+                self.client.sadd(self.DIRTY, str(user.pk))
+                raise
+
+    def persist_dirty(self, batch_size=500):
+        """
+        Write a batch of changed carts to their rows; returns how many.
+
+        A cart that fails to write is logged and stays dirty, as do the ones
+        not reached if the batch is interrupted, so none is dropped.
+        """
+        user_ids = [_text(user_id) for user_id in self.client.spop(self.DIRTY, batch_size)]
+        failed = []
+        done = 0
+        try:
+            for user_id in user_ids:
+                try:
+                    self.write(user_id)
+                except Exception:
+                    logger.exception('Could not write the cart of user %s behind', user_id)
+                    failed.append(user_id)
+                done += 1
+        finally:
+            unwritten = failed + user_ids[done:]
+            if unwritten:
+                self.client.sadd(self.DIRTY, *unwritten)
+        return done - len(failed)
+
+    def write(self, user_id):
+        """Make the cart's CartItem rows match its hash"""
+        quantities = self.quantities(user_id)
+        with transaction.atomic():
+            cart = upsert_cart(CustomUser(pk=user_id))
+            # Lines of variants deleted since they were added are dropped
+            live = set(ProductVariant.objects.filter(pk__in=list(quantities)).values_list('pk', flat=True))
+            wanted = {
+                line_id(user_id, variant_id): (variant_id, quantity)
+                for variant_id, quantity in quantities.items()
+                if variant_id in live
+            }
+            current = dict(CartItem.objects.filter(cart=cart).values_list('id', 'quantity'))
+
+            CartItem.objects.filter(cart=cart).exclude(id__in=list(wanted)).delete()
+            CartItem.objects.bulk_create([
+                CartItem(id=item_id, cart=cart, variant_id=variant_id, quantity=quantity)
+                for item_id, (variant_id, quantity) in wanted.items()
+                if item_id not in current
+            ])
+            CartItem.objects.bulk_update([
+                CartItem(id=item_id, quantity=quantity)
+                for item_id, (_, quantity) in wanted.items()
+                if item_id in current and current[item_id] != quantity
+            ], ['quantity'])
+
+
+def fold_operations(operations):
+    """
+    Reduce ('add' | 'set' | 'remove', variant_id, quantity) operations,
+    applied in order, to {variant_id: (absolute, quantity)}: absolute
+    quantities replace the line, the others are added to it.
+    """
+    changes = {}
+    for op, variant_id, quantity in operations:
+        absolute, current = changes.get(variant_id, (False, 0))
+        if op == 'add':
+            changes[variant_id] = (absolute, current + quantity)
+        else:
+            changes[variant_id] = (True, quantity if op == 'set' else 0)
+    return changes
+
+
+def apply_operations(user, operations):
+    """
+    Apply a batch of cart operations through the active store; the batch
+    endpoint and the guest-cart merge both come through here.
+
+    Variants are fetched once; operations on unknown variants are skipped
+    and their ids returned. Raises InsufficientStock.
+    """
+    changes = fold_operations(operations)
+    variants = ProductVariant.objects.in_bulk(list(changes))
+    skipped = [variant_id for variant_id in changes if variant_id not in variants]
+    for variant_id in skipped:
+        del changes[variant_id]
+    if changes:
+        get_cart_store().apply(user, changes, variants)
+    return skipped
+
+
+def merge_guest_cart(user, lines):
+    """Add a guest cart's {variant_id: quantity} lines to the user's cart"""
+    return apply_operations(user, [('add', variant_id, quantity) for variant_id, quantity in lines.items()])
+
+
+class GuestCart:
+    """
+    Anonymous cart kept client-side in a signed token, rendered by CartSerializer.
+
+    The token (cookie or X-Guest-Cart header) maps variant ids to
+    quantities, so guests never write cart rows. It is merged into the
+    user's cart on their first cart request after logging in.
+    """
+    id = None
+    user = None
+    created_at = None
+    SALT = 'store.carts.guest'
+    COOKIE = 'guest_cart'
+    HEADER = 'X-Guest-Cart'
+
+    def __init__(self, lines, variants=None):
+        """Price `lines` ({variant_id: quantity}) with one variant query, unless `variants` are given"""
+        if variants is None:
+            variants = ProductVariant.objects.select_related('product').in_bulk(list(lines))
+        self.lines = {variant_id: quantity for variant_id, quantity in lines.items() if variant_id in variants}
+        self.items = [
+            CartItem(id=line_id('guest', variant_id), variant=variants[variant_id], quantity=quantity)
+            for variant_id, quantity in self.lines.items()
+        ]
+        prefetch_related_objects(self.items, MAIN_IMAGES)
+        self.totals = line_totals(self.items)
+
+    @property
+    def total_amount(self):
+        return self.totals['total_amount']
+
+    @property
+    def total_items(self):
+        return self.totals['total_items']
+
+    @classmethod
+    def token_of(cls, request):
+        return request.headers.get(cls.HEADER) or request.COOKIES.get(cls.COOKIE)
+
+    @classmethod
+    def read(cls, request):
+        """{variant_id: quantity} of the request's token ({} if missing, expired or tampered with)"""
+        token = cls.token_of(request)
+        if not token:
+            return {}
+        try:
+            data = signing.loads(token, salt=cls.SALT, max_age=settings.GUEST_CART_MAX_AGE)
+            return {uuid.UUID(hex=variant_id): int(quantity) for variant_id, quantity in data.items()}
+        except (signing.BadSignature, AttributeError, TypeError, ValueError):
+            return {}
+
+    @property
+    def token(self):
+        """Compact signed token of the lines"""
+        return signing.dumps(
+            {variant_id.hex: quantity for variant_id, quantity in self.lines.items()},
+            salt=self.SALT, compress=True
+        )
+
+
+def apply_changes(lines, changes):
+    """Apply folded changes (see fold_operations) to a {variant_id: quantity} cart"""
+    lines = dict(lines)
+    for variant_id, (absolute, quantity) in changes.items():
+        lines[variant_id] = quantity if absolute else lines.get(variant_id, 0) + quantity
+    return {variant_id: quantity for variant_id, quantity in lines.items() if quantity > 0}
+
+
+def claim_guest_cart(request):
+    """
+    Merge the request's guest cart into the signed-in user's cart, once.
+
+    Lines short of stock are dropped rather than failing the request.
+    Returns whether a cart was merged (so the caller can drop the cookie).
+    """
+    lines = GuestCart.read(request)
+    if not lines:
+        return False
+    digest = hashlib.sha256(GuestCart.token_of(request).encode('utf-8')).hexdigest()
+    # The same token may come back until the client drops it
+    if not cache.add(f'guest-cart:merged:{digest}', request.user.pk, settings.GUEST_CART_MAX_AGE):
+        return True
+    while lines:
+        try:
+            merge_guest_cart(request.user, lines)
+            break
+        except InsufficientStock as exc:
+            del lines[exc.variant.pk]
+    return True
+
+
+CART_STORES = {
+    'database': DatabaseCartStore,
+    'redis': RedisCartStore,
+}
+
+
+def get_cart_store():
+    return CART_STORES[settings.CART_STORE]()
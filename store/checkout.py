@@ -0,0 +1,274 @@
+"""
+Order placement.
+
+Checkout runs in one transaction: the variants are fetched in a single
+query and locked in id order (so concurrent checkouts cannot deadlock),
+items are bulk inserted and stock is decremented with one conditional
+F() update, so concurrent buyers can never oversell or lose an update.
+Stock held by the buyer's own cart (store.inventory) is turned into the sale.
+"""
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.lookups import GreaterThanOrEqual
+from rest_framework import serializers
+
+from .cache import bump_generation, product_namespace, PRODUCTS
+from .inventory import held_for, InsufficientStock, per_variant, stock_level, take_from_stripes
+from .models import InventoryReservation, Order, OrderItem, ProductSummary, ProductVariant
+from .tasks import dispatch_order_events
+
+
+def collect_quantities(items):
+    """Merge (variant_id, quantity) pairs, rejecting non-positive quantities"""
+    quantities = OrderedDict()
+    for variant_id, quantity in items:
+        if quantity is None or quantity <= 0:
+            raise serializers.ValidationError(f"Invalid quantity for variant {variant_id}")
+        quantities[variant_id] = quantities.get(variant_id, 0) + quantity
+    if not quantities:
+        raise serializers.ValidationError("Order must contain at least one item")
+    return quantities
+
+
+def lock_variants(variant_ids):
+    """
+    Fetch the variants (with their product), row-locking them in
+    deterministic id order. Striped variants are read without a lock:
+    their stock lives in stripes, which is the point of striping them.
+    """
+    variants = {
+        variant.id: variant
+        for variant in ProductVariant.objects.select_for_update(of=('self',)).select_related(
+            'product'
+        ).filter(id__in=variant_ids, stripe_count=0).order_by('id')
+    }
+    missing = [variant_id for variant_id in variant_ids if variant_id not in variants]
+    if missing:
+        variants.update(
+            (variant.id, variant)
+            for variant in ProductVariant.objects.select_related('product').filter(id__in=missing)
+        )
+    return variants
+
+
+def decrement_stock(variants, quantities, held=None):
+    """
+    Take quantities[variant_id] units off each locked variant in one UPDATE.
+
+    Units the buyer's cart holds (`held`) are converted into the sale; the
+    WHERE clause re-checks unheld stock per row, so a stale read can never
+    oversell: if any row falls short the whole order is rejected. Striped
+    variants are taken from one of their stripes instead.
+    """
+    striped = {variant_id for variant_id in quantities if variants[variant_id].is_striped}
+    for variant_id in striped:
+        variant = variants[variant_id]
+        try:
+            left = take_from_stripes(variant, quantities[variant_id])
+        except InsufficientStock as exc:
+            raise serializers.ValidationError(
+                f"Insufficient stock for {variant.product.name} - {variant.size}. "
+                f"Available: {exc.available}, Requested: {quantities[variant_id]}"
+            )
+        if left is not None:
+            # A stripe may have run dry, so the synced total is now known
+            variant.inventory_quantity = left
+
+    quantities = {variant_id: quantity for variant_id, quantity in quantities.items() if variant_id not in striped}
+    if not quantities:
+        return
+
+    requested = per_variant(quantities)
+    free = F('inventory_quantity') - F('reserved_quantity')
+    changes = {'inventory_quantity': F('inventory_quantity') - requested}
+    if held:
+        free = free + per_variant(held)
+        changes['reserved_quantity'] = Greatest(F('reserved_quantity') - per_variant(held), Value(0))
+
+    updated = ProductVariant.objects.filter(
+        GreaterThanOrEqual(free, requested), pk__in=list(quantities)
+    ).update(**changes)
+    if updated != len(quantities):
+        raise serializers.ValidationError("Insufficient stock for one or more items")
+    for variant_id, quantity in quantities.items():
+        variant = variants[variant_id]
+        variant.inventory_quantity -= quantity
+        variant.reserved_quantity = max(variant.reserved_quantity - (held or {}).get(variant_id, 0), 0)
+
+
+def stock_changed(variants):
+    """Refresh catalog data after set-based stock updates (which skip signals)"""
+    # Summaries only look at in-stock variants, so they change when one runs out
+    sold_out = {variant.product_id for variant in variants if variant.inventory_quantity <= 0}
+    ProductSummary.refresh(sold_out)
+    namespaces = [product_namespace(slug) for slug in {variant.product.slug for variant in variants}]
+    if sold_out:
+        # Listings read the summaries; other sales only move the product pages
+        namespaces.append(PRODUCTS)
+    transaction.on_commit(lambda: bump_generation(*namespaces))
+
+
+def check_lines(variants, quantities, available):
+    """
+    Validate an order's lines against locked variants and return its total.
+
+    `available` maps variant ids to the stock this order may take; None
+    (striped variants) leaves the check to the stripe decrement.
+    """
+    total_amount = Decimal('0.00')
+    for variant_id, quantity in quantities.items():
+        variant = variants.get(variant_id)
+        if variant is None:
+            raise serializers.ValidationError(f"Product variant {variant_id} does not exist")
+        if variant.price is None:
+            raise serializers.ValidationError(f"Price not set for {variant.product.name}")
+        stock = available.get(variant_id)
+        if stock is not None and stock < quantity:
+            raise serializers.ValidationError(
+                f"Insufficient stock for {variant.product.name} - {variant.size}. "
+                f"Available: {stock}, Requested: {quantity}"
+            )
+        total_amount += variant.price * quantity
+    return total_amount
+
+
+def order_items(order, variants, quantities):
+    return [
+        OrderItem(order=order, variant=variants[variant_id], quantity=quantity, price=variants[variant_id].price)
+        for variant_id, quantity in quantities.items()
+    ]
+
+
+def enqueue_order_events(orders, payment_method='card'):
+    """Queue one order-placed event for after the transaction commits"""
+    order_ids = [str(order.id) for order in orders]
+    if order_ids:
+        # robust: a broker outage must not fail an order that is already committed
+        transaction.on_commit(
+            lambda: dispatch_order_events.delay(order_ids, payment_method), robust=True
+        )
+
+
+def remember_items(order, items):
+    """Keep the rows just inserted on the order, so OrderSerializer renders them without a reload"""
+    order.loaded_items = items
+
+
+def place_order(user, shipping_address, phone, items, cart=None, payment_method='card'):
+    """
+    Create an order for `items` ((variant_id, quantity) pairs) atomically.
+
+    When `cart` is given its stock reservations on the ordered variants
+    count towards availability and are consumed by the sale. Side effects
+    (email, payment, alerts, analytics) run in Celery after commit.
+
+    Raises serializers.ValidationError (rolling everything back) when a
+    variant is missing, has no price or does not have enough stock.
+    """
+    quantities = collect_quantities(items)
+
+    with transaction.atomic():
+        variants = lock_variants(quantities)
+        held = held_for(cart, quantities)
+
+        total_amount = check_lines(variants, quantities, {
+            variant_id: None if variant.is_striped else variant.available_quantity + held.get(variant_id, 0)
+            for variant_id, variant in variants.items()
+        })
+
+        order = Order.objects.create(
+            user=user,
+            total_amount=total_amount,
+            shipping_address=shipping_address,
+            phone=phone
+        )
+        remember_items(order, OrderItem.objects.bulk_create(order_items(order, variants, quantities)))
+
+        decrement_stock(variants, quantities, held)
+        if held:
+            InventoryReservation.objects.filter(cart=cart, variant_id__in=list(held)).delete()
+        stock_changed([variants[variant_id] for variant_id in quantities])
+        enqueue_order_events([order], payment_method)
+
+    return order
+
+
+def place_orders(entries, batch_size=200):
+    """
+    Create many orders, `batch_size` per transaction.
+
+    `entries` are dicts with user, shipping_address, phone, items
+    ((variant_id, quantity) pairs) and optionally payment_method. Each batch locks its variants with one
+    query, allocates stock in memory in entry order, bulk inserts orders
+    and items and applies one set-based stock decrement. Returns one
+    result per entry: ('created', order) or ('failed', message).
+    """
+    results = []
+    for start in range(0, len(entries), batch_size):
+        batch = entries[start:start + batch_size]
+        try:
+            results.extend(place_batch(batch))
+        except serializers.ValidationError as exc:
+            # The batch rolled back; none of its orders exist
+            results.extend(('failed', f"Batch rolled back: {error_message(exc)}") for _ in batch)
+    return results
+
+
+def place_batch(entries):
+    outcomes = [None] * len(entries)
+    pending = []
+    for position, entry in enumerate(entries):
+        try:
+            pending.append((position, entry, collect_quantities(entry['items'])))
+        except serializers.ValidationError as exc:
+            outcomes[position] = ('failed', error_message(exc))
+
+    with transaction.atomic():
+        variants = lock_variants({variant_id for _, _, quantities in pending for variant_id in quantities})
+        remaining = {
+            variant_id: stock_level(variant) if variant.is_striped else variant.available_quantity
+            for variant_id, variant in variants.items()
+        }
+        orders, items, sold = [], [], {}
+        for position, entry, quantities in pending:
+            try:
+                total_amount = check_lines(variants, quantities, remaining)
+            except serializers.ValidationError as exc:
+                outcomes[position] = ('failed', error_message(exc))
+                continue
+            order = Order(
+                user=entry['user'],
+                total_amount=total_amount,
+                shipping_address=entry['shipping_address'],
+                phone=entry['phone']
+            )
+            orders.append(order)
+            items.extend(order_items(order, variants, quantities))
+            for variant_id, quantity in quantities.items():
+                remaining[variant_id] -= quantity
+                sold[variant_id] = sold.get(variant_id, 0) + quantity
+            outcomes[position] = ('created', order)
+
+        Order.objects.bulk_create(orders)
+        OrderItem.objects.bulk_create(items)
+        if sold:
+            decrement_stock(variants, sold)
+            stock_changed([variants[variant_id] for variant_id in sold])
+        by_method = {}
+        for position, entry, _ in pending:
+            if outcomes[position][0] == 'created':
+                by_method.setdefault(entry.get('payment_method', 'card'), []).append(outcomes[position][1])
+        for payment_method, placed in by_method.items():
+            enqueue_order_events(placed, payment_method)
+    return outcomes
+
+
+def error_message(exc):
+    detail = exc.detail
+    if isinstance(detail, list):
+        return ' '.join(str(message) for message in detail)
+    return str(detail)
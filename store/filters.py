@@ -1,19 +1,75 @@
 import django_filters
+from django.db.models import Exists, F, OuterRef
+from rest_framework import filters
 from .models import Product, ProductVariant
 
 class ProductFilter(django_filters.FilterSet):
+    """
+    Product filters. Variant predicates (price bounds, size, stock) are
+    combined into a single correlated EXISTS, so they must all hold for the
+    same variant and no join/DISTINCT is needed.
+    """
     name = django_filters.CharFilter(lookup_expr='icontains')
     category = django_filters.CharFilter(field_name='category__slug')
-    min_price = django_filters.NumberFilter(field_name='variants__price', lookup_expr='gte')
-    max_price = django_filters.NumberFilter(field_name='variants__price', lookup_expr='lte')
-    size = django_filters.CharFilter(field_name='variants__size')
-    in_stock = django_filters.BooleanFilter(method='filter_in_stock')
+    min_price = django_filters.NumberFilter(method='filter_variant')
+    max_price = django_filters.NumberFilter(method='filter_variant')
+    size = django_filters.CharFilter(method='filter_variant')
+    in_stock = django_filters.BooleanFilter(method='filter_variant')
+
+    # filter name -> ProductVariant lookup
+    variant_lookups = {
+        'min_price': 'price__gte',
+        'max_price': 'price__lte',
+        'size': 'size',
+        'in_stock': 'inventory_quantity__gt',
+    }
     
     class Meta:
         model = Product
         fields = ['name', 'category', 'status', 'min_price', 'max_price', 'size', 'in_stock']
-    
-    def filter_in_stock(self, queryset, name, value):
-        if value:
-            return queryset.filter(variants__inventory_quantity__gt=0).distinct()
+
+    def filter_variant(self, queryset, name, value):
+        # Collected and applied together in filter_queryset
         return queryset
+
+    def get_variant_conditions(self):
+        conditions = {}
+        for name, lookup in self.variant_lookups.items():
+            value = self.form.cleaned_data.get(name)
+            if value is None or value == '' or value is False:
+                continue
+            conditions[lookup] = 0 if name == 'in_stock' else value
+        return conditions
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        conditions = self.get_variant_conditions()
+        if list(conditions) == ['inventory_quantity__gt']:
+            # Stock on its own is answered by the summary row
+            return queryset.filter(summary__in_stock=True)
+        if conditions:
+            queryset = queryset.filter(Exists(
+                ProductVariant.objects.filter(product=OuterRef('pk'), **conditions)
+            ))
+        return queryset
+
+
+class ProductOrderingFilter(filters.OrderingFilter):
+    """
+    OrderingFilter that also understands `price` / `-price`, ordering by the
+    lowest / highest in-stock price kept on ProductSummary, and that ranks
+    search results by relevance when no ordering is given.
+    """
+    price_orderings = {
+        'price': F('summary__min_price').asc(nulls_last=True),
+        '-price': F('summary__max_price').desc(nulls_last=True),
+    }
+
+    def get_ordering(self, request, queryset, view):
+        params = request.query_params.get(self.ordering_param)
+        if params in self.price_orderings:
+            return [self.price_orderings[params], '-created_at']
+        if not params and 'search_rank' in queryset.query.annotations:
+            # Searches without an explicit ordering are ranked by relevance
+            return ['-search_rank', '-created_at']
+        return super().get_ordering(request, queryset, view)
@@ -0,0 +1,80 @@
+"""
+Idempotency-Key support for unsafe endpoints.
+
+The first request with a given key runs normally and its response is kept
+in the cache (Redis in production, local memory otherwise) for
+IDEMPOTENCY_KEY_TTL seconds. Retries with the same key replay that response
+without touching serializers, inventory or the database. Keys are scoped
+per user and endpoint; reusing one with a different body is rejected.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAY_HEADER = 'Idempotent-Replayed'
+# How long a claimed key blocks duplicates while its first request runs
+IN_FLIGHT_TIMEOUT = 60
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+class IdempotencyMixin:
+    """Wrap handlers with idempotent_response() to honour Idempotency-Key"""
+
+    def get_idempotency_cache_key(self, request, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return f'idempotency:{request.user.pk}:{self.basename}:{self.action}:{digest}'
+
+    def idempotent_response(self, handler, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return handler(request, *args, **kwargs)
+        if len(key) > 255:
+            return Response(
+                {'error': f'{IDEMPOTENCY_HEADER} must be at most 255 characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        cache_key = self.get_idempotency_cache_key(request, key)
+        fingerprint = request_fingerprint(request)
+        # add() is atomic: only one request can claim the key
+        if not cache.add(cache_key, {'fingerprint': fingerprint}, IN_FLIGHT_TIMEOUT):
+            return self.replay(cache.get(cache_key), fingerprint)
+
+        try:
+            response = handler(request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+
+        if response.status_code >= 500:
+            # Let the client retry server errors for real
+            cache.delete(cache_key)
+        else:
+            cache.set(cache_key, {
+                'fingerprint': fingerprint,
+                'status': response.status_code,
+                'data': response.data,
+            }, settings.IDEMPOTENCY_KEY_TTL)
+        return response
+
+    def replay(self, stored, fingerprint):
+        if stored is None or 'status' not in stored:
+            return Response(
+                {'error': 'A request with this Idempotency-Key is still being processed'},
+                status=status.HTTP_409_CONFLICT
+            )
+        if stored['fingerprint'] != fingerprint:
+            return Response(
+                {'error': 'Idempotency-Key was already used with a different request body'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        return Response(stored['data'], status=stored['status'], headers={REPLAY_HEADER: 'true'})
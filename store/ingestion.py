@@ -0,0 +1,58 @@
+"""
+Bulk order ingestion for partner channels (see OrderViewSet.bulk and the
+import_orders management command).
+"""
+from .checkout import place_orders
+from .models import CustomUser
+from .serializers import BulkOrderEntrySerializer
+
+
+def ingest_orders(payloads, default_user, batch_size=200):
+    """
+    Validate and create `payloads` (order dicts), reporting per order.
+
+    Customers named by customer_email are resolved with one query; orders
+    without one belong to `default_user`. Returns one dict per payload, in
+    order, with its index, reference, status and order_id or errors.
+    """
+    results = [None] * len(payloads)
+    valid = []
+    for index, payload in enumerate(payloads):
+        serializer = BulkOrderEntrySerializer(data=payload)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = failed(index, payload, serializer.errors)
+
+    emails = {data['customer_email'] for _, data in valid if data.get('customer_email')}
+    customers = {user.email: user for user in CustomUser.objects.filter(email__in=emails)} if emails else {}
+
+    entries = []
+    for index, data in valid:
+        email = data.get('customer_email')
+        if email and email not in customers:
+            results[index] = failed(index, data, {'customer_email': [f"No customer with email {email}"]})
+            continue
+        entries.append((index, data, {
+            'user': customers[email] if email else default_user,
+            'shipping_address': data['shipping_address'],
+            'phone': data['phone'],
+            'items': [(item['variant_id'], item['quantity']) for item in data['items']],
+            'payment_method': data['payment_method'],
+        }))
+
+    outcomes = place_orders([entry for _, _, entry in entries], batch_size=batch_size)
+    for (index, data, _), (outcome, value) in zip(entries, outcomes):
+        if outcome == 'created':
+            results[index] = {
+                'index': index, 'reference': data.get('reference'),
+                'status': 'created', 'order_id': str(value.id)
+            }
+        else:
+            results[index] = failed(index, data, {'non_field_errors': [value]})
+    return results
+
+
+def failed(index, payload, errors):
+    reference = payload.get('reference') if isinstance(payload, dict) else None
+    return {'index': index, 'reference': reference, 'status': 'failed', 'errors': errors}
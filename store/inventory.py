@@ -0,0 +1,359 @@
+"""
+Inventory primitives: cart reservations and striped stock.
+
+Adding to a cart places a time-limited hold on the variant. Holds are
+counted in ProductVariant.reserved_quantity, so available stock is a
+column subtraction rather than an aggregate over holds. Checkout turns a
+cart's holds into a sale and the release_expired_reservations task hands
+expired holds back in bulk.
+
+Striped variants (stripe_count > 0) keep their stock in InventoryStripe
+rows instead, so a flash sale on one SKU does not serialise on its row.
+They are sold first come, first served at checkout and take no holds.
+
+Locks are always taken on variant rows (in id order) before their holds,
+as checkout does, so buyers, carts and the sweeper cannot deadlock.
+"""
+import random
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.lookups import GreaterThanOrEqual
+from django.utils import timezone
+
+from .cache import bump_generation, product_namespace, PRODUCTS
+from .models import InventoryReservation, InventoryStripe, ProductSummary, ProductVariant
+
+
+class InsufficientStock(Exception):
+    def __init__(self, variant, available):
+        self.variant = variant
+        self.available = available
+        super().__init__(f"Only {available} of {variant} available")
+
+
+def reservation_expiry(now=None):
+    return (now or timezone.now()) + timedelta(seconds=settings.CART_RESERVATION_TTL)
+
+
+def per_variant(quantities, field='pk'):
+    """CASE expression mapping variant ids (in `field`) to quantities (0 for any other row)"""
+    return Case(
+        *[When(**{field: variant_id}, then=Value(quantity)) for variant_id, quantity in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField()
+    )
+
+
+def lock_variant_rows(variant_ids, skip_locked=False):
+    """Row-lock variants (ids or a subquery of them) in id order; returns the locked ids"""
+    return set(
+        ProductVariant.objects.select_for_update(skip_locked=skip_locked).filter(pk__in=variant_ids)
+        .order_by('pk').values_list('pk', flat=True)
+    )
+
+
+def holds_changed(variant_ids):
+    """
+    Available stock is shown on product pages but not in listings, so only
+    the pages of the variants' products are invalidated, on commit.
+    """
+    variant_ids = list(variant_ids)
+
+    def bump():
+        slugs = ProductVariant.objects.filter(pk__in=variant_ids).values_list('product__slug', flat=True).distinct()
+        bump_generation(*(product_namespace(slug) for slug in slugs))
+
+    transaction.on_commit(bump)
+
+
+def adjust_reserved(deltas):
+    """Apply {variant_id: delta} to reserved_quantity in one UPDATE"""
+    deltas = {variant_id: delta for variant_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    ProductVariant.objects.filter(pk__in=list(deltas)).update(
+        reserved_quantity=Greatest(F('reserved_quantity') + per_variant(deltas), Value(0))
+    )
+    holds_changed(deltas)
+
+
+def claim(variant_id, quantity):
+    """Reserve `quantity` more units if that many are free; False otherwise"""
+    claimed = bool(ProductVariant.objects.filter(
+        GreaterThanOrEqual(F('inventory_quantity') - F('reserved_quantity'), quantity),
+        pk=variant_id
+    ).update(reserved_quantity=F('reserved_quantity') + quantity))
+    if claimed:
+        holds_changed([variant_id])
+    return claimed
+
+
+def release_rows(rows):
+    """Delete (pk, variant_id, quantity) holds and return their units to stock"""
+    if not rows:
+        return 0
+    deltas = defaultdict(int)
+    for _, variant_id, quantity in rows:
+        deltas[variant_id] -= quantity
+    InventoryReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+    adjust_reserved(deltas)
+    return len(rows)
+
+
+def reserve(cart, variant, quantity):
+    """
+    Hold `quantity` units of `variant` for `cart`, replacing its current hold.
+
+    Raises InsufficientStock (leaving the current hold untouched) when not
+    enough unheld stock is left. Striped variants are never held.
+    """
+    if quantity <= 0 or variant.is_striped:
+        return release(cart, [variant.pk])
+
+    now = timezone.now()
+    with transaction.atomic():
+        lock_variant_rows([variant.pk])
+        hold = InventoryReservation.objects.select_for_update().filter(cart=cart, variant=variant).first()
+        if hold is not None and hold.expires_at <= now:
+            # Our own hold lapsed: hand it back before claiming afresh
+            release_rows([(hold.pk, variant.pk, hold.quantity)])
+            hold = None
+        held = hold.quantity if hold else 0
+
+        delta = quantity - held
+        if delta > 0 and not claim(variant.pk, delta):
+            # Lapsed holds of other carts may still be counted; free them and retry
+            if not release_expired(now=now, variant_ids=[variant.pk]) or not claim(variant.pk, delta):
+                variant.refresh_from_db(fields=['inventory_quantity', 'reserved_quantity'])
+                raise InsufficientStock(variant, variant.available_quantity + held)
+        elif delta < 0:
+            adjust_reserved({variant.pk: delta})
+
+        if hold is None:
+            hold = InventoryReservation.objects.create(
+                cart=cart, variant=variant, quantity=quantity, expires_at=reservation_expiry(now)
+            )
+        else:
+            hold.quantity = quantity
+            hold.expires_at = reservation_expiry(now)
+            hold.save(update_fields=['quantity', 'expires_at'])
+    return hold
+
+
+def claim_many(deltas):
+    """Reserve {variant_id: quantity} more units in one UPDATE if all are free; False otherwise"""
+    if not deltas:
+        return True
+    with transaction.atomic():
+        claimed = ProductVariant.objects.filter(
+            GreaterThanOrEqual(F('inventory_quantity') - F('reserved_quantity'), per_variant(deltas)),
+            pk__in=list(deltas)
+        ).update(reserved_quantity=F('reserved_quantity') + per_variant(deltas))
+        if claimed < len(deltas):
+            # Some variant fell short: undo the claims that went through
+            transaction.set_rollback(True)
+    if claimed == len(deltas):
+        holds_changed(deltas)
+    return claimed == len(deltas)
+
+
+def reserve_many(cart, quantities, variants):
+    """
+    Set the cart's holds on several variants at once; reserve() in bulk.
+
+    `quantities` maps variant ids to the wanted hold (0 drops it) and
+    `variants` holds their instances. All or nothing: raises InsufficientStock
+    for a variant short of stock, leaving every hold untouched.
+    """
+    quantities = {
+        variant_id: quantity for variant_id, quantity in quantities.items()
+        if not variants[variant_id].is_striped
+    }
+    if not quantities:
+        return
+
+    now = timezone.now()
+    with transaction.atomic():
+        lock_variant_rows(list(quantities))
+        holds = {
+            hold.variant_id: hold
+            for hold in InventoryReservation.objects.select_for_update().filter(cart=cart, variant_id__in=list(quantities))
+        }
+        lapsed = [hold for hold in holds.values() if hold.expires_at <= now]
+        # Our own lapsed holds: hand them back before claiming afresh
+        release_rows([(hold.pk, hold.variant_id, hold.quantity) for hold in lapsed])
+        for hold in lapsed:
+            del holds[hold.variant_id]
+
+        deltas = {
+            variant_id: quantity - (holds[variant_id].quantity if variant_id in holds else 0)
+            for variant_id, quantity in quantities.items()
+        }
+        wanted = {variant_id: delta for variant_id, delta in deltas.items() if delta > 0}
+        if not claim_many(wanted):
+            # Lapsed holds of other carts may still be counted; free them and retry
+            if not release_expired(now=now, variant_ids=list(wanted)) or not claim_many(wanted):
+                free = dict(ProductVariant.objects.filter(pk__in=list(wanted)).values_list(
+                    'pk', F('inventory_quantity') - F('reserved_quantity')
+                ))
+                # The first variant short of stock (any, if a concurrent claim has since been released)
+                variant_id = next((pk for pk in wanted if free.get(pk, 0) < wanted[pk]), next(iter(wanted)))
+                held = holds[variant_id].quantity if variant_id in holds else 0
+                raise InsufficientStock(variants[variant_id], free.get(variant_id, 0) + held)
+        adjust_reserved({variant_id: delta for variant_id, delta in deltas.items() if delta < 0})
+
+        InventoryReservation.objects.filter(
+            pk__in=[hold.pk for variant_id, hold in holds.items() if not quantities[variant_id]]
+        ).delete()
+        kept = [hold for variant_id, hold in holds.items() if quantities[variant_id]]
+        for hold in kept:
+            hold.quantity = quantities[hold.variant_id]
+            hold.expires_at = reservation_expiry(now)
+        InventoryReservation.objects.bulk_update(kept, ['quantity', 'expires_at'])
+        InventoryReservation.objects.bulk_create([
+            InventoryReservation(cart=cart, variant_id=variant_id, quantity=quantity, expires_at=reservation_expiry(now))
+            for variant_id, quantity in quantities.items()
+            if quantity and variant_id not in holds
+        ])
+
+
+def release(cart, variant_ids=None):
+    """Give back the cart's holds (all of them, or those on `variant_ids`)"""
+    holds = InventoryReservation.objects.filter(cart=cart)
+    if variant_ids is not None:
+        holds = holds.filter(variant_id__in=variant_ids)
+    with transaction.atomic():
+        lock_variant_rows(holds.values('variant_id'))
+        return release_rows(list(holds.select_for_update().values_list('pk', 'variant_id', 'quantity')))
+
+
+def release_expired(now=None, variant_ids=None, batch_size=1000):
+    """Release lapsed holds in batches; returns how many were released"""
+    now = now or timezone.now()
+    expired = InventoryReservation.objects.filter(expires_at__lte=now)
+    if variant_ids is not None:
+        expired = expired.filter(variant_id__in=variant_ids)
+
+    released = 0
+    while True:
+        with transaction.atomic():
+            batch = list(expired.order_by('expires_at').values_list('pk', flat=True)[:batch_size])
+            # Concurrent sweepers (and checkouts) skip each other's variants and holds
+            locked = lock_variant_rows(expired.filter(pk__in=batch).values('variant_id'), skip_locked=True)
+            rows = list(
+                expired.select_for_update(skip_locked=True).filter(pk__in=batch, variant_id__in=locked)
+                .values_list('pk', 'variant_id', 'quantity')
+            )
+            released += release_rows(rows)
+        if len(rows) < batch_size:
+            return released
+
+
+def held_for(cart, variant_ids):
+    """Lock and return {variant_id: quantity} of the cart's holds on `variant_ids`"""
+    if cart is None:
+        return {}
+    return dict(
+        InventoryReservation.objects.select_for_update()
+        .filter(cart=cart, variant_id__in=variant_ids)
+        .values_list('variant_id', 'quantity')
+    )
+
+
+def stock_level(variant):
+    """Exact stock of a variant: the stripe sum when striped"""
+    if not variant.is_striped:
+        return variant.inventory_quantity
+    return InventoryStripe.objects.filter(variant=variant).aggregate(total=Coalesce(Sum('quantity'), 0))['total']
+
+
+def sync_striped_total(variant_ids):
+    """Mirror the stripe sums into inventory_quantity so catalog reads stay valid"""
+    totals = InventoryStripe.objects.filter(variant=OuterRef('pk')).values('variant').annotate(
+        total=Sum('quantity')
+    ).values('total')
+    ProductVariant.objects.filter(pk__in=variant_ids).update(
+        inventory_quantity=Coalesce(Subquery(totals), Value(0))
+    )
+
+
+def take_from_stripes(variant, quantity):
+    """
+    Take `quantity` units off a striped variant; returns the stock left if
+    a stripe may have run dry (after syncing the total), else None.
+
+    A random stripe with enough stock is decremented with a conditional
+    update. If stock is too fragmented for any single stripe, the stripes
+    are locked and drained in index order.
+    """
+    candidates = list(
+        InventoryStripe.objects.filter(variant=variant, quantity__gte=quantity).values_list('index', 'quantity')
+    )
+    random.shuffle(candidates)
+    for index, seen in candidates:
+        taken = InventoryStripe.objects.filter(
+            variant=variant, index=index, quantity__gte=quantity
+        ).update(quantity=F('quantity') - quantity)
+        if taken:
+            if seen - quantity > 0:
+                return None
+            break
+    else:
+        stripes = list(InventoryStripe.objects.select_for_update().filter(variant=variant).order_by('index'))
+        if sum(stripe.quantity for stripe in stripes) < quantity:
+            raise InsufficientStock(variant, sum(stripe.quantity for stripe in stripes))
+        remaining = quantity
+        for stripe in stripes:
+            taken = min(stripe.quantity, remaining)
+            stripe.quantity -= taken
+            remaining -= taken
+        InventoryStripe.objects.bulk_update(stripes, ['quantity'])
+
+    sync_striped_total([variant.pk])
+    return ProductVariant.objects.values_list('inventory_quantity', flat=True).get(pk=variant.pk)
+
+
+def rebalance_stripes(variant, stripe_count=None, stock=None):
+    """
+    Spread a variant's stock evenly over `stripe_count` stripes.
+
+    `stripe_count` defaults to the variant's current setting and 0 folds
+    the stripes back into inventory_quantity. `stock` replaces the total
+    (restocking); otherwise the current stripe sum is redistributed.
+    """
+    with transaction.atomic():
+        variant = ProductVariant.objects.select_for_update(of=('self',)).select_related('product').get(pk=variant.pk)
+        stripes = InventoryStripe.objects.select_for_update().filter(variant=variant)
+        if stock is None:
+            stock = (
+                sum(stripes.values_list('quantity', flat=True))
+                if variant.is_striped else variant.inventory_quantity
+            )
+        stripe_count = variant.stripe_count if stripe_count is None else stripe_count
+        if stripe_count:
+            # Striped stock is not held; give any open holds back
+            release_rows(list(
+                InventoryReservation.objects.select_for_update().filter(variant=variant)
+                .values_list('pk', 'variant_id', 'quantity')
+            ))
+
+        stripes.delete()
+        share, extra = divmod(stock, stripe_count) if stripe_count else (0, 0)
+        InventoryStripe.objects.bulk_create([
+            InventoryStripe(variant=variant, index=index, quantity=share + (index < extra))
+            for index in range(stripe_count)
+        ])
+        ProductVariant.objects.filter(pk=variant.pk).update(stripe_count=stripe_count, inventory_quantity=stock)
+        # update() skips the signals that keep listings in sync
+        ProductSummary.refresh([variant.product_id])
+        namespaces = [product_namespace(variant.product.slug)]
+        if (variant.inventory_quantity > 0) != (stock > 0):
+            # Listings only change when the variant runs out or comes back
+            namespaces.append(PRODUCTS)
+        transaction.on_commit(lambda: bump_generation(*namespaces))
+    return stock
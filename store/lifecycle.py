@@ -0,0 +1,97 @@
+"""
+Order lifecycle: allowed status transitions, applied in bulk.
+
+Each batch of orders is locked and read with one query, moved with one
+UPDATE ... WHERE status IN (allowed sources) and journalled with one bulk
+insert of OrderStatusEvent rows. Orders whose current status does not allow
+the transition are reported back rather than raising. Cancelling returns
+the orders' stock with one set-based update.
+"""
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .cache import bump_generation, PRODUCTS
+from .inventory import per_variant, sync_striped_total
+from .models import InventoryStripe, Order, OrderItem, OrderStatusEvent, ProductSummary, ProductVariant
+
+TRANSITIONS = {
+    'pending': {'processing', 'cancelled'},
+    'processing': {'shipped', 'cancelled'},
+    'shipped': {'delivered'},
+    'delivered': set(),
+    'cancelled': set(),
+}
+
+TransitionResult = namedtuple('TransitionResult', ['updated', 'ineligible', 'missing'])
+
+
+def sources_for(target):
+    """Statuses an order may move to `target` from"""
+    return sorted(status for status, targets in TRANSITIONS.items() if target in targets)
+
+
+def transition_orders(order_ids, target, actor=None, note='', batch_size=1000):
+    """
+    Move `order_ids` (UUIDs) to `target` status, `batch_size` orders per
+    transaction.
+
+    Returns a TransitionResult: the number of orders moved, {order_id:
+    current status} for orders that may not make the transition, and ids
+    that do not exist.
+    """
+    if target not in TRANSITIONS:
+        raise ValueError(f"Unknown order status {target!r}")
+    sources = sources_for(target)
+    order_ids = list(dict.fromkeys(order_ids))
+
+    updated = 0
+    ineligible = {}
+    missing = []
+    for start in range(0, len(order_ids), batch_size):
+        batch = order_ids[start:start + batch_size]
+        with transaction.atomic():
+            current = dict(Order.objects.select_for_update().filter(pk__in=batch).values_list('pk', 'status'))
+            eligible = {pk: status for pk, status in current.items() if status in sources}
+            ineligible.update((pk, status) for pk, status in current.items() if pk not in eligible)
+            missing.extend(pk for pk in batch if pk not in current)
+            if not eligible:
+                continue
+
+            updated += Order.objects.filter(pk__in=list(eligible), status__in=sources).update(
+                status=target, updated_at=timezone.now()
+            )
+            OrderStatusEvent.objects.bulk_create([
+                OrderStatusEvent(order_id=pk, from_status=status, to_status=target, actor=actor, note=note)
+                for pk, status in eligible.items()
+            ])
+            if target == 'cancelled':
+                restock(list(eligible))
+    return TransitionResult(updated, ineligible, missing)
+
+
+def restock(order_ids):
+    """Return cancelled orders' units to stock with one update per storage kind"""
+    sold = dict(
+        OrderItem.objects.filter(order_id__in=order_ids).order_by().values('variant_id')
+        .annotate(units=Sum('quantity')).values_list('variant_id', 'units')
+    )
+    if not sold:
+        return
+    striped = set(ProductVariant.objects.filter(pk__in=list(sold), stripe_count__gt=0).values_list('pk', flat=True))
+    plain = {variant_id: units for variant_id, units in sold.items() if variant_id not in striped}
+    if plain:
+        ProductVariant.objects.filter(pk__in=list(plain)).update(
+            inventory_quantity=F('inventory_quantity') + per_variant(plain)
+        )
+    if striped:
+        InventoryStripe.objects.filter(variant_id__in=striped, index=0).update(
+            quantity=F('quantity') + per_variant({variant_id: sold[variant_id] for variant_id in striped}, 'variant_id')
+        )
+        sync_striped_total(striped)
+
+    # update() skips the signals that keep listings in sync
+    ProductSummary.refresh(set(ProductVariant.objects.filter(pk__in=list(sold)).values_list('product_id', flat=True)))
+    transaction.on_commit(lambda: bump_generation(PRODUCTS))
@@ -0,0 +1,120 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+from rest_framework import serializers
+
+from store.checkout import place_order
+from store.inventory import rebalance_stripes, stock_level
+from store.models import Category, CustomUser, Order, Product, ProductSummary, ProductVariant
+
+BENCH_PREFIX = 'bench-checkout'
+
+
+def legacy_checkout(user, variant_id, quantity):
+    """The previous read-check-save checkout, which loses concurrent updates"""
+    variant = ProductVariant.objects.get(id=variant_id)
+    if variant.inventory_quantity < quantity:
+        raise serializers.ValidationError("Insufficient stock")
+    order = Order.objects.create(
+        user=user, total_amount=variant.price * quantity,
+        shipping_address='Benchmark', phone='000'
+    )
+    order.items.create(variant=variant, quantity=quantity, price=variant.price)
+    variant.inventory_quantity -= quantity
+    variant.save()
+    return order
+
+
+class Command(BaseCommand):
+    help = (
+        "Race concurrent buyers for one hot SKU through the legacy and the locked "
+        "checkout paths (and striped inventory with --stripes) and report oversells "
+        "and throughput. Run it against PostgreSQL: SQLite serialises writers and "
+        "does not support row locks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=50)
+        parser.add_argument('--stock', type=int, default=20)
+        parser.add_argument('--quantity', type=int, default=1)
+        parser.add_argument(
+            '--stripes', default='', help='Comma-separated stripe counts to compare, e.g. 4,16,64'
+        )
+
+    def handle(self, *args, **options):
+        user, _ = CustomUser.objects.get_or_create(
+            username=BENCH_PREFIX, defaults={'email': f'{BENCH_PREFIX}@example.com'}
+        )
+        stripe_counts = [int(count) for count in options['stripes'].split(',') if count.strip()]
+        runs = [
+            ('legacy read/save', legacy_checkout, 0),
+            ('locked + conditional F()', self.locked_checkout, 0),
+        ] + [(f'{count} stripes', self.locked_checkout, count) for count in stripe_counts]
+        try:
+            for label, checkout, stripes in runs:
+                self.report(label, checkout, user, stripes, options)
+        finally:
+            Order.objects.filter(user=user).delete()
+            Product.objects.filter(slug__startswith=BENCH_PREFIX).delete()
+            Category.objects.filter(slug=BENCH_PREFIX).delete()
+            user.delete()
+
+    @staticmethod
+    def locked_checkout(user, variant_id, quantity):
+        return place_order(user, 'Benchmark', '000', [(variant_id, quantity)])
+
+    def report(self, label, checkout, user, stripes, options):
+        variant = self.hot_variant(options['stock'], stripes)
+        results = {'sold': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        start_gate = threading.Barrier(options['buyers'])
+
+        def buyer():
+            start_gate.wait()
+            try:
+                checkout(user, variant.id, options['quantity'])
+                outcome = 'sold'
+            except serializers.ValidationError:
+                outcome = 'rejected'
+            except DatabaseError:
+                outcome = 'errors'
+            finally:
+                connection.close()
+            with lock:
+                results[outcome] += 1
+
+        threads = [threading.Thread(target=buyer) for _ in range(options['buyers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        variant.refresh_from_db()
+        units_sold = results['sold'] * options['quantity']
+        oversold = units_sold - options['stock']
+        self.stdout.write(
+            f"{label}\n"
+            f"  orders: {results['sold']} sold, {results['rejected']} rejected, {results['errors']} db errors "
+            f"in {elapsed * 1000:.0f} ms ({options['buyers'] / elapsed:.0f} checkouts/s)\n"
+            f"  stock left: {stock_level(variant)}, units sold: {units_sold}, "
+            f"oversold: {max(oversold, 0)}"
+        )
+
+    def hot_variant(self, stock, stripes):
+        category, _ = Category.objects.get_or_create(slug=BENCH_PREFIX, defaults={'name': BENCH_PREFIX})
+        product = Product.objects.create(
+            name='Bench hot product', slug=f'{BENCH_PREFIX}-{time.monotonic_ns()}',
+            description='Synthetic benchmark product', category=category, status='active'
+        )
+        variant = ProductVariant.objects.create(
+            product=product, size='M', price=Decimal('10.00'), inventory_quantity=stock
+        )
+        if stripes:
+            rebalance_stripes(variant, stripes)
+        ProductSummary.refresh([product.pk])
+        return variant
@@ -0,0 +1,104 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.filters import ProductFilter
+from store.models import Category, Product, ProductSummary, ProductVariant
+
+BENCH_PREFIX = 'bench-filter'
+
+
+def legacy_filter(queryset, params):
+    """The previous join-per-predicate + DISTINCT implementation, for comparison"""
+    if 'min_price' in params:
+        queryset = queryset.filter(variants__price__gte=params['min_price'])
+    if 'max_price' in params:
+        queryset = queryset.filter(variants__price__lte=params['max_price'])
+    if 'size' in params:
+        queryset = queryset.filter(variants__size=params['size'])
+    if params.get('in_stock') == 'true':
+        queryset = queryset.filter(variants__inventory_quantity__gt=0)
+    return queryset.distinct()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare ProductFilter (single EXISTS) against the old join + DISTINCT "
+        "filtering. Use --seed to create a synthetic catalog first."
+    )
+
+    cases = [
+        {'min_price': '20', 'max_price': '40'},
+        {'size': 'M', 'in_stock': 'true'},
+        {'size': 'XL', 'min_price': '50', 'max_price': '60', 'in_stock': 'true'},
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help='Create the benchmark catalog')
+        parser.add_argument('--variants', type=int, default=1_000_000)
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--cleanup', action='store_true', help='Delete the benchmark catalog and exit')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            Product.objects.filter(slug__startswith=BENCH_PREFIX).delete()
+            Category.objects.filter(slug=BENCH_PREFIX).delete()
+            self.stdout.write(self.style.SUCCESS("Benchmark catalog removed"))
+            return
+        if options['seed']:
+            self.seed(options['variants'])
+
+        base = Product.objects.filter(status='active', slug__startswith=BENCH_PREFIX)
+        for params in self.cases:
+            legacy_ms, legacy_count = self.time(lambda: legacy_filter(base, params), options['runs'])
+            exists_ms, exists_count = self.time(
+                lambda: ProductFilter(params, queryset=base).qs, options['runs']
+            )
+            self.stdout.write(
+                f"{params}\n"
+                f"  join + DISTINCT: {legacy_ms:9.1f} ms  ({legacy_count} products)\n"
+                f"  single EXISTS:   {exists_ms:9.1f} ms  ({exists_count} products)"
+            )
+
+    def time(self, build, runs):
+        """Median time of what a listing does: a count plus the first page"""
+        timings = []
+        count = 0
+        for _ in range(runs):
+            start = time.perf_counter()
+            queryset = build()
+            count = queryset.count()
+            list(queryset.order_by('-created_at').values_list('pk', flat=True)[:12])
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), count
+
+    def seed(self, variant_count):
+        sizes = [size for size, _ in ProductVariant.SIZE_CHOICES]
+        category, _ = Category.objects.get_or_create(slug=BENCH_PREFIX, defaults={'name': BENCH_PREFIX})
+        product_count = variant_count // len(sizes)
+        rng = random.Random(42)
+        batch = 5000
+
+        for start in range(0, product_count, batch):
+            with transaction.atomic():
+                products = Product.objects.bulk_create([
+                    Product(
+                        name=f'Bench product {i}', slug=f'{BENCH_PREFIX}-{i}',
+                        description='Synthetic benchmark product', category=category, status='active'
+                    )
+                    for i in range(start, min(start + batch, product_count))
+                ])
+                ProductVariant.objects.bulk_create([
+                    ProductVariant(
+                        product=product, size=size,
+                        price=Decimal(rng.randrange(500, 10000)) / 100,
+                        inventory_quantity=rng.choice([0, 0, 1, 5, 20]),
+                    )
+                    for product in products for size in sizes
+                ])
+                ProductSummary.refresh([product.pk for product in products])
+            self.stdout.write(f"Seeded {min(start + batch, product_count) * len(sizes)} variants")
@@ -0,0 +1,43 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.ingestion import ingest_orders
+from store.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Import orders from a JSON file (a list of orders, or {\"orders\": [...]}; "
+        "'-' reads stdin). Orders without customer_email belong to --user."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help='Email of the default order owner')
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        try:
+            owner = CustomUser.objects.get(email=options['user'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"No user with email {options['user']}")
+
+        if options['path'] == '-':
+            payload = json.load(sys.stdin)
+        else:
+            with open(options['path']) as handle:
+                payload = json.load(handle)
+        orders = payload.get('orders') if isinstance(payload, dict) else payload
+        if not isinstance(orders, list):
+            raise CommandError("Expected a list of orders")
+
+        results = ingest_orders(orders, owner, batch_size=options['batch_size'])
+        failures = [result for result in results if result['status'] == 'failed']
+        for result in failures:
+            label = result['reference'] or f"#{result['index']}"
+            self.stderr.write(f"{label}: {json.dumps(result['errors'])}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {len(results) - len(failures)} orders, {len(failures)} failed"
+        ))
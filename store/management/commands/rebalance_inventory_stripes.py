@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.inventory import rebalance_stripes
+from store.models import ProductVariant
+
+
+class Command(BaseCommand):
+    help = (
+        "Spread striped variants' stock evenly over their stripes. With --stripes, "
+        "enable (N > 0) or disable (0) striping for the given variants; with --stock, "
+        "restock them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--variant', action='append', default=[], help='Variant id (repeatable)')
+        parser.add_argument('--stripes', type=int, help='New stripe count (0 folds the stripes back)')
+        parser.add_argument('--stock', type=int, help='New total stock')
+
+    def handle(self, *args, **options):
+        if options['stripes'] is not None or options['stock'] is not None:
+            if not options['variant']:
+                raise CommandError("--stripes and --stock need at least one --variant")
+            variants = ProductVariant.objects.filter(pk__in=options['variant'])
+        elif options['variant']:
+            variants = ProductVariant.objects.filter(pk__in=options['variant'], stripe_count__gt=0)
+        else:
+            variants = ProductVariant.objects.filter(stripe_count__gt=0)
+
+        for variant in variants.select_related('product'):
+            stock = rebalance_stripes(variant, options['stripes'], options['stock'])
+            self.stdout.write(f"{variant}: {stock} units")
+
+        self.stdout.write(self.style.SUCCESS(f"Rebalanced {variants.count()} variant(s)"))
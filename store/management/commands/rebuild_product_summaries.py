@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Product, ProductSummary
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the denormalized ProductSummary rows from variants and images, "
+        "and the per-product review star counters"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        product_ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+
+        total = 0
+        batch = []
+        for product_id in product_ids.iterator(chunk_size=batch_size):
+            batch.append(product_id)
+            if len(batch) == batch_size:
+                ProductSummary.refresh(batch)
+                Product.rebuild_rating_counts(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            ProductSummary.refresh(batch)
+            Product.rebuild_rating_counts(batch)
+            total += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} product summaries"))
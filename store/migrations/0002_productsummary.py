@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_summaries(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    ProductVariant = apps.get_model('store', 'ProductVariant')
+    ProductImage = apps.get_model('store', 'ProductImage')
+    ProductSummary = apps.get_model('store', 'ProductSummary')
+
+    summaries = {
+        pk: ProductSummary(product_id=pk, available_sizes=[])
+        for pk in Product.objects.values_list('pk', flat=True)
+    }
+    variants = ProductVariant.objects.filter(
+        inventory_quantity__gt=0
+    ).order_by('size').values_list('product_id', 'size', 'price')
+    for product_id, size, price in variants:
+        summary = summaries[product_id]
+        summary.in_stock = True
+        summary.available_sizes.append(size)
+        summary.min_price = price if summary.min_price is None else min(summary.min_price, price)
+        summary.max_price = price if summary.max_price is None else max(summary.max_price, price)
+    for product_id, image in ProductImage.objects.filter(is_main=True).values_list('product_id', 'image'):
+        summaries[product_id].main_image = image
+    ProductSummary.objects.bulk_create(summaries.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='store.product')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('in_stock', models.BooleanField(default=False)),
+                ('available_sizes', models.JSONField(blank=True, default=list)),
+                ('main_image', models.CharField(blank=True, max_length=255)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'product summaries',
+                'indexes': [models.Index(fields=['min_price'], name='store_produ_min_pri_6871f4_idx'), models.Index(fields=['max_price'], name='store_produ_max_pri_67e8ba_idx'), models.Index(fields=['in_stock'], name='store_produ_in_stoc_b92084_idx')],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_productsummary'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='productsummary',
+            name='store_produ_min_pri_6871f4_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='productsummary',
+            name='store_produ_max_pri_67e8ba_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at', 'id'], name='store_produ_created_8914b9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='store_produ_name_171327_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsummary',
+            index=models.Index(fields=['min_price', 'product'], name='store_produ_min_pri_3ad38b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsummary',
+            index=models.Index(fields=['max_price', 'product'], name='store_produ_max_pri_d29d1c_idx'),
+        ),
+    ]
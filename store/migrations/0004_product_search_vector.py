@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:59
+
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+GIN_INDEX = 'store_product_search_vector_gin'
+
+
+def add_search_index(apps, schema_editor):
+    # tsvector and GIN only exist on PostgreSQL; other databases use the
+    # in-process index from store/search.py
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Product = apps.get_model('store', 'Product')
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {GIN_INDEX} ON {Product._meta.db_table} USING gin (search_vector)'
+    )
+    Product.objects.update(search_vector=(
+        SearchVector('name', weight='A', config='english')
+        + SearchVector('description', weight='B', config='english')
+    ))
+
+
+def remove_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {GIN_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(add_search_index, remove_search_index),
+    ]
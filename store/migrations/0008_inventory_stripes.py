@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:13
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_inventory_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='stripe_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='InventoryStripe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('quantity', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stripes', to='store.productvariant')),
+            ],
+            options={
+                'ordering': ['variant', 'index'],
+                'unique_together': {('variant', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_order_status_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='low_stock_notified_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(condition=models.Q(('inventory_quantity__lte', models.F('low_stock_threshold'))), fields=['inventory_quantity', 'id'], name='variant_low_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(condition=models.Q(('low_stock_notified_at__isnull', False)), fields=['low_stock_notified_at'], name='variant_low_stock_alerted_idx'),
+        ),
+    ]
@@ -1,9 +1,13 @@
 from django.db import models
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 from django.urls import reverse
+from django.utils import timezone
 from decimal import Decimal
 import uuid
 # Create your models here.
@@ -86,6 +90,17 @@ class Product(models.Model):
     meta_title = models.CharField(max_length=60, blank=True, null=True)
     meta_description = models.CharField(max_length=160, blank=True, null=True)
 
+    # Weighted name/description tsvector, maintained on PostgreSQL only (see search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Review counts per star rating, maintained incrementally from ProductReview writes
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+    RATING_COUNT_FIELDS = [f'rating_{rating}_count' for rating in range(1, 6)]
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -96,16 +111,41 @@ class Product(models.Model):
             models.Index(fields=['status']),
             models.Index(fields=['category']),
             models.Index(fields=['created_at']),
+            # Keyset pagination seeks (see pagination.py)
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['name', 'id']),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_listing_state()
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Never write back star counters read earlier; they move with F() updates
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.RATING_COUNT_FIELDS
+            ]
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
+    def remember_listing_state(self):
+        """Record status/category as loaded so signals can detect changes"""
+        self._loaded_listing_state = (self.__dict__.get('status'), self.__dict__.get('category_id'))
+
+    @property
+    def listing_state_changed(self):
+        """Whether status or category changed since the row was loaded"""
+        loaded = getattr(self, '_loaded_listing_state', None)
+        return loaded is None or loaded != (self.status, self.category_id)
+
     @property
     def is_in_stock(self):
         """Check if any variant is in stock"""
@@ -116,6 +156,44 @@ class Product(models.Model):
         """Get the main product image"""
         return self.images.filter(is_main=True).first()
 
+    @property
+    def rating_histogram(self):
+        return {rating: getattr(self, f'rating_{rating}_count') for rating in range(1, 6)}
+
+    @property
+    def review_count(self):
+        return sum(self.rating_histogram.values())
+
+    @property
+    def average_rating(self):
+        count = self.review_count
+        if not count:
+            return 0
+        total = sum(rating * n for rating, n in self.rating_histogram.items())
+        return round(total / count, 1)
+
+    @staticmethod
+    def adjust_rating_counts(product_id, rating, delta):
+        """Atomically add `delta` to one star counter of a product"""
+        field = f'rating_{rating}_count'
+        Product.objects.filter(pk=product_id).update(
+            **{field: models.F(field) + delta, 'updated_at': timezone.now()}
+        )
+
+    @classmethod
+    def rebuild_rating_counts(cls, product_ids):
+        """Recompute the star counters of the given products from their reviews"""
+        products = {pk: cls(pk=pk) for pk in product_ids}
+        for product in products.values():
+            for rating in range(1, 6):
+                setattr(product, f'rating_{rating}_count', 0)
+        counts = ProductReview.objects.filter(product_id__in=products).values(
+            'product_id', 'rating'
+        ).annotate(n=models.Count('pk'))
+        for row in counts:
+            setattr(products[row['product_id']], f"rating_{row['rating']}_count", row['n'])
+        cls.objects.bulk_update(products.values(), cls.RATING_COUNT_FIELDS)
+
 
 class ProductVariant(models.Model):
     """Variants of a product (size, price, inventory)"""
@@ -138,15 +216,56 @@ class ProductVariant(models.Model):
         blank=True, null=True
     )
     inventory_quantity = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    # Units held by active cart reservations (see store.inventory)
+    reserved_quantity = models.IntegerField(default=0, editable=False)
+    # Hot SKUs can spread stock over N InventoryStripe rows (0 = not striped)
+    stripe_count = models.PositiveSmallIntegerField(default=0)
     low_stock_threshold = models.IntegerField(default=5, validators=[MinValueValidator(0)])
+    # Set when staff were alerted about this low-stock crossing; cleared on recovery
+    low_stock_notified_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    UPDATE_MANAGED_FIELDS = ('reserved_quantity', 'low_stock_notified_at')
+
+    # Database form of is_low_stock; matches the partial index below
+    LOW_STOCK = models.Q(inventory_quantity__lte=models.F('low_stock_threshold'))
 
     class Meta:
         unique_together = ("product", "size")
         ordering = ["size"]
+        indexes = [
+            # Back the per-product EXISTS probes of ProductFilter (index-only)
+            models.Index(fields=['product', 'size', 'price', 'inventory_quantity']),
+            # Price-range scans that drive a semi-join from variants
+            models.Index(fields=['price', 'product']),
+            # Low-stock report and alert queue: only low rows are indexed
+            models.Index(
+                fields=['inventory_quantity', 'id'], name='variant_low_stock_idx',
+                condition=models.Q(inventory_quantity__lte=models.F('low_stock_threshold'))
+            ),
+            # Alerted variants, scanned to re-arm the alert once restocked
+            models.Index(
+                fields=['low_stock_notified_at'], name='variant_low_stock_alerted_idx',
+                condition=models.Q(low_stock_notified_at__isnull=False)
+            ),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.size}"
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Never write back values read earlier that holds and alerts move with update()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.UPDATE_MANAGED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def available_quantity(self):
+        """Stock that is neither sold nor held in a cart"""
+        return max(self.inventory_quantity - self.reserved_quantity, 0)
+
     @property
     def is_on_sale(self):
         return self.compare_at_price and self.price < self.compare_at_price
@@ -165,6 +284,30 @@ class ProductVariant(models.Model):
     def is_low_stock(self):
         return self.inventory_quantity <= self.low_stock_threshold
 
+    @property
+    def is_striped(self):
+        return self.stripe_count > 0
+
+
+class InventoryStripe(models.Model):
+    """
+    One sub-counter of a striped variant's stock.
+
+    Checkouts decrement a random stripe, so concurrent buyers of a hot SKU
+    lock different rows. The variant's inventory_quantity mirrors the sum,
+    resynced whenever a stripe may have run dry (see store.inventory).
+    """
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='stripes')
+    index = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+
+    class Meta:
+        unique_together = ('variant', 'index')
+        ordering = ['variant', 'index']
+
+    def __str__(self):
+        return f"{self.variant_id} stripe {self.index}: {self.quantity}"
+
 class ProductImage(models.Model):
     """Product images model"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -191,6 +334,68 @@ class ProductImage(models.Model):
             ProductImage.objects.filter(product=self.product, is_main=True).update(is_main=False)
         super().save(*args, **kwargs)
 
+class ProductSummary(models.Model):
+    """
+    Denormalized catalog data for a product (price range, stock, sizes and
+    main image), kept in sync from variant and image writes so listings read
+    one row per product instead of aggregating variants.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    in_stock = models.BooleanField(default=False)
+    available_sizes = models.JSONField(default=list, blank=True)
+    main_image = models.CharField(max_length=255, blank=True)  # storage name of the main ProductImage
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'product summaries'
+        indexes = [
+            models.Index(fields=['min_price', 'product']),
+            models.Index(fields=['max_price', 'product']),
+            models.Index(fields=['in_stock']),
+        ]
+
+    def __str__(self):
+        return f"Summary - {self.product_id}"
+
+    @classmethod
+    def refresh(cls, product_ids):
+        """Recompute the summaries of the given products from their in-stock variants and main image"""
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+
+        summaries = {
+            pk: cls(product_id=pk, available_sizes=[])
+            for pk in Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True)
+        }
+        if not summaries:
+            return
+
+        variants = ProductVariant.objects.filter(
+            product_id__in=summaries, inventory_quantity__gt=0
+        ).order_by('size').values_list('product_id', 'size', 'price')
+        for product_id, size, price in variants:
+            summary = summaries[product_id]
+            summary.in_stock = True
+            summary.available_sizes.append(size)
+            summary.min_price = price if summary.min_price is None else min(summary.min_price, price)
+            summary.max_price = price if summary.max_price is None else max(summary.max_price, price)
+
+        main_images = ProductImage.objects.filter(
+            product_id__in=summaries, is_main=True
+        ).values_list('product_id', 'image')
+        for product_id, image in main_images:
+            summaries[product_id].main_image = image
+
+        cls.objects.bulk_create(
+            summaries.values(),
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['min_price', 'max_price', 'in_stock', 'available_sizes', 'main_image', 'updated_at'],
+        )
+
 class ProductReview(models.Model):
     """Product reviews and ratings"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -213,6 +418,16 @@ class ProductReview(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.rating}/5 by {self.user.email}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_rating()
+        return instance
+
+    def remember_rating(self):
+        """Record the stored (product, rating) so counter updates can undo it"""
+        self._loaded_rating = (self.__dict__.get('product_id'), self.__dict__.get('rating'))
+
 class Order(models.Model):
     """Customer orders"""
     STATUS_CHOICES = [
@@ -240,11 +455,37 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Order history pages: a customer's orders, newest first
+            models.Index(fields=['user', '-created_at']),
+            # Staff listing of all orders
+            models.Index(fields=['-created_at']),
+        ]
 
     def __str__(self):
         return f"Order {self.id} - {self.user.email}"
 
 
+class OrderStatusEvent(models.Model):
+    """One status transition of an order (see store.lifecycle)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_events')
+    from_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    actor = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['order', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Order {self.order_id}: {self.from_status} -> {self.to_status}"
+
+
 class OrderItem(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
@@ -331,13 +572,44 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart - {self.user.email}"
 
+    @cached_property
+    def totals(self):
+        """Amount and unit count of the cart, in one aggregate over its lines"""
+        return self.items.aggregate(
+            total_amount=Coalesce(
+                models.Sum(models.F('quantity') * models.F('variant__price'), output_field=models.DecimalField()),
+                Decimal('0.00')
+            ),
+            total_items=Coalesce(models.Sum('quantity'), 0)
+        )
+
     @property
     def total_amount(self):
-        return sum(item.total_price for item in self.items.all())
+        return self.totals['total_amount']
 
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.totals['total_items']
+
+
+class InventoryReservation(models.Model):
+    """A time-limited hold on variant stock for a cart line"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='reservations')
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['cart', 'variant']
+        indexes = [
+            # The expiry sweep scans holds in expiry order
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity}x {self.variant_id} until {self.expires_at}"
 
 
 class CartItem(models.Model):
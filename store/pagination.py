@@ -0,0 +1,178 @@
+import base64
+import json
+import uuid
+from decimal import Decimal
+
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class ProductCursorPagination(BasePagination):
+    """
+    Keyset pagination for product listings.
+
+    Pages seek on (sort value, id) instead of using OFFSET, and no exact
+    COUNT(*) is run, so latency stays flat however deep the client goes.
+    Enabled with `?pagination=cursor` (or by following a `next` link);
+    `ordering` supports created_at, name and price in both directions.
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    page_size = 12
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    default_ordering = '-created_at'
+
+    # ordering param -> (sort field, descending, parser for cursor values)
+    keysets = {
+        'created_at': ('created_at', False, parse_datetime),
+        '-created_at': ('created_at', True, parse_datetime),
+        'name': ('name', False, str),
+        '-name': ('name', True, str),
+        'price': ('summary__min_price', False, Decimal),
+        '-price': ('summary__max_price', True, Decimal),
+    }
+    nullable_fields = {'summary__min_price', 'summary__max_price'}
+
+    @classmethod
+    def is_requested(cls, request):
+        params = request.query_params
+        return cls.cursor_query_param in params or params.get(cls.mode_query_param) == 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = request.query_params.get('ordering')
+        if self.ordering not in self.keysets:
+            self.ordering = self.default_ordering
+        field, descending, parse = self.keysets[self.ordering]
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor.get('r'))
+        # Walking backwards is the same seek with the ordering flipped;
+        # NULL sort values stay at the end of the forward order.
+        effective_desc = descending != reverse
+        nulls_last = not reverse
+
+        if cursor is not None:
+            queryset = queryset.filter(self.seek_filter(
+                field, cursor['v'], cursor['id'], effective_desc, nulls_last
+            ))
+
+        nulls = {'nulls_last': True} if nulls_last else {'nulls_first': True}
+        sort = F(field).desc(**nulls) if effective_desc else F(field).asc(**nulls)
+        queryset = queryset.order_by(sort, '-id' if effective_desc else 'id')
+
+        self.estimated_count = self.estimate_count(queryset) if cursor is None else None
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.field = field
+        self.has_next = has_more if not reverse else True
+        self.has_previous = (cursor is not None) if not reverse else has_more
+        self.page = rows
+        return rows
+
+    def seek_filter(self, field, value, pk, descending, nulls_last):
+        """Rows strictly after (value, pk) in the given direction"""
+        value_lookup = f'{field}__lt' if descending else f'{field}__gt'
+        pk_lookup = 'id__lt' if descending else 'id__gt'
+        after = Q(**{value_lookup: value}) | Q(**{field: value, pk_lookup: pk})
+        if field not in self.nullable_fields:
+            return after
+
+        is_null = Q(**{f'{field}__isnull': True})
+        if value is None:
+            after = is_null & Q(**{pk_lookup: pk})
+            return after if nulls_last else after | ~is_null
+        return after | is_null if nulls_last else after
+
+    def estimate_count(self, queryset):
+        """Planner row estimate on PostgreSQL; no count elsewhere"""
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        """The cursor with its sort value and id parsed; NotFound if it was tampered with"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        _, _, parse = self.keysets[self.ordering]
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            if cursor['o'] != self.ordering:
+                raise ValueError
+            cursor['id'] = uuid.UUID(cursor['id'])
+            if cursor['v'] is not None:
+                if not isinstance(cursor['v'], str):
+                    raise ValueError
+                cursor['v'] = parse(cursor['v'])
+                # parse_datetime returns None for garbage; Decimal accepts NaN
+                if cursor['v'] is None or (isinstance(cursor['v'], Decimal) and not cursor['v'].is_finite()):
+                    raise ValueError
+        except (TypeError, ValueError, KeyError, AttributeError, ArithmeticError, UnicodeEncodeError):
+            raise NotFound('Invalid cursor')
+        return cursor
+
+    def encode_cursor(self, row, reverse):
+        value = row
+        for part in self.field.split('__'):
+            value = getattr(value, part, None) if value is not None else None
+        if value is not None:
+            value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+        payload = {'o': self.ordering, 'v': value, 'id': str(row.pk)}
+        if reverse:
+            payload['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'estimated_count': self.estimated_count,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'estimated_count': {'type': 'integer', 'nullable': True},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,164 @@
+"""
+Ranked product search.
+
+On PostgreSQL products carry a stored, GIN-indexed `search_vector` (name
+weighted above description) queried with prefix tsqueries. Other databases
+(the SQLite dev database, tests) use an in-process inverted index with the
+same weighting and prefix semantics, so both expose the same API.
+"""
+import bisect
+import re
+import threading
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, F, FloatField, Value, When
+from rest_framework import filters
+
+SEARCH_CONFIG = 'english'
+# Same relative weights PostgreSQL's ts_rank uses for A and B
+NAME_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def uses_search_vector():
+    return connection.vendor == 'postgresql'
+
+
+def product_search_vector():
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+class ProductSearchIndex:
+    """In-process inverted index: token -> {product id: weight}"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = None
+        self._tokens = []
+        self._documents = {}
+
+    def _ensure_built(self):
+        if self._postings is not None:
+            return
+        from .models import Product
+
+        with self._lock:
+            if self._postings is not None:
+                return
+            self._postings = defaultdict(dict)
+            self._documents = {}
+            for pk, name, description in Product.objects.values_list('pk', 'name', 'description').iterator():
+                self._add(pk, name, description)
+            self._tokens = sorted(self._postings)
+
+    def _add(self, pk, name, description):
+        weights = defaultdict(float)
+        for token in tokenize(description):
+            weights[token] = max(weights[token], DESCRIPTION_WEIGHT)
+        for token in tokenize(name):
+            weights[token] = NAME_WEIGHT
+        for token, weight in weights.items():
+            self._postings[token][pk] = weight
+        self._documents[pk] = list(weights)
+
+    def _remove(self, pk):
+        for token in self._documents.pop(pk, []):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(pk, None)
+                if not postings:
+                    del self._postings[token]
+
+    def update(self, product):
+        """Re-index one product (no-op until the index is first used)"""
+        if self._postings is None:
+            return
+        with self._lock:
+            self._remove(product.pk)
+            self._add(product.pk, product.name, product.description)
+            self._tokens = sorted(self._postings)
+
+    def remove(self, pk):
+        if self._postings is None:
+            return
+        with self._lock:
+            self._remove(pk)
+            self._tokens = sorted(self._postings)
+
+    def clear(self):
+        with self._lock:
+            self._postings = None
+            self._tokens = []
+            self._documents = {}
+
+    def _prefix_matches(self, term):
+        """{product id: best weight} over every token starting with `term`"""
+        matches = {}
+        start = bisect.bisect_left(self._tokens, term)
+        for token in self._tokens[start:]:
+            if not token.startswith(term):
+                break
+            for pk, weight in self._postings[token].items():
+                if weight > matches.get(pk, 0):
+                    matches[pk] = weight
+        return matches
+
+    def search(self, terms):
+        """{product id: rank} for products matching every term as a prefix"""
+        self._ensure_built()
+        ranks = None
+        for term in terms:
+            matches = self._prefix_matches(term)
+            if ranks is None:
+                ranks = matches
+            else:
+                ranks = {pk: rank + matches[pk] for pk, rank in ranks.items() if pk in matches}
+            if not ranks:
+                return {}
+        return ranks or {}
+
+
+product_index = ProductSearchIndex()
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """
+    Full-text `?search=` backend for products, annotating `search_rank`.
+
+    Every term must match (as a prefix) the name or the description; name
+    hits rank above description hits.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = tokenize(request.query_params.get(self.search_param, ''))
+        if not terms:
+            return queryset
+
+        if uses_search_vector():
+            query = SearchQuery(
+                ' & '.join(f'{term}:*' for term in terms),
+                search_type='raw', config=SEARCH_CONFIG
+            )
+            return queryset.filter(search_vector=query).annotate(
+                search_rank=SearchRank(F('search_vector'), query)
+            )
+
+        ranks = product_index.search(terms)
+        if not ranks:
+            return queryset.none()
+        return queryset.filter(pk__in=ranks).annotate(search_rank=Case(
+            *[When(pk=pk, then=Value(rank)) for pk, rank in ranks.items()],
+            default=Value(0.0),
+            output_field=FloatField(),
+        ))
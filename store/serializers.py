@@ -1,15 +1,27 @@
 from django.db import models
-from decimal import Decimal
 from rest_framework import serializers
 from dj_rest_auth.registration.serializers import RegisterSerializer
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
+from django.urls import reverse
 
+from .cache import category_map
+from .checkout import place_order
 from .models import (
     CustomUser, Category, Product, ProductImage, ProductReview,
-    Order, OrderItem, Wishlist, Payment, Cart, CartItem, ProductVariant
+    Order, OrderItem, Wishlist, Payment, Cart, CartItem, ProductVariant, ProductSummary
 )
+
+
+class LoadedItemsSerializer(serializers.ListSerializer):
+    """Renders the parent's `loaded_items` list, when the code that built it set one, instead of querying"""
+
+    def get_attribute(self, instance):
+        loaded = getattr(instance, 'loaded_items', None)
+        return super().get_attribute(instance) if loaded is None else loaded
+
+
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     """
     Extend JWT token serializer to include extra user data in the response
@@ -68,8 +80,37 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ["id", "name", "slug", "description", "image", "product_count", "created_at"]
         
     def get_product_count(self, obj):
+        # Use the annotated count when the queryset provides one
+        if hasattr(obj, 'product_count'):
+            return obj.product_count
         return obj.products.filter(status='active').count()
 
+class NestedCategoryField(serializers.Field):
+    """
+    Read-only category representation served from the process-local
+    category map instead of serializing (and counting) per product row.
+    """
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        kwargs.setdefault('source', 'category_id')
+        super().__init__(**kwargs)
+
+    def to_representation(self, category_id):
+        # Look the map up once per response, not once per row
+        categories = self.context.get('_category_map')
+        if categories is None:
+            categories = category_map.current()
+            if isinstance(self.context, dict):
+                self.context['_category_map'] = categories
+        data = categories.get(category_id)
+        if data is None:
+            return None
+        data = dict(data)
+        request = self.context.get('request')
+        if data.get('image') and request:
+            data['image'] = request.build_absolute_uri(data['image'])
+        return data
+
 # -------------------
 # PRODUCT VARIANTS
 # -------------------
@@ -78,11 +119,25 @@ class ProductVariantSerializer(serializers.ModelSerializer):
         model = ProductVariant
         fields = [
             "id", "size", "price", "compare_at_price",
-            "inventory_quantity", "low_stock_threshold",
+            "inventory_quantity", "available_quantity", "low_stock_threshold",
             "is_on_sale", "discount_percentage",
             "is_in_stock", "is_low_stock"
         ]
-        read_only_fields = ["is_on_sale", "discount_percentage", "is_in_stock", "is_low_stock"]
+        read_only_fields = ["available_quantity", "is_on_sale", "discount_percentage", "is_in_stock", "is_low_stock"]
+
+
+class LowStockVariantSerializer(serializers.ModelSerializer):
+    """Row of the staff low-stock report; expects select_related('product')"""
+    product_id = serializers.UUIDField(source='product.id', read_only=True)
+    product_name = serializers.CharField(source='product.name', read_only=True)
+
+    class Meta:
+        model = ProductVariant
+        fields = [
+            "id", "product_id", "product_name", "size", "inventory_quantity",
+            "reserved_quantity", "low_stock_threshold", "low_stock_notified_at"
+        ]
+        read_only_fields = fields
 
 # -------------------
 # PRODUCT IMAGES
@@ -112,8 +167,15 @@ class ProductReviewSerializer(serializers.ModelSerializer):
 # PRODUCTS
 # -------------------
 class ProductListSerializer(serializers.ModelSerializer):
-    """Lightweight serializer for product lists"""
-    category = CategorySerializer(read_only=True)
+    """
+    Lightweight serializer for product lists.
+
+    Reads stock, price range, sizes and main image from the product's
+    ProductSummary, falling back to per-row queries when it is missing.
+    The category comes from the shared category map.
+    """
+    category = NestedCategoryField()
+    is_in_stock = serializers.SerializerMethodField()
     main_image = serializers.SerializerMethodField()
     price_range = serializers.SerializerMethodField()
     available_sizes = serializers.SerializerMethodField()
@@ -125,41 +187,71 @@ class ProductListSerializer(serializers.ModelSerializer):
             "status", "is_in_stock", "main_image", 
             "price_range", "available_sizes", "created_at"
         ]
+
+    def get_summary(self, obj):
+        try:
+            return obj.summary
+        except ProductSummary.DoesNotExist:
+            return None
+
+    def get_is_in_stock(self, obj):
+        summary = self.get_summary(obj)
+        if summary is not None:
+            return summary.in_stock
+        return obj.is_in_stock
     
     def get_main_image(self, obj):
-        main_image = obj.main_image
-        if main_image:
+        summary = self.get_summary(obj)
+        if summary is not None:
+            image_name = summary.main_image
+        else:
+            main_image = obj.main_image
+            image_name = main_image.image.name if main_image else None
+        if image_name:
             request = self.context.get('request')
             if request:
-                return request.build_absolute_uri(main_image.image.url)
+                storage = ProductImage._meta.get_field('image').storage
+                return request.build_absolute_uri(storage.url(image_name))
         return None
     
     def get_price_range(self, obj):
-        variants = obj.variants.filter(inventory_quantity__gt=0)
-        if not variants.exists():
+        summary = self.get_summary(obj)
+        if summary is not None:
+            min_price, max_price = summary.min_price, summary.max_price
+        else:
+            prices = list(obj.variants.filter(inventory_quantity__gt=0).values_list('price', flat=True))
+            min_price = min(prices) if prices else None
+            max_price = max(prices) if prices else None
+
+        if min_price is None:
             return None
-        
-        prices = variants.values_list('price', flat=True)
-        min_price = min(prices)
-        max_price = max(prices)
-        
-        if min_price == max_price:
-            return {"min": float(min_price), "max": float(max_price)}
         return {"min": float(min_price), "max": float(max_price)}
     
     def get_available_sizes(self, obj):
+        summary = self.get_summary(obj)
+        if summary is not None:
+            return summary.available_sizes
         return list(obj.variants.filter(
             inventory_quantity__gt=0
         ).values_list('size', flat=True).distinct())
 
 class ProductDetailSerializer(serializers.ModelSerializer):
-    """Detailed serializer for single product view"""
+    """
+    Detailed serializer for single product view.
+
+    Ratings come from the counters stored on the product; only the newest
+    reviews are embedded, the rest are paginated under `reviews_url`.
+    """
+    review_preview_size = 5
+
     category = CategorySerializer(read_only=True)
     images = ProductImageSerializer(many=True, read_only=True)
     variants = ProductVariantSerializer(many=True, read_only=True)
-    reviews = ProductReviewSerializer(many=True, read_only=True)
-    review_count = serializers.SerializerMethodField()
-    average_rating = serializers.SerializerMethodField()
+    reviews = serializers.SerializerMethodField()
+    reviews_url = serializers.SerializerMethodField()
+    review_count = serializers.IntegerField(read_only=True)
+    average_rating = serializers.FloatField(read_only=True)
+    rating_summary = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
@@ -167,16 +259,25 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             'id', 'name', 'slug', 'description', 'category',
             'status', 'meta_title', 'meta_description',
             'is_in_stock', 'images', 'variants', 
-            'reviews', 'review_count', 'average_rating',
+            'reviews', 'reviews_url', 'review_count', 'average_rating', 'rating_summary',
             'created_at', 'updated_at'
         ]
 
-    def get_review_count(self, obj):
-        return obj.reviews.count()
+    def get_reviews(self, obj):
+        reviews = obj.reviews.select_related('user')[:self.review_preview_size]
+        return ProductReviewSerializer(reviews, many=True, context=self.context).data
 
-    def get_average_rating(self, obj):
-        avg = obj.reviews.aggregate(avg_rating=models.Avg('rating'))['avg_rating']
-        return round(avg, 1) if avg else 0
+    def get_reviews_url(self, obj):
+        url = reverse('product-reviews-list', kwargs={'product_slug': obj.slug})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_rating_summary(self, obj):
+        return {
+            'count': obj.review_count,
+            'average': obj.average_rating,
+            'histogram': {str(rating): count for rating, count in obj.rating_histogram.items()},
+        }
 
 # -------------------
 # CART
@@ -198,6 +299,20 @@ class CartItemCreateSerializer(serializers.ModelSerializer):
         except ProductVariant.DoesNotExist:
             raise serializers.ValidationError("Product variant does not exist")
 
+class CartOperationSerializer(serializers.Serializer):
+    """One line change of a cart batch; quantity is ignored by remove"""
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    variant_id = serializers.UUIDField()
+    quantity = serializers.IntegerField(min_value=0, default=0)
+
+    def validate(self, data):
+        if data['op'] == 'add' and data['quantity'] < 1:
+            raise serializers.ValidationError({'quantity': 'Ensure this value is greater than or equal to 1.'})
+        return data
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=500)
+
 class CartItemSerializer(serializers.ModelSerializer):
     variant = ProductVariantSerializer(read_only=True)
     product_name = serializers.CharField(source='variant.product.name', read_only=True)
@@ -206,9 +321,15 @@ class CartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ["id", "variant", "product_name", "product_image", "quantity", "total_price", "created_at"]
+        list_serializer_class = LoadedItemsSerializer
     
     def get_product_image(self, obj):
-        main_image = obj.variant.product.main_image
+        product = obj.variant.product
+        # Prefetched by the cart stores (see carts.MAIN_IMAGES)
+        if hasattr(product, 'main_images'):
+            main_image = product.main_images[0] if product.main_images else None
+        else:
+            main_image = product.main_image
         if main_image:
             request = self.context.get('request')
             if request:
@@ -240,6 +361,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ["id", "variant", "product_name", "quantity", "price", "total_price"]
+        list_serializer_class = LoadedItemsSerializer
 
 class OrderCreateSerializer(serializers.ModelSerializer):
     """
@@ -249,12 +371,16 @@ class OrderCreateSerializer(serializers.ModelSerializer):
     - shipping_address: string
     - phone: string
     - items: array of order items with variant_id and quantity
+
+    Optional:
+    - payment_method: card (default), paypal or cash
     """
     items = OrderItemCreateSerializer(many=True, write_only=True)
+    payment_method = serializers.ChoiceField(choices=Payment.METHOD_CHOICES, default='card', write_only=True)
     
     class Meta:
         model = Order
-        fields = ['shipping_address', 'phone', 'items']
+        fields = ['shipping_address', 'phone', 'items', 'payment_method']
     
     def validate(self, data):
         """Validate order data before creation"""
@@ -266,65 +392,58 @@ class OrderCreateSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         items_data = validated_data.pop('items')
         user = self.context['request'].user
-        
-        # Calculate total amount
-        total_amount = Decimal('0.00')
-        order_items = []
-        
-        for item_data in items_data:
-            try:
-                variant = ProductVariant.objects.get(id=item_data['variant_id'])
-                quantity = item_data['quantity']
-                
-                # Validate data
-                if quantity is None or quantity <= 0:
-                    raise serializers.ValidationError(f"Invalid quantity for {variant.product.name}")
-                
-                if variant.price is None:
-                    raise serializers.ValidationError(f"Price not set for {variant.product.name}")
-                
-                # Check stock
-                if variant.inventory_quantity < quantity:
-                    raise serializers.ValidationError(
-                        f"Insufficient stock for {variant.product.name} - {variant.size}. "
-                        f"Available: {variant.inventory_quantity}, Requested: {quantity}"
-                    )
-                
-                item_total = variant.price * quantity
-                total_amount += item_total
-                
-                order_items.append({
-                    'variant': variant,
-                    'quantity': quantity,
-                    'price': variant.price
-                })
-                
-            except ProductVariant.DoesNotExist:
-                raise serializers.ValidationError(f"Product variant {item_data['variant_id']} does not exist")
-        
-        # Create order - explicitly pass only the fields you need
-        order = Order.objects.create(
-            user=user,
-            total_amount=total_amount,
-            shipping_address=validated_data['shipping_address'],
-            phone=validated_data['phone']
+
+        # Locks, validates and decrements stock in one transaction
+        return place_order(
+            user,
+            validated_data['shipping_address'],
+            validated_data['phone'],
+            [(item_data['variant_id'], item_data['quantity']) for item_data in items_data],
+            cart=validated_data.get('cart'),
+            payment_method=validated_data['payment_method']
         )
-        
-        # Create order items and update inventory
-        for item_data in order_items:
-            OrderItem.objects.create(
-                order=order,
-                variant=item_data['variant'],
-                quantity=item_data['quantity'],
-                price=item_data['price']
-            )
-            
-            # Update inventory
-            variant = item_data['variant']
-            variant.inventory_quantity -= item_data['quantity']
-            variant.save()
-        
-        return order
+
+class BulkOrderEntrySerializer(OrderCreateSerializer):
+    """One order of a bulk import; owned by customer_email or the importer"""
+    reference = serializers.CharField(required=False, allow_blank=True)
+    customer_email = serializers.EmailField(required=False)
+
+    class Meta(OrderCreateSerializer.Meta):
+        fields = OrderCreateSerializer.Meta.fields + ['reference', 'customer_email']
+
+class OrderTransitionSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+    note = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+
+class BulkOrderTransitionSerializer(OrderTransitionSerializer):
+    order_ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=50000)
+
+class OrderListSerializer(serializers.ModelSerializer):
+    """
+    Order history row, read entirely from annotations (see
+    OrderViewSet.get_queryset): item and unit counts plus the name and
+    thumbnail of the lead (most expensive) item.
+    """
+    customer_email = serializers.EmailField(source='user.email', read_only=True)
+    item_count = serializers.IntegerField(read_only=True)
+    unit_count = serializers.IntegerField(read_only=True)
+    lead_item_name = serializers.CharField(read_only=True)
+    lead_item_thumbnail = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Order
+        fields = [
+            "id", "customer_email", "status", "total_amount",
+            "item_count", "unit_count", "lead_item_name", "lead_item_thumbnail",
+            "created_at", "updated_at"
+        ]
+
+    def get_lead_item_thumbnail(self, obj):
+        request = self.context.get('request')
+        if obj.lead_item_image and request:
+            storage = ProductImage._meta.get_field('image').storage
+            return request.build_absolute_uri(storage.url(obj.lead_item_image))
+        return None
 
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
@@ -337,7 +456,8 @@ class OrderSerializer(serializers.ModelSerializer):
             "shipping_address", "phone", "items",
             "created_at", "updated_at"
         ]
-        read_only_fields = ['user', 'total_amount']
+        # Status changes go through the transition endpoints (store.lifecycle)
+        read_only_fields = ['user', 'status', 'total_amount']
 
 # -------------------
 # PAYMENT
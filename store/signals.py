@@ -1,12 +1,89 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
-from django.contrib.auth import get_user_model
-from .models import Cart
+from .models import Cart, Category, Product, ProductVariant, ProductImage, ProductReview, ProductSummary
+from .cache import bump_generation, PRODUCTS, CATEGORIES
+from .inventory import release
+from .search import product_index, product_search_vector, uses_search_vector
 
-User = get_user_model()
+@receiver(pre_delete, sender=Cart)
+def release_cart_reservations(sender, instance, **kwargs):
+    """Hand a deleted cart's stock holds back before they cascade away"""
+    release(instance)
 
-@receiver(post_save, sender=User)
-def create_user_cart(sender, instance, created, **kwargs):
-    """Create a cart for new users"""
+@receiver(post_save, sender=Product)
+def create_product_summary(sender, instance, created, **kwargs):
+    """Start every product with an (empty) summary row"""
     if created:
-        Cart.objects.create(user=instance)
\ No newline at end of file
+        ProductSummary.objects.get_or_create(product=instance)
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+def refresh_product_summary(sender, instance, **kwargs):
+    """Keep the product summary in sync with variant and image writes"""
+    ProductSummary.refresh([instance.product_id])
+
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_delete, sender=ProductImage)
+def refresh_product_summary_on_delete(sender, instance, origin=None, **kwargs):
+    """Refresh the summary unless the product itself is being deleted"""
+    if isinstance(origin, Product) or getattr(origin, 'model', None) is Product:
+        return
+    ProductSummary.refresh([instance.product_id])
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog_cache(sender, **kwargs):
+    """Category and product rows feed both product and category responses"""
+    bump_generation(PRODUCTS, CATEGORIES)
+
+@receiver(post_save, sender=Product)
+def invalidate_product_listing_cache(sender, instance, **kwargs):
+    """Category counts (and the category map) only move with status/category changes"""
+    if instance.listing_state_changed:
+        bump_generation(PRODUCTS, CATEGORIES)
+        instance.remember_listing_state()
+    else:
+        bump_generation(PRODUCTS)
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def invalidate_product_cache(sender, **kwargs):
+    bump_generation(PRODUCTS)
+
+@receiver(post_save, sender=Product)
+def update_product_search(sender, instance, update_fields=None, **kwargs):
+    """Re-index the product's name and description"""
+    if update_fields is not None and not {'name', 'description'} & set(update_fields):
+        return
+    if uses_search_vector():
+        Product.objects.filter(pk=instance.pk).update(search_vector=product_search_vector())
+    else:
+        product_index.update(instance)
+
+@receiver(post_delete, sender=Product)
+def remove_product_search(sender, instance, **kwargs):
+    product_index.remove(instance.pk)
+
+@receiver(post_save, sender=ProductReview)
+def count_review_rating(sender, instance, created, **kwargs):
+    """Move the product's star counters to the review's current rating"""
+    current = (instance.product_id, instance.rating)
+    previous = None if created else getattr(instance, '_loaded_rating', None)
+    if previous == current:
+        return
+    if previous is not None and None not in previous:
+        Product.adjust_rating_counts(previous[0], previous[1], -1)
+    Product.adjust_rating_counts(instance.product_id, instance.rating, 1)
+    instance.remember_rating()
+
+@receiver(post_delete, sender=ProductReview)
+def uncount_review_rating(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Product) or getattr(origin, 'model', None) is Product:
+        return
+    product_id, rating = getattr(instance, '_loaded_rating', (instance.product_id, instance.rating))
+    Product.adjust_rating_counts(product_id, rating, -1)
@@ -0,0 +1,150 @@
+"""
+Celery tasks: the order-events pipeline, inventory and cart housekeeping.
+
+Checkout enqueues one dispatch_order_events task per commit (see
+store.checkout.enqueue_order_events); it fans out to the side-effect tasks
+below, each retried with backoff. With no broker configured the tasks run
+eagerly (CELERY_TASK_ALWAYS_EAGER).
+"""
+import json
+import logging
+
+from celery import group, shared_task
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .carts import get_cart_store
+from .inventory import release_expired, sync_striped_total
+from .models import Order, OrderItem, Payment, ProductVariant
+
+analytics_logger = logging.getLogger('store.analytics')
+
+RETRY_OPTIONS = {
+    'autoretry_for': (Exception,),
+    'retry_backoff': True,
+    'retry_jitter': True,
+    'max_retries': 5,
+}
+
+
+@shared_task
+def release_expired_reservations(batch_size=1000):
+    """Return lapsed cart holds to available stock; scheduled by celery beat"""
+    return release_expired(batch_size=batch_size)
+
+
+@shared_task(**RETRY_OPTIONS)
+def persist_carts(batch_size=500):
+    """Write changed Redis carts behind to their rows; scheduled by celery beat"""
+    return get_cart_store().persist_dirty(batch_size=batch_size)
+
+
+@shared_task
+def dispatch_order_events(order_ids, payment_method='card'):
+    """
+    Fan an order-placed event out to its side-effect tasks, sent once as a
+    group. The fan-out itself is not retried, so a failed send never emails
+    or opens a payment twice; each side effect retries on its own.
+    """
+    variant_ids = OrderItem.objects.filter(order_id__in=order_ids).values_list('variant_id', flat=True).distinct()
+    group(
+        [
+            task
+            for order_id in order_ids
+            for task in (send_order_confirmation.s(order_id), create_order_payment.s(order_id, payment_method))
+        ]
+        + [
+            notify_low_stock.s([str(variant_id) for variant_id in variant_ids]),
+            record_order_analytics.s(order_ids),
+        ]
+    ).apply_async()
+
+
+@shared_task(**RETRY_OPTIONS)
+def send_order_confirmation(order_id):
+    order = Order.objects.select_related('user').get(pk=order_id)
+    lines = [
+        f"{item.quantity} x {item.variant.product.name} ({item.variant.size}) - {item.total_price}"
+        for item in order.items.select_related('variant__product')
+    ]
+    send_mail(
+        f"Order {order.id} confirmed",
+        "Thank you for your order.\n\n" + "\n".join(lines) + f"\n\nTotal: {order.total_amount}",
+        settings.DEFAULT_FROM_EMAIL,
+        [order.user.email],
+    )
+
+
+@shared_task(**RETRY_OPTIONS)
+def create_order_payment(order_id, payment_method='card'):
+    """Open the pending payment for an order (idempotent under retries)"""
+    order = Order.objects.get(pk=order_id)
+    Payment.objects.get_or_create(order=order, defaults={'method': payment_method, 'amount': order.total_amount})
+
+
+@shared_task(**RETRY_OPTIONS)
+def notify_low_stock(variant_ids=None, batch_size=500):
+    """
+    Alert staff once per low-stock crossing (of `variant_ids`, or all).
+
+    Unalerted low variants are claimed by stamping low_stock_notified_at
+    in the same transaction that sends the digest, so concurrent runs never
+    alert twice and a failed send is retried. Alerted variants that were
+    restocked above their threshold are re-armed first. Striped variants
+    only resync inventory_quantity when a stripe runs dry, so their totals
+    are refreshed from the stripes before checking.
+    """
+    striped = ProductVariant.objects.filter(stripe_count__gt=0)
+    if variant_ids is not None:
+        striped = striped.filter(pk__in=variant_ids)
+    sync_striped_total(list(striped.values_list('pk', flat=True)))
+
+    ProductVariant.objects.filter(low_stock_notified_at__isnull=False).exclude(
+        ProductVariant.LOW_STOCK
+    ).update(low_stock_notified_at=None)
+    if not settings.LOW_STOCK_ALERT_EMAILS:
+        return 0
+
+    pending = ProductVariant.objects.filter(ProductVariant.LOW_STOCK, low_stock_notified_at__isnull=True)
+    if variant_ids is not None:
+        pending = pending.filter(pk__in=variant_ids)
+
+    with transaction.atomic():
+        claimed = list(
+            pending.select_for_update(skip_locked=True, of=('self',)).select_related('product')
+            .order_by('inventory_quantity', 'id')[:batch_size]
+        )
+        if not claimed:
+            return 0
+        ProductVariant.objects.filter(pk__in=[variant.pk for variant in claimed]).update(
+            low_stock_notified_at=timezone.now()
+        )
+        send_mail(
+            f"Low stock: {len(claimed)} variant(s)",
+            "\n".join(
+                f"{variant}: {variant.inventory_quantity} left (threshold {variant.low_stock_threshold})"
+                for variant in claimed
+            ),
+            settings.DEFAULT_FROM_EMAIL,
+            settings.LOW_STOCK_ALERT_EMAILS,
+        )
+    return len(claimed)
+
+
+@shared_task(**RETRY_OPTIONS)
+def record_order_analytics(order_ids):
+    """Emit one structured sales record per order for the analytics pipeline"""
+    rows = OrderItem.objects.filter(order_id__in=order_ids).values(
+        'order_id', 'order__user_id', 'order__total_amount'
+    ).annotate(units=Sum('quantity'))
+    for row in rows:
+        analytics_logger.info(json.dumps({
+            'event': 'order_placed',
+            'order_id': str(row['order_id']),
+            'user_id': row['order__user_id'],
+            'total_amount': str(row['order__total_amount']),
+            'units': row['units'],
+        }))
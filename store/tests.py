@@ -2,10 +2,16 @@ from django.test import TestCase
 
 # Create your tests here.
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from decimal import Decimal
-from .models import Category, Product, ProductVariant, Cart, CartItem, Order
+from .search import product_index
+from .models import (
+    Category, Product, ProductVariant, ProductImage, ProductSummary, ProductReview, Cart, CartItem, Order
+)
 
 User = get_user_model()
 
@@ -51,6 +57,1418 @@ class ProductTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['results']), 1)
 
+class ProductListQueryTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Shirts')
+
+    def create_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(
+                name=f'Shirt {Product.objects.count()}',
+                description='Cotton shirt',
+                category=self.category,
+                status='active'
+            )
+            ProductVariant.objects.create(product=product, size='S', price=Decimal('10.00'), inventory_quantity=0)
+            ProductVariant.objects.create(product=product, size='M', price=Decimal('20.00'), inventory_quantity=3)
+            ProductVariant.objects.create(product=product, size='L', price=Decimal('25.00'), inventory_quantity=1)
+            ProductImage.objects.create(product=product, image='products/shirt.jpg', is_main=True)
+
+    def test_list_fields_come_from_summary(self):
+        """Test list rows expose stock, price range, sizes and main image"""
+        self.create_products(1)
+        response = self.client.get('/api/store/products/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        row = response.data['results'][0]
+        self.assertTrue(row['is_in_stock'])
+        self.assertEqual(row['price_range'], {'min': 20.0, 'max': 25.0})
+        self.assertEqual(sorted(row['available_sizes']), ['L', 'M'])
+        self.assertTrue(row['main_image'].endswith('/products/shirt.jpg'))
+        self.assertEqual(row['category']['product_count'], 1)
+
+    def test_list_query_count_is_constant(self):
+        """Test a product page costs the same number of queries at any size"""
+        self.create_products(2)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/store/products/?page_size=50')
+        self.assertEqual(len(response.data['results']), 2)
+
+        self.create_products(20)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/store/products/?page_size=50')
+        self.assertEqual(len(response.data['results']), 22)
+
+class ProductSummaryTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Shoes')
+        self.product = Product.objects.create(
+            name='Runner', description='Running shoe', category=self.category, status='active'
+        )
+        self.variant = ProductVariant.objects.create(
+            product=self.product, size='M', price=Decimal('50.00'), inventory_quantity=2
+        )
+
+    def test_summary_follows_variant_writes(self):
+        """Test the summary is refreshed when variants change or go away"""
+        summary = ProductSummary.objects.get(product=self.product)
+        self.assertTrue(summary.in_stock)
+        self.assertEqual(summary.min_price, Decimal('50.00'))
+
+        ProductVariant.objects.create(product=self.product, size='L', price=Decimal('40.00'), inventory_quantity=1)
+        self.variant.inventory_quantity = 0
+        self.variant.save()
+        summary.refresh_from_db()
+        self.assertEqual((summary.min_price, summary.max_price), (Decimal('40.00'), Decimal('40.00')))
+        self.assertEqual(summary.available_sizes, ['L'])
+
+        ProductVariant.objects.filter(product=self.product).delete()
+        summary.refresh_from_db()
+        self.assertFalse(summary.in_stock)
+        self.assertIsNone(summary.min_price)
+
+    def test_deleting_product_removes_summary(self):
+        """Test cascading variant deletes do not resurrect the summary"""
+        self.product.delete()
+        self.assertFalse(ProductSummary.objects.exists())
+
+    def test_price_ordering(self):
+        """Test ordering=price / -price use the summary price range"""
+        cheap = Product.objects.create(name='Flat', description='Flat shoe', category=self.category, status='active')
+        ProductVariant.objects.create(product=cheap, size='S', price=Decimal('15.00'), inventory_quantity=4)
+
+        response = self.client.get('/api/store/products/?ordering=price')
+        self.assertEqual([row['slug'] for row in response.data['results']], ['flat', 'runner'])
+        response = self.client.get('/api/store/products/?ordering=-price')
+        self.assertEqual([row['slug'] for row in response.data['results']], ['runner', 'flat'])
+
+class CatalogCacheTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Hats')
+        self.product = Product.objects.create(
+            name='Cap', description='Baseball cap', category=self.category, status='active'
+        )
+        self.variant = ProductVariant.objects.create(
+            product=self.product, size='M', price=Decimal('12.00'), inventory_quantity=5
+        )
+
+    def test_anonymous_repeat_requests_are_cached(self):
+        """Test identical anonymous requests skip the database"""
+        first = self.client.get('/api/store/products/?ordering=name&page=1')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/store/products/?page=1&ordering=name&utm=x')
+        self.assertEqual(first.data, second.data)
+        self.client.get(f'/api/store/categories/{self.category.slug}/')
+        with self.assertNumQueries(0):
+            self.client.get(f'/api/store/categories/{self.category.slug}/')
+
+    def test_writes_invalidate_cached_responses(self):
+        """Test variant and category writes bump the cache generation"""
+        response = self.client.get('/api/store/products/')
+        self.assertEqual(response.data['results'][0]['price_range']['min'], 12.0)
+
+        self.variant.price = Decimal('9.00')
+        self.variant.save()
+        response = self.client.get('/api/store/products/')
+        self.assertEqual(response.data['results'][0]['price_range']['min'], 9.0)
+
+        self.category.name = 'Caps'
+        self.category.save()
+        response = self.client.get('/api/store/products/')
+        self.assertEqual(response.data['results'][0]['category']['name'], 'Caps')
+
+    def test_authenticated_requests_bypass_cache(self):
+        """Test only anonymous traffic is served from the cache"""
+        user = User.objects.create_user(username='shopper', email='shopper@example.com', password='testpass123')
+        self.client.get('/api/store/products/')
+        self.client.force_authenticate(user=user)
+        with self.assertNumQueries(2):
+            self.client.get('/api/store/products/')
+
+class ProductCursorPaginationTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Socks')
+        for i, price in enumerate(['5.00', '7.50', '5.00', None, '12.00', '7.50', None]):
+            product = Product.objects.create(
+                name=f'Sock {i % 3}', description='Wool sock', slug=f'sock-{i}',
+                category=category, status='active'
+            )
+            if price is not None:
+                ProductVariant.objects.create(product=product, size='M', price=Decimal(price), inventory_quantity=1)
+
+    def walk(self, url):
+        slugs = []
+        response = self.client.get(url)
+        self.assertNotIn('count', response.data)
+        while True:
+            slugs.extend(row['slug'] for row in response.data['results'])
+            if not response.data['next']:
+                return slugs, response
+            response = self.client.get(response.data['next'])
+
+    def test_cursor_pages_match_offset_ordering(self):
+        """Test walking cursor pages yields every product once, in order"""
+        for ordering in ['-created_at', 'created_at', 'name', '-name', 'price', '-price']:
+            expected = [
+                row['slug'] for row in
+                self.client.get(f'/api/store/products/?ordering={ordering}&page_size=100').data['results']
+            ]
+            slugs, _ = self.walk(f'/api/store/products/?pagination=cursor&ordering={ordering}&page_size=2')
+            self.assertEqual(len(slugs), 7)
+            self.assertEqual(len(set(slugs)), 7)
+            if ordering.endswith('created_at'):
+                self.assertEqual(slugs, expected)
+        # Products without stock have no price and sort last either way
+        slugs, _ = self.walk('/api/store/products/?pagination=cursor&ordering=-price&page_size=2')
+        self.assertEqual(slugs[0], 'sock-4')
+        self.assertEqual(set(slugs[-2:]), {'sock-3', 'sock-6'})
+
+    def test_previous_link_returns_prior_page(self):
+        """Test the previous cursor walks back to the same rows"""
+        first = self.client.get('/api/store/products/?pagination=cursor&ordering=price&page_size=3')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(
+            [row['slug'] for row in back.data['results']],
+            [row['slug'] for row in first.data['results']]
+        )
+
+    def test_invalid_cursor(self):
+        """Test a tampered cursor is rejected"""
+        response = self.client.get('/api/store/products/?cursor=bm90LWpzb24')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        import base64
+        import json
+
+        product_id = Product.objects.values_list('id', flat=True).first()
+        for ordering, payload in [
+            ('price', {'o': 'price', 'v': 'abc', 'id': str(product_id)}),
+            ('-created_at', {'o': '-created_at', 'v': 'not-a-date', 'id': str(product_id)}),
+            ('price', {'o': 'price', 'v': '10.00', 'id': 'not-a-uuid'}),
+        ]:
+            cursor = base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+            response = self.client.get(f'/api/store/products/?ordering={ordering}&cursor={cursor}')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class ProductSearchTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        product_index.clear()
+        category = Category.objects.create(name='Outerwear')
+        self.make(category, 'Rain Jacket', 'Waterproof shell for hiking')
+        self.make(category, 'Hiking Boots', 'Leather boots with a waterproof membrane')
+        self.make(category, 'Fleece', 'Warm layer worn under a rain jacket')
+
+    def make(self, category, name, description):
+        return Product.objects.create(name=name, description=description, category=category, status='active')
+
+    def search(self, term):
+        response = self.client.get('/api/store/products/', {'search': term})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['name'] for row in response.data['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        """Test results are ranked with name hits first"""
+        self.assertEqual(self.search('jacket'), ['Rain Jacket', 'Fleece'])
+        self.assertEqual(self.search('hiking'), ['Hiking Boots', 'Rain Jacket'])
+
+    def test_prefix_and_all_terms_match(self):
+        """Test terms match as prefixes and must all be present"""
+        self.assertEqual(set(self.search('waterpr')), {'Rain Jacket', 'Hiking Boots'})
+        self.assertEqual(self.search('rain boot'), [])
+
+    def test_index_follows_product_writes(self):
+        """Test renamed and new products are searchable immediately"""
+        self.search('fleece')
+        fleece = Product.objects.get(name='Fleece')
+        fleece.name = 'Polar Fleece'
+        fleece.save()
+        self.make(fleece.category, 'Polar Hat', 'Knitted')
+        self.assertEqual(set(self.search('polar')), {'Polar Fleece', 'Polar Hat'})
+
+class ProductFacetsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        tops = Category.objects.create(name='Tops')
+        bottoms = Category.objects.create(name='Bottoms')
+        for name, category, variants in [
+            ('Tee', tops, [('S', '15.00', 3), ('M', '15.00', 0)]),
+            ('Polo', tops, [('M', '40.00', 2)]),
+            ('Jeans', bottoms, [('L', '80.00', 0)]),
+        ]:
+            product = Product.objects.create(name=name, description=name, category=category, status='active')
+            for size, price, quantity in variants:
+                ProductVariant.objects.create(
+                    product=product, size=size, price=Decimal(price), inventory_quantity=quantity
+                )
+
+    def test_facet_counts(self):
+        """Test all facets are counted in one grouped query"""
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/store/products/facets/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data
+        self.assertEqual((data['total'], data['in_stock']), (3, 2))
+        self.assertEqual(
+            {c['slug']: c['count'] for c in data['categories']}, {'tops': 2, 'bottoms': 1}
+        )
+        self.assertEqual({s['size']: s['count'] for s in data['sizes']}, {'S': 1, 'M': 2, 'L': 1})
+        self.assertEqual(
+            {b['key']: b['count'] for b in data['price_buckets'] if b['count']}, {'0-25': 1, '25-50': 1}
+        )
+
+    def test_facets_respect_filters_and_cache(self):
+        """Test facets use the list filters and are cached per filter set"""
+        response = self.client.get('/api/store/products/facets/?category=tops')
+        self.assertEqual(response.data['total'], 2)
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/store/products/facets/?category=tops')
+        self.assertEqual(cached.data, response.data)
+
+class CategoryCountTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.categories = [Category.objects.create(name=f'Category {i}') for i in range(4)]
+        for category in self.categories:
+            for i, status_value in enumerate(['active', 'active', 'draft']):
+                Product.objects.create(
+                    name=f'{category.name} item {i}', description='Item',
+                    category=category, status=status_value
+                )
+
+    def test_category_list_counts_in_one_query(self):
+        """Test active product counts come from a single grouped query"""
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/store/categories/')
+        self.assertEqual([row['product_count'] for row in response.data['results']], [2, 2, 2, 2])
+
+    def test_nested_category_follows_status_changes(self):
+        """Test the category map refreshes when a product's status changes"""
+        response = self.client.get('/api/store/products/')
+        self.assertEqual(response.data['results'][0]['category']['product_count'], 2)
+
+        draft = Product.objects.filter(status='draft').first()
+        draft.status = 'active'
+        draft.save()
+        response = self.client.get('/api/store/products/', {'category': draft.category.slug})
+        self.assertEqual(response.data['results'][0]['category']['product_count'], 3)
+
+        # Edits that keep status and category leave the map alone
+        draft.description = 'Updated'
+        draft.save()
+        with self.assertNumQueries(2):
+            self.client.get('/api/store/products/')
+
+class ProductFilterTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Dresses')
+        self.mixed = Product.objects.create(name='Mixed', description='Mixed', category=category, status='active')
+        ProductVariant.objects.create(product=self.mixed, size='S', price=Decimal('10.00'), inventory_quantity=0)
+        ProductVariant.objects.create(product=self.mixed, size='L', price=Decimal('90.00'), inventory_quantity=4)
+        self.cheap = Product.objects.create(name='Cheap', description='Cheap', category=category, status='active')
+        ProductVariant.objects.create(product=self.cheap, size='S', price=Decimal('12.00'), inventory_quantity=2)
+        ProductVariant.objects.create(product=self.cheap, size='M', price=Decimal('14.00'), inventory_quantity=2)
+
+    def filtered(self, **params):
+        response = self.client.get('/api/store/products/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(row['name'] for row in response.data['results'])
+
+    def test_variant_predicates_apply_to_one_variant(self):
+        """Test price, size and stock must all hold for the same variant"""
+        self.assertEqual(self.filtered(size='S', max_price='20'), ['Cheap', 'Mixed'])
+        self.assertEqual(self.filtered(size='S', max_price='20', in_stock='true'), ['Cheap'])
+        self.assertEqual(self.filtered(size='L', max_price='20'), [])
+        self.assertEqual(self.filtered(min_price='13', max_price='50'), ['Cheap'])
+        self.assertEqual(self.filtered(in_stock='true'), ['Cheap', 'Mixed'])
+
+    def test_filtered_rows_are_not_duplicated(self):
+        """Test matching several variants does not repeat the product"""
+        response = self.client.get('/api/store/products/', {'max_price': '100'})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['results']), 2)
+
+class ProductReviewStatsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Bags')
+        self.product = Product.objects.create(
+            name='Tote', description='Canvas tote', category=category, status='active'
+        )
+        self.users = [
+            User.objects.create_user(username=f'reviewer{i}', email=f'reviewer{i}@example.com', password='testpass123')
+            for i in range(8)
+        ]
+        for user, rating in zip(self.users, [5, 5, 4, 4, 4, 3, 1, 5]):
+            ProductReview.objects.create(product=self.product, user=user, rating=rating, comment='Nice')
+
+    def test_counters_follow_review_writes(self):
+        """Test star counters change on review create, update and delete"""
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_histogram, {1: 1, 2: 0, 3: 1, 4: 3, 5: 3})
+
+        review = ProductReview.objects.get(product=self.product, user=self.users[6])
+        review.rating = 2
+        review.save()
+        ProductReview.objects.get(product=self.product, user=self.users[0]).delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_histogram, {1: 0, 2: 1, 3: 1, 4: 3, 5: 2})
+        self.assertEqual(self.product.average_rating, 3.9)
+
+    def test_stale_product_save_keeps_counters(self):
+        """Test saving a product loaded before new reviews keeps the counters"""
+        stale = Product.objects.get(pk=self.product.pk)
+        ProductReview.objects.filter(user=self.users[7]).delete()
+        ProductReview.objects.create(product=self.product, user=self.users[7], rating=1)
+        stale.description = 'Heavy canvas tote'
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual(stale.rating_1_count, 2)
+
+    def test_detail_embeds_bounded_reviews(self):
+        """Test the detail payload has the summary and only the first reviews"""
+        response = self.client.get(f'/api/store/products/{self.product.slug}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['reviews']), 5)
+        self.assertEqual(response.data['review_count'], 8)
+        self.assertEqual(response.data['rating_summary']['histogram']['4'], 3)
+        self.assertEqual(response.data['average_rating'], 3.9)
+        self.assertTrue(response.data['reviews_url'].endswith(f'/api/store/products/{self.product.slug}/reviews/'))
+
+        reviews = self.client.get(response.data['reviews_url'])
+        self.assertEqual(reviews.data['count'], 8)
+
+    def test_review_endpoint_creates_and_counts(self):
+        """Test posting through the nested endpoint updates the counters"""
+        author = User.objects.create_user(username='author', email='author@example.com', password='testpass123')
+        self.client.force_authenticate(user=author)
+        response = self.client.post(
+            f'/api/store/products/{self.product.slug}/reviews/', {'rating': 2, 'comment': 'Thin'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_2_count, 1)
+
+class ConditionalGetTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Belts')
+        self.product = Product.objects.create(
+            name='Belt', description='Leather belt', category=self.category, status='active'
+        )
+        self.variant = ProductVariant.objects.create(
+            product=self.product, size='M', price=Decimal('20.00'), inventory_quantity=2
+        )
+        self.user = User.objects.create_user(username='critic', email='critic@example.com', password='testpass123')
+
+    def assertRevalidates(self, url, queries=0):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(queries):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        since = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(since.status_code, status.HTTP_304_NOT_MODIFIED)
+        return response['ETag']
+
+    def test_catalog_endpoints_return_304(self):
+        """Test matching validators short-circuit before serialization"""
+        self.assertRevalidates('/api/store/products/')
+        self.assertRevalidates('/api/store/categories/')
+        self.assertRevalidates(f'/api/store/products/{self.product.slug}/', queries=1)
+        self.assertRevalidates(f'/api/store/products/{self.product.slug}/reviews/', queries=1)
+
+    def test_writes_change_validators(self):
+        """Test variant and review writes produce new ETags"""
+        detail = f'/api/store/products/{self.product.slug}/'
+        reviews = f'/api/store/products/{self.product.slug}/reviews/'
+        detail_etag = self.assertRevalidates(detail, queries=1)
+        reviews_etag = self.assertRevalidates(reviews, queries=1)
+
+        self.variant.price = Decimal('18.00')
+        self.variant.save()
+        response = self.client.get(detail, HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        review = ProductReview.objects.create(product=self.product, user=self.user, rating=4)
+        response = self.client.get(reviews, HTTP_IF_NONE_MATCH=reviews_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        reviews_etag = response['ETag']
+        review.delete()
+        response = self.client.get(reviews, HTTP_IF_NONE_MATCH=reviews_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_stock_changes_change_detail_validators(self):
+        """Test orders and cart holds (set-based updates) produce new detail ETags"""
+        detail = f'/api/store/products/{self.product.slug}/'
+        etag = self.assertRevalidates(detail, queries=1)
+
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/store/orders/', {
+                'shipping_address': '1 Main St', 'phone': '555-0100',
+                'items': [{'variant_id': str(self.variant.id), 'quantity': 1}],
+            }, format='json')
+        self.client.force_authenticate(user=None)
+        response = self.client.get(detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['variants'][0]['inventory_quantity'], 1)
+
+        etag = response['ETag']
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/store/carts/add_item/', {
+                'variant_id': str(self.variant.id), 'quantity': 1
+            }, format='json')
+        self.client.force_authenticate(user=None)
+        response = self.client.get(detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['variants'][0]['available_quantity'], 0)
+
+    def test_listings_only_move_when_stock_runs_out(self):
+        """Test holds and partial sales keep list validators and cached lists; selling out moves them"""
+        listing = '/api/store/products/'
+        etag = self.assertRevalidates(listing)
+
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/store/carts/add_item/', {
+                'variant_id': str(self.variant.id), 'quantity': 1
+            }, format='json')
+            self.client.post('/api/store/orders/', {
+                'shipping_address': '1 Main St', 'phone': '555-0100',
+                'items': [{'variant_id': str(self.variant.id), 'quantity': 1}],
+            }, format='json')
+        self.client.force_authenticate(user=None)
+        with self.assertNumQueries(0):
+            response = self.client.get(listing, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Checking the cart out sells its held, last unit
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/store/orders/', {
+                'from_cart': True, 'shipping_address': '1 Main St', 'phone': '555-0100'
+            }, format='json')
+        self.client.force_authenticate(user=None)
+        response = self.client.get(listing, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['results'][0]['is_in_stock'])
+
+class CheckoutTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name='Coats')
+        self.product = Product.objects.create(name='Coat', description='Coat', category=category, status='active')
+        self.small = ProductVariant.objects.create(product=self.product, size='S', price=Decimal('50.00'), inventory_quantity=5)
+        self.large = ProductVariant.objects.create(product=self.product, size='L', price=Decimal('60.00'), inventory_quantity=1)
+
+    def place(self, *lines):
+        return self.client.post('/api/store/orders/', {
+            'shipping_address': '1 Main St',
+            'phone': '555-0100',
+            'items': [{'variant_id': str(variant.id), 'quantity': quantity} for variant, quantity in lines],
+        }, format='json')
+
+    def test_order_decrements_stock_and_merges_lines(self):
+        """Test duplicate lines are merged and stock is taken atomically"""
+        response = self.place((self.small, 2), (self.large, 1), (self.small, 1))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.total_amount, Decimal('210.00'))
+        self.assertEqual(
+            sorted(order.items.values_list('variant__size', 'quantity', 'price')),
+            [('L', 1, Decimal('60.00')), ('S', 3, Decimal('50.00'))]
+        )
+        self.small.refresh_from_db()
+        self.large.refresh_from_db()
+        self.assertEqual((self.small.inventory_quantity, self.large.inventory_quantity), (2, 0))
+        # The large size sold out, so the listing summary no longer offers it
+        self.assertEqual(ProductSummary.objects.get(product=self.product).available_sizes, ['S'])
+
+    def test_oversell_rolls_back_whole_order(self):
+        """Test one short line rejects the order without touching other stock"""
+        response = self.place((self.small, 2), (self.large, 2))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+        self.small.refresh_from_db()
+        self.assertEqual(self.small.inventory_quantity, 5)
+
+    def test_conditional_decrement_guards_stale_reads(self):
+        """Test stock that ran out after it was read is still never oversold"""
+        from rest_framework.exceptions import ValidationError
+        from .checkout import decrement_stock
+
+        stale = {variant.pk: variant for variant in ProductVariant.objects.filter(product=self.product)}
+        ProductVariant.objects.filter(pk=self.large.pk).update(inventory_quantity=0)
+        with self.assertRaises(ValidationError):
+            decrement_stock(stale, {self.small.pk: 1, self.large.pk: 1})
+        self.large.refresh_from_db()
+        self.assertEqual(self.large.inventory_quantity, 0)
+
+    def test_checkout_query_count_is_constant(self):
+        """Test the number of queries does not grow with the number of lines"""
+        variants = [
+            ProductVariant.objects.create(product=self.product, size=size, price=Decimal('10.00'), inventory_quantity=9)
+            for size in ('XS', 'M', 'XL', 'XXL')
+        ]
+        with self.assertNumQueries(6):
+            self.assertEqual(self.place((self.small, 1)).status_code, status.HTTP_201_CREATED)
+        with self.assertNumQueries(6):
+            self.assertEqual(
+                self.place(*[(variant, 1) for variant in variants]).status_code, status.HTTP_201_CREATED
+            )
+
+class InventoryReservationTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Sneakers')
+        product = Product.objects.create(name='Drop', description='Drop', category=category, status='active')
+        self.variant = ProductVariant.objects.create(product=product, size='M', price=Decimal('100.00'), inventory_quantity=3)
+        self.first = User.objects.create_user(username='first', email='first@example.com', password='testpass123')
+        self.second = User.objects.create_user(username='second', email='second@example.com', password='testpass123')
+
+    def add(self, user, quantity):
+        self.client.force_authenticate(user=user)
+        return self.client.post('/api/store/carts/add_item/', {'variant_id': str(self.variant.id), 'quantity': quantity})
+
+    def test_add_item_holds_stock(self):
+        """Test a cart line reserves stock other carts cannot take"""
+        self.assertEqual(self.add(self.first, 2).status_code, status.HTTP_201_CREATED)
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.reserved_quantity, self.variant.available_quantity), (2, 1))
+
+        response = self.add(self.second, 2)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['available'], 1)
+        self.assertEqual(self.add(self.second, 1).status_code, status.HTTP_201_CREATED)
+
+    def test_expired_holds_are_swept(self):
+        """Test the sweep task releases lapsed holds in bulk"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import InventoryReservation
+        from .tasks import release_expired_reservations
+
+        self.add(self.first, 2)
+        self.add(self.second, 1)
+        InventoryReservation.objects.filter(cart__user=self.first).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(release_expired_reservations.delay().get(), 1)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved_quantity, 1)
+        self.assertEqual(InventoryReservation.objects.get().cart.user, self.second)
+
+    def test_lapsed_holds_do_not_block_new_carts(self):
+        """Test a short variant frees lapsed holds before refusing a cart"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import InventoryReservation
+
+        self.add(self.first, 3)
+        InventoryReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.add(self.second, 3).status_code, status.HTTP_201_CREATED)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved_quantity, 3)
+
+    def test_checkout_converts_holds(self):
+        """Test checkout sells held units and other carts' holds stay intact"""
+        self.add(self.second, 1)
+        self.add(self.first, 2)
+        response = self.client.post('/api/store/orders/', {
+            'from_cart': True, 'shipping_address': '1 Main St', 'phone': '555-0100'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.inventory_quantity, self.variant.reserved_quantity), (1, 1))
+
+        # Without a hold, a direct order cannot take the unit held by another cart
+        response = self.client.post('/api/store/orders/', {
+            'shipping_address': '1 Main St', 'phone': '555-0100',
+            'items': [{'variant_id': str(self.variant.id), 'quantity': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_clear_releases_holds(self):
+        """Test clearing the cart gives its stock back"""
+        self.add(self.first, 2)
+        self.client.post('/api/store/carts/clear/')
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved_quantity, 0)
+
+class InventoryStripeTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='flash', email='flash@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name='Drops')
+        self.product = Product.objects.create(name='Hyped', description='Hyped', category=category, status='active')
+        self.variant = ProductVariant.objects.create(product=self.product, size='M', price=Decimal('80.00'), inventory_quantity=10)
+
+    def order(self, quantity):
+        return self.client.post('/api/store/orders/', {
+            'shipping_address': '1 Main St', 'phone': '555-0100',
+            'items': [{'variant_id': str(self.variant.id), 'quantity': quantity}],
+        }, format='json')
+
+    def stripes(self):
+        return list(self.variant.stripes.values_list('quantity', flat=True))
+
+    def test_rebalance_spreads_stock(self):
+        """Test striping splits stock evenly and folding restores it"""
+        from .inventory import rebalance_stripes
+
+        rebalance_stripes(self.variant, 4)
+        self.assertEqual(self.stripes(), [3, 3, 2, 2])
+        rebalance_stripes(self.variant, 3, stock=7)
+        self.assertEqual(self.stripes(), [3, 2, 2])
+        rebalance_stripes(self.variant, 0)
+        self.variant.refresh_from_db()
+        self.assertEqual((self.stripes(), self.variant.inventory_quantity, self.variant.stripe_count), ([], 7, 0))
+
+    def test_checkout_takes_from_stripes(self):
+        """Test striped checkout never oversells and drains fragmented stripes"""
+        from .inventory import rebalance_stripes, stock_level
+
+        rebalance_stripes(self.variant, 4)
+        for _ in range(3):
+            self.assertEqual(self.order(2).status_code, status.HTTP_201_CREATED)
+        self.variant.refresh_from_db()
+        self.assertEqual(stock_level(self.variant), 4)
+
+        # The last units sell even when no single stripe holds them all
+        self.assertEqual(self.order(4).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.order(1).status_code, status.HTTP_400_BAD_REQUEST)
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.inventory_quantity, sum(self.stripes())), (0, 0))
+        self.assertFalse(ProductSummary.objects.get(product=self.product).in_stock)
+
+    def test_rebalance_command(self):
+        """Test the management command stripes and restocks variants"""
+        from django.core.management import call_command
+        from io import StringIO
+
+        call_command('rebalance_inventory_stripes', variant=[str(self.variant.pk)], stripes=2, stdout=StringIO())
+        self.assertEqual(self.stripes(), [5, 5])
+        self.variant.stripes.filter(index=0).update(quantity=1)
+        call_command('rebalance_inventory_stripes', stdout=StringIO())
+        self.assertEqual(self.stripes(), [3, 3])
+
+class BulkOrderTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(
+            username='partner', email='partner@example.com', password='testpass123', is_staff=True
+        )
+        self.customer = User.objects.create_user(username='retail', email='retail@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.staff)
+        category = Category.objects.create(name='Wholesale')
+        product = Product.objects.create(name='Tee', description='Tee', category=category, status='active')
+        self.small = ProductVariant.objects.create(product=product, size='S', price=Decimal('5.00'), inventory_quantity=10)
+        self.large = ProductVariant.objects.create(product=product, size='L', price=Decimal('6.00'), inventory_quantity=3)
+
+    def entry(self, reference, *lines, **extra):
+        return dict({
+            'reference': reference, 'shipping_address': 'Depot 4', 'phone': '555-0199',
+            'items': [{'variant_id': str(variant.id), 'quantity': quantity} for variant, quantity in lines],
+        }, **extra)
+
+    def test_bulk_reports_each_order(self):
+        """Test valid orders are created and failures are reported per order"""
+        response = self.client.post('/api/store/orders/bulk/', {'orders': [
+            self.entry('A', (self.small, 4), (self.large, 2)),
+            self.entry('B', (self.large, 2)),
+            self.entry('C', (self.small, 6), customer_email='retail@example.com'),
+            self.entry('D', (self.small, 1), customer_email='nobody@example.com'),
+            {'reference': 'E', 'items': []},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 3))
+        self.assertEqual(
+            [(result['reference'], result['status']) for result in response.data['results']],
+            [('A', 'created'), ('B', 'failed'), ('C', 'created'), ('D', 'failed'), ('E', 'failed')]
+        )
+        self.assertIn('Available: 1', str(response.data['results'][1]['errors']))
+        self.assertEqual(Order.objects.get(id=response.data['results'][2]['order_id']).user, self.customer)
+
+        self.small.refresh_from_db()
+        self.large.refresh_from_db()
+        self.assertEqual((self.small.inventory_quantity, self.large.inventory_quantity), (0, 1))
+        self.assertEqual(Order.objects.get(id=response.data['results'][0]['order_id']).total_amount, Decimal('32.00'))
+
+    def test_bulk_query_count_is_per_batch(self):
+        """Test a batch costs the same queries whatever its number of orders"""
+        orders = [self.entry(str(i), (self.small, 1)) for i in range(8)]
+        with self.assertNumQueries(6):
+            response = self.client.post('/api/store/orders/bulk/', {'orders': orders}, format='json')
+        self.assertEqual(response.data['created'], 8)
+
+    def test_bulk_is_staff_only(self):
+        """Test customers cannot import orders"""
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.post('/api/store/orders/bulk/', {'orders': [self.entry('A', (self.small, 1))]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+class OrderEventsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='eventful', email='eventful@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name='Bags')
+        product = Product.objects.create(name='Tote', description='Tote', category=category, status='active')
+        self.variant = ProductVariant.objects.create(
+            product=product, size='M', price=Decimal('40.00'), inventory_quantity=6, low_stock_threshold=5
+        )
+
+    def place(self):
+        return self.client.post('/api/store/orders/', {
+            'shipping_address': '1 Main St', 'phone': '555-0100', 'payment_method': 'paypal',
+            'items': [{'variant_id': str(self.variant.id), 'quantity': 2}],
+        }, format='json')
+
+    def test_side_effects_wait_for_commit(self):
+        """Test nothing is enqueued until the order transaction commits"""
+        from django.core import mail
+        from .models import Payment
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.assertEqual(self.place().status_code, status.HTTP_201_CREATED)
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(len(mail.outbox), 0)
+
+        for callback in callbacks:
+            callback()
+        self.assertTrue(Payment.objects.exists())
+
+    def test_pipeline_runs_side_effects(self):
+        """Test the eager pipeline emails, opens the payment, alerts and records analytics"""
+        from django.core import mail
+        from django.test import override_settings
+        from .models import Payment
+
+        with override_settings(LOW_STOCK_ALERT_EMAILS=['ops@example.com']):
+            with self.assertLogs('store.analytics', level='INFO') as logs:
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.assertEqual(self.place().status_code, status.HTTP_201_CREATED)
+
+        order = Order.objects.get(user=self.user)
+        payment = Payment.objects.get(order=order)
+        self.assertEqual((payment.method, payment.status, payment.amount), ('paypal', 'pending', Decimal('80.00')))
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox), ['eventful@example.com', 'ops@example.com']
+        )
+        self.assertIn(str(order.id), logs.output[0])
+
+    def test_failed_fan_out_is_not_retried(self):
+        """Test a fan-out that fails to send is not rerun, so no side effect goes out twice"""
+        from unittest import mock
+        from django.core import mail
+        from .tasks import dispatch_order_events
+
+        with self.captureOnCommitCallbacks(execute=False):
+            self.assertEqual(self.place().status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get(user=self.user)
+
+        with mock.patch('store.tasks.group') as group:
+            group.return_value.apply_async.side_effect = ConnectionError('broker unavailable')
+            with self.assertRaises(ConnectionError):
+                dispatch_order_events.delay([str(order.id)])
+        self.assertEqual(group.return_value.apply_async.call_count, 1)
+        self.assertEqual(len(mail.outbox), 0)
+
+class IdempotencyTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='retrier', email='retrier@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name='Socks')
+        product = Product.objects.create(name='Wool socks', description='Socks', category=category, status='active')
+        self.variant = ProductVariant.objects.create(product=product, size='M', price=Decimal('9.00'), inventory_quantity=10)
+
+    def order(self, key, quantity=1):
+        return self.client.post('/api/store/orders/', {
+            'shipping_address': '1 Main St', 'phone': '555-0100',
+            'items': [{'variant_id': str(self.variant.id), 'quantity': quantity}],
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_order_is_replayed(self):
+        """Test a retry with the same key replays without creating a second order"""
+        first = self.order('order-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        with self.assertNumQueries(0):
+            retry = self.order('order-1')
+        self.assertEqual((retry.status_code, retry.data), (first.status_code, first.data))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+        self.assertEqual(self.order('order-2').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reuse_with_other_body_is_rejected(self):
+        """Test a key cannot be reused for a different request"""
+        self.order('order-1')
+        self.assertEqual(self.order('order-1', quantity=2).status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_retried_add_item_does_not_double_increment(self):
+        """Test add_item retries keep the cart quantity"""
+        for _ in range(2):
+            response = self.client.post(
+                '/api/store/carts/add_item/', {'variant_id': str(self.variant.id), 'quantity': 2},
+                HTTP_IDEMPOTENCY_KEY='cart-1'
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 2)
+
+class CartCheckoutTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cartbuyer', email='cartbuyer@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name='Basics')
+        sizes = [size for size, _ in ProductVariant.SIZE_CHOICES]
+        self.variants = []
+        for i in range(9):
+            product = Product.objects.create(name=f'Basic {i}', description='Basic', category=category, status='active')
+            self.variants += [
+                ProductVariant.objects.create(product=product, size=size, price=Decimal('3.00'), inventory_quantity=5)
+                for size in sizes
+            ]
+        self.cart = Cart.objects.create(user=self.user)
+
+    def checkout(self):
+        return self.client.post('/api/store/orders/', {
+            'from_cart': True, 'shipping_address': '1 Main St', 'phone': '555-0100'
+        }, format='json')
+
+    def fill(self, count):
+        CartItem.objects.bulk_create([
+            CartItem(cart=self.cart, variant=variant, quantity=2) for variant in self.variants[:count]
+        ])
+
+    def test_cart_checkout_query_count_is_constant(self):
+        """Test converting a 50-line cart costs the same queries as a 2-line one"""
+        self.fill(2)
+        with self.assertNumQueries(11):
+            self.assertEqual(self.checkout().status_code, status.HTTP_201_CREATED)
+
+        self.fill(50)
+        with self.assertNumQueries(11):
+            response = self.checkout()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['items']), 50)
+        self.assertEqual(response.data['total_amount'], '300.00')
+        # Stock in the response is the post-sale value, without a reload
+        self.assertEqual({item['variant']['inventory_quantity'] for item in response.data['items']}, {1, 3})
+        self.assertFalse(self.cart.items.exists())
+
+    def test_sale_after_a_concurrent_purchase_sees_fresh_stock(self):
+        """Test stock sold between reading the cart and checkout still marks the product sold out"""
+        from unittest import mock
+        from .carts import DatabaseCartStore
+
+        variant = self.variants[0]
+        ProductVariant.objects.filter(pk=variant.pk).update(inventory_quantity=2)
+        CartItem.objects.create(cart=self.cart, variant=variant, quantity=1)
+        read_items = DatabaseCartStore.items
+
+        def items_then_concurrent_sale(store, user):
+            items = read_items(store, user)
+            ProductVariant.objects.filter(pk=variant.pk).update(inventory_quantity=1)
+            return items
+
+        with mock.patch.object(DatabaseCartStore, 'items', items_then_concurrent_sale):
+            response = self.checkout()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['items'][0]['variant']['inventory_quantity'], 0)
+        self.assertNotIn(variant.size, ProductSummary.objects.get(product=variant.product).available_sizes)
+
+    def test_empty_and_missing_cart(self):
+        """Test the empty and missing cart errors are kept"""
+        self.assertEqual(self.checkout().data, {'error': 'Cart is empty'})
+        self.cart.delete()
+        self.assertEqual(self.checkout().status_code, status.HTTP_404_NOT_FOUND)
+
+class OrderHistoryTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='regular', email='regular@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name='Knitwear')
+        product = Product.objects.create(name='Cardigan', description='Cardigan', category=category, status='active')
+        ProductImage.objects.create(product=product, image='products/cardigan.jpg', is_main=True)
+        self.cheap = ProductVariant.objects.create(product=product, size='S', price=Decimal('20.00'), inventory_quantity=100)
+        other = Product.objects.create(name='Scarf', description='Scarf', category=category, status='active')
+        self.scarf = ProductVariant.objects.create(product=other, size='M', price=Decimal('5.00'), inventory_quantity=100)
+
+    def place(self, count):
+        for _ in range(count):
+            order = Order.objects.create(user=self.user, total_amount=Decimal('50.00'), shipping_address='x', phone='1')
+            order.items.create(variant=self.cheap, quantity=2, price=self.cheap.price)
+            order.items.create(variant=self.scarf, quantity=2, price=self.scarf.price)
+
+    def test_list_is_summarised(self):
+        """Test list rows carry counts and the lead item instead of nested items"""
+        self.place(1)
+        row = self.client.get('/api/store/orders/').data['results'][0]
+        self.assertNotIn('items', row)
+        self.assertEqual((row['item_count'], row['unit_count'], row['lead_item_name']), (2, 4, 'Cardigan'))
+        self.assertTrue(row['lead_item_thumbnail'].endswith('/media/products/cardigan.jpg'))
+
+        detail = self.client.get(f"/api/store/orders/{row['id']}/").data
+        self.assertEqual(len(detail['items']), 2)
+
+    def test_list_query_count_is_constant(self):
+        """Test the history page does not issue queries per order"""
+        self.place(2)
+        with self.assertNumQueries(2):
+            self.client.get('/api/store/orders/')
+        self.place(8)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/store/orders/')
+        self.assertEqual(len(response.data['results']), 10)
+
+class OrderLifecycleTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(
+            username='warehouse', email='warehouse@example.com', password='testpass123', is_staff=True
+        )
+        self.customer = User.objects.create_user(username='shopper2', email='shopper2@example.com', password='testpass123')
+        category = Category.objects.create(name='Boots')
+        product = Product.objects.create(name='Boot', description='Boot', category=category, status='active')
+        self.variant = ProductVariant.objects.create(product=product, size='L', price=Decimal('70.00'), inventory_quantity=0)
+
+    def orders(self, count, status_value='pending'):
+        orders = [
+            Order.objects.create(user=self.customer, total_amount=Decimal('70.00'), shipping_address='x', phone='1', status=status_value)
+            for _ in range(count)
+        ]
+        for order in orders:
+            order.items.create(variant=self.variant, quantity=1, price=self.variant.price)
+        return orders
+
+    def test_bulk_transition_reports_ineligible(self):
+        """Test one batch moves eligible orders, journals them and reports the rest"""
+        from uuid import uuid4
+        from .models import OrderStatusEvent
+
+        processing = self.orders(3, 'processing')
+        delivered = self.orders(1, 'delivered')
+        unknown = uuid4()
+        self.client.force_authenticate(user=self.staff)
+        with self.assertNumQueries(5):
+            response = self.client.post('/api/store/orders/bulk_transition/', {
+                'order_ids': [str(order.id) for order in processing + delivered] + [str(unknown)],
+                'status': 'shipped',
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual(response.data['ineligible'], [{'id': str(delivered[0].id), 'status': 'delivered'}])
+        self.assertEqual(response.data['missing'], [str(unknown)])
+        self.assertEqual(Order.objects.filter(status='shipped').count(), 3)
+        self.assertEqual(
+            set(OrderStatusEvent.objects.values_list('from_status', 'to_status', 'actor')),
+            {('processing', 'shipped', self.staff.pk)}
+        )
+
+    def test_cancel_restocks(self):
+        """Test customers can cancel their pending order and its stock returns"""
+        order = self.orders(1)[0]
+        self.client.force_authenticate(user=self.customer)
+        self.assertEqual(
+            self.client.post(f'/api/store/orders/{order.id}/transition/', {'status': 'shipped'}).status_code,
+            status.HTTP_403_FORBIDDEN
+        )
+        response = self.client.post(f'/api/store/orders/{order.id}/transition/', {'status': 'cancelled'})
+        self.assertEqual((response.status_code, response.data['status']), (status.HTTP_200_OK, 'cancelled'))
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.inventory_quantity, 1)
+        self.assertTrue(ProductSummary.objects.get(product=self.variant.product).in_stock)
+
+        response = self.client.post(f'/api/store/orders/{order.id}/transition/', {'status': 'cancelled'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_status_is_not_freely_writable(self):
+        """Test PATCHing status no longer bypasses the lifecycle"""
+        order = self.orders(1)[0]
+        self.client.force_authenticate(user=self.customer)
+        self.client.patch(f'/api/store/orders/{order.id}/', {'status': 'delivered'})
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'pending')
+
+class LowStockTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(
+            username='stocker', email='stocker@example.com', password='testpass123', is_staff=True
+        )
+        self.client.force_authenticate(user=self.staff)
+        category = Category.objects.create(name='Caps')
+        product = Product.objects.create(name='Cap', description='Cap', category=category, status='active')
+        self.variants = [
+            ProductVariant.objects.create(
+                product=product, size=f'S{index}', price=Decimal('15.00'),
+                inventory_quantity=index, low_stock_threshold=5
+            )
+            for index in range(15)
+        ]
+
+    def test_report_lists_low_variants_lowest_first(self):
+        """Test the staff report pages low variants ordered by remaining stock"""
+        response = self.client.get('/api/store/low-stock/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 6)
+        self.assertEqual([row['inventory_quantity'] for row in response.data['results']], [0, 1, 2, 3, 4, 5])
+        self.assertEqual(response.data['results'][0]['product_name'], 'Cap')
+
+        self.client.force_authenticate(user=User.objects.create_user(
+            username='shopper', email='shopper@example.com', password='testpass123'
+        ))
+        self.assertEqual(self.client.get('/api/store/low-stock/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_alert_fires_once_per_crossing(self):
+        """Test each variant is alerted once until it is restocked above its threshold"""
+        from django.core import mail
+        from django.test import override_settings
+        from .tasks import notify_low_stock
+
+        with override_settings(LOW_STOCK_ALERT_EMAILS=['ops@example.com']):
+            self.assertEqual(notify_low_stock(), 6)
+            self.assertEqual(notify_low_stock(), 0)
+            self.assertEqual(len(mail.outbox), 1)
+
+            ProductVariant.objects.filter(pk=self.variants[0].pk).update(inventory_quantity=20)
+            self.assertEqual(notify_low_stock(), 0)
+            self.assertIsNone(ProductVariant.objects.get(pk=self.variants[0].pk).low_stock_notified_at)
+
+            ProductVariant.objects.filter(pk=self.variants[0].pk).update(inventory_quantity=1)
+            self.assertEqual(notify_low_stock([self.variants[0].pk]), 1)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_striped_variant_alerts_on_its_stripe_total(self):
+        """Test a striped variant is alerted from its stripes even before a stripe runs dry"""
+        from django.core import mail
+        from django.test import override_settings
+        from .inventory import rebalance_stripes
+        from .models import InventoryStripe
+        from .tasks import notify_low_stock
+
+        variant = self.variants[14]
+        rebalance_stripes(variant, stripe_count=2, stock=14)
+        InventoryStripe.objects.filter(variant=variant).update(quantity=2)
+        self.assertEqual(ProductVariant.objects.get(pk=variant.pk).inventory_quantity, 14)
+
+        with override_settings(LOW_STOCK_ALERT_EMAILS=['ops@example.com']):
+            self.assertEqual(notify_low_stock([variant.pk]), 1)
+        self.assertIn('4 left', mail.outbox[0].body)
+
+class RedisCartStoreTestCase(APITestCase):
+    def setUp(self):
+        from .carts import local_hashes
+
+        cache.clear()
+        local_hashes.flushall()
+        self.user = User.objects.create_user(username='hasher', email='hasher@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name='Scarves')
+        product = Product.objects.create(name='Scarf', description='Scarf', category=category, status='active')
+        self.variants = [
+            ProductVariant.objects.create(product=product, size=size, price=Decimal('12.00'), inventory_quantity=10)
+            for size in ('S', 'M')
+        ]
+
+    def add(self, variant, quantity):
+        return self.client.post('/api/store/carts/add_item/', {
+            'variant_id': str(variant.id), 'quantity': quantity
+        }, format='json')
+
+    def test_cart_writes_stay_out_of_the_database_until_persisted(self):
+        """Test cached carts are written behind and checked out from the hash"""
+        from django.test import override_settings
+        from .tasks import persist_carts
+
+        with override_settings(CART_STORE='redis'):
+            self.add(self.variants[0], 1)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.add(self.variants[0], 2).status_code, status.HTTP_201_CREATED)
+            self.assertFalse([query for query in queries if not query['sql'].startswith('SELECT')])
+            self.assertFalse(CartItem.objects.exists())
+
+            self.client.get('/api/store/carts/')
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/store/carts/')
+            self.assertFalse([query for query in queries if not query['sql'].startswith('SELECT')])
+            self.assertEqual([item['quantity'] for item in response.data['items']], [3])
+            self.assertEqual(response.data['total_amount'], Decimal('36.00'))
+
+            self.assertEqual(persist_carts(), 1)
+            item = CartItem.objects.get(cart__user=self.user)
+            self.assertEqual((item.variant_id, item.quantity), (self.variants[0].id, 3))
+            self.assertEqual(str(item.id), response.data['items'][0]['id'])
+
+            self.add(self.variants[1], 1)
+            response = self.client.post('/api/store/orders/', {
+                'from_cart': True, 'shipping_address': '1 Main St', 'phone': '555-0100'
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.data['total_amount'], '48.00')
+            self.assertEqual(self.client.get('/api/store/carts/').data['items'], [])
+
+            persist_carts()
+            self.assertFalse(CartItem.objects.exists())
+
+    def test_a_failing_cart_stays_dirty_without_dropping_the_batch(self):
+        """Test a cart that fails to write behind is logged and retried, and the others are written"""
+        from unittest import mock
+        from django.db import IntegrityError
+        from django.test import override_settings
+        from .carts import RedisCartStore
+        from .tasks import persist_carts
+
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        write = RedisCartStore.write
+
+        def failing_write(store, user_id):
+            if str(user_id) == str(self.user.pk):
+                raise IntegrityError('cart owner is gone')
+            write(store, user_id)
+
+        with override_settings(CART_STORE='redis'):
+            self.add(self.variants[0], 1)
+            self.client.force_authenticate(user=other)
+            self.add(self.variants[1], 2)
+
+            with mock.patch.object(RedisCartStore, 'write', failing_write), self.assertLogs('store.carts', 'ERROR'):
+                self.assertEqual(persist_carts(), 1)
+            self.assertEqual(CartItem.objects.get().cart.user, other)
+
+            self.assertEqual(persist_carts(), 1)
+            self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 1)
+            self.assertEqual(persist_carts(), 0)
+
+class CartTotalsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='totaller', email='totaller@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name='Gloves')
+        sizes = [size for size, _ in ProductVariant.SIZE_CHOICES]
+        self.variants = []
+        for i in range(8):
+            product = Product.objects.create(name=f'Glove {i}', description='Glove', category=category, status='active')
+            ProductImage.objects.create(product=product, image=f'products/glove-{i}.jpg', is_main=True)
+            self.variants += [
+                ProductVariant.objects.create(product=product, size=size, price=Decimal('2.50'), inventory_quantity=9)
+                for size in sizes
+            ]
+        self.cart = Cart.objects.create(user=self.user)
+
+    def fill(self, count):
+        CartItem.objects.bulk_create([
+            CartItem(cart=self.cart, variant=variant, quantity=2) for variant in self.variants[:count]
+        ])
+
+    def test_cart_query_count_is_constant(self):
+        """Test a 40-line cart reads in as many queries as a 2-line one"""
+        self.fill(2)
+        with self.assertNumQueries(4):
+            self.client.get('/api/store/carts/')
+
+        CartItem.objects.all().delete()
+        self.fill(40)
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/store/carts/')
+        self.assertEqual(len(response.data['items']), 40)
+        self.assertEqual((response.data['total_amount'], response.data['total_items']), (Decimal('200.00'), 80))
+        self.assertTrue(response.data['items'][0]['product_image'].endswith('.jpg'))
+
+class CartBatchTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='syncer', email='syncer@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name='Belts')
+        sizes = [size for size, _ in ProductVariant.SIZE_CHOICES]
+        self.variants = []
+        for i in range(6):
+            product = Product.objects.create(name=f'Belt {i}', description='Belt', category=category, status='active')
+            self.variants += [
+                ProductVariant.objects.create(product=product, size=size, price=Decimal('4.00'), inventory_quantity=6)
+                for size in sizes
+            ]
+        self.cart = Cart.objects.create(user=self.user)
+
+    def batch(self, operations):
+        return self.client.post('/api/store/carts/batch/', {'operations': [
+            {'op': op, 'variant_id': str(variant_id), 'quantity': quantity} for op, variant_id, quantity in operations
+        ]}, format='json')
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list('variant_id', 'quantity'))
+
+    def test_batch_applies_operations_in_order(self):
+        """Test adds, sets and removes are folded per variant and held"""
+        from .models import InventoryReservation
+
+        first, second, third = self.variants[:3]
+        self.batch([('add', first.id, 2), ('add', second.id, 1)])
+        response = self.batch([
+            ('add', first.id, 1), ('set', second.id, 4), ('add', third.id, 1), ('remove', third.id, 0),
+            ('add', third.id, 2), ('add', '00000000-0000-0000-0000-000000000000', 1),
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['skipped'], ['00000000-0000-0000-0000-000000000000'])
+        self.assertEqual(response.data['total_items'], 9)
+        self.assertEqual(self.quantities(), {first.id: 3, second.id: 4, third.id: 2})
+        self.assertEqual(
+            dict(InventoryReservation.objects.filter(cart=self.cart).values_list('variant_id', 'quantity')),
+            self.quantities()
+        )
+
+        self.batch([('remove', first.id, 0), ('set', second.id, 0)])
+        self.assertEqual(self.quantities(), {third.id: 2})
+        self.assertEqual(ProductVariant.objects.get(pk=first.pk).reserved_quantity, 0)
+
+    def test_batch_query_count_is_constant(self):
+        """Test a 30-line batch costs the same queries as a 2-line one"""
+        self.batch([('add', self.variants[-1].id, 1)])
+        with CaptureQueriesContext(connection) as small:
+            self.batch([('add', variant.id, 1) for variant in self.variants[:2]])
+        with CaptureQueriesContext(connection) as large:
+            self.batch([('add', variant.id, 1) for variant in self.variants[2:32]])
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(len(self.quantities()), 33)
+
+    def test_short_stock_rejects_the_whole_batch(self):
+        """Test one variant short of stock leaves every line untouched"""
+        first, second = self.variants[:2]
+        response = self.batch([('add', first.id, 2), ('set', second.id, 7)])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual((response.data['variant_id'], response.data['available']), (str(second.id), 6))
+        self.assertEqual(self.quantities(), {})
+        self.assertEqual(ProductVariant.objects.get(pk=first.pk).reserved_quantity, 0)
+
+    def test_guest_merge_adds_to_existing_lines(self):
+        """Test merging a guest cart goes through the batch path"""
+        from .carts import merge_guest_cart
+
+        self.batch([('add', self.variants[0].id, 1)])
+        merge_guest_cart(self.user, {self.variants[0].id: 2, self.variants[1].id: 1})
+        self.assertEqual(self.quantities(), {self.variants[0].id: 3, self.variants[1].id: 1})
+
+class GuestCartTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Beanies')
+        product = Product.objects.create(name='Beanie', description='Beanie', category=category, status='active')
+        self.variants = [
+            ProductVariant.objects.create(product=product, size=size, price=Decimal('8.00'), inventory_quantity=5)
+            for size in ('S', 'M', 'L')
+        ]
+
+    def add(self, variant, quantity):
+        return self.client.post('/api/store/carts/add_item/', {
+            'variant_id': str(variant.id), 'quantity': quantity
+        }, format='json')
+
+    def test_guest_cart_never_writes(self):
+        """Test anonymous carts live in the signed cookie and are priced in one query"""
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.add(self.variants[0], 2).status_code, status.HTTP_201_CREATED)
+            response = self.client.post('/api/store/carts/batch/', {'operations': [
+                {'op': 'add', 'variant_id': str(self.variants[1].id), 'quantity': 1},
+                {'op': 'set', 'variant_id': str(self.variants[0].id), 'quantity': 3},
+            ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if not query['sql'].startswith('SELECT')])
+        self.assertFalse(Cart.objects.exists())
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/store/carts/')
+        self.assertEqual((response.data['total_items'], response.data['total_amount']), (4, Decimal('32.00')))
+        self.assertEqual(response.data['guest_cart'], self.client.cookies['guest_cart'].value)
+
+        self.client.cookies['guest_cart'] = response.data['guest_cart'][:-2] + 'xx'
+        self.assertEqual(self.client.get('/api/store/carts/').data['items'], [])
+
+    def test_guest_cart_is_merged_once_on_login(self):
+        """Test the first signed-in cart request merges the guest cart and drops the cookie"""
+        self.add(self.variants[0], 2)
+        self.add(self.variants[1], 1)
+        token = self.client.cookies['guest_cart'].value
+        user = User.objects.create_user(username='returning', email='returning@example.com', password='testpass123')
+        CartItem.objects.create(cart=Cart.objects.create(user=user), variant=self.variants[0], quantity=1)
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/api/store/carts/')
+        self.assertEqual(
+            {item['variant']['id']: item['quantity'] for item in response.data['items']},
+            {str(self.variants[0].id): 3, str(self.variants[1].id): 1}
+        )
+        self.assertEqual(response.cookies['guest_cart'].value, '')
+
+        # A client replaying the old token does not merge it twice
+        response = self.client.get('/api/store/carts/', HTTP_X_GUEST_CART=token)
+        self.assertEqual(response.data['total_items'], 4)
+
+class CartUpsertTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='lazy', email='lazy@example.com', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name='Ties')
+        product = Product.objects.create(name='Tie', description='Tie', category=category, status='active')
+        self.variant = ProductVariant.objects.create(product=product, size='M', price=Decimal('6.00'), inventory_quantity=10)
+
+    def test_users_get_no_cart_until_they_use_one(self):
+        """Test carts are created lazily, once, and never for bulk-created users"""
+        User.objects.bulk_create([User(username=f'bulk{i}', email=f'bulk{i}@example.com') for i in range(3)])
+        self.assertFalse(Cart.objects.exists())
+
+        for _ in range(2):
+            response = self.client.post('/api/store/carts/add_item/', {
+                'variant_id': str(self.variant.id), 'quantity': 2
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        cart = Cart.objects.get()
+        item = CartItem.objects.get(cart=cart)
+        self.assertEqual((cart.user_id, item.quantity, str(item.id)), (self.user.id, 4, response.data['cart_item_id']))
+        self.assertEqual(ProductVariant.objects.get(pk=self.variant.pk).reserved_quantity, 4)
+
+    def test_upsert_returns_the_existing_cart(self):
+        """Test the cart upsert hands back the stored row on conflict"""
+        from .carts import upsert_cart
+
+        cart = Cart.objects.create(user=self.user)
+        with self.assertNumQueries(1):
+            upserted = upsert_cart(self.user)
+        self.assertEqual((upserted.pk, upserted.created_at), (cart.pk, cart.created_at))
+
+    def test_adding_to_an_existing_cart_only_reads_it(self):
+        """Test adding a line reads the stored cart instead of rewriting its row"""
+        from .carts import DatabaseCartStore
+
+        cart = Cart.objects.create(user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            DatabaseCartStore().add(self.user, self.variant, 1)
+        cart_table = Cart._meta.db_table
+        self.assertFalse([
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith(('INSERT INTO "%s"' % cart_table, 'UPDATE "%s"' % cart_table))
+        ])
+        self.assertEqual(CartItem.objects.get().cart_id, cart.pk)
+
 class CartTestCase(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
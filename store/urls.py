@@ -4,7 +4,7 @@ from django.urls import path, include
 from .views import (
     UserViewSet, CategoryViewSet, ProductViewSet, ProductImageViewSet,
     ProductReviewViewSet, OrderViewSet, OrderItemViewSet,
-    WishlistViewSet, PaymentViewSet, CartViewSet, CartItemViewSet
+    WishlistViewSet, PaymentViewSet, CartViewSet, CartItemViewSet, LowStockViewSet
 )
 
 # Base router
@@ -17,6 +17,7 @@ router.register(r'carts', CartViewSet, basename='cart')
 router.register(r'cart-items', CartItemViewSet, basename='cartitem')
 router.register(r'payments', PaymentViewSet, basename='payment')
 router.register(r'wishlists', WishlistViewSet, basename='wishlist')
+router.register(r'low-stock', LowStockViewSet, basename='low-stock')
 
 # Nested router for product reviews and images
 products_router = routers.NestedDefaultRouter(router, r'products', lookup='product')
@@ -5,7 +5,12 @@ from rest_framework import filters, serializers, status
 from rest_framework.pagination import PageNumberPagination
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework import viewsets, permissions
-from django.db import models  # Added missing import
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.db.models import Case, CharField, Count, Exists, Max, OuterRef, Prefetch, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 
 from .models import (
     CustomUser, Category, Product, ProductImage, ProductReview,
@@ -13,13 +18,27 @@ from .models import (
 )
 from .serializers import (
     UserSerializer, CategorySerializer, ProductListSerializer, ProductDetailSerializer,
-    ProductImageSerializer, ProductReviewSerializer, OrderSerializer, OrderCreateSerializer,
+    ProductImageSerializer, ProductReviewSerializer, OrderSerializer, OrderCreateSerializer, OrderListSerializer,
+    OrderTransitionSerializer, BulkOrderTransitionSerializer,
     OrderItemSerializer, WishlistSerializer, WishlistCreateSerializer,
-    PaymentSerializer, CartSerializer, CartItemSerializer, CartItemCreateSerializer,
-    ProductVariantSerializer
+    PaymentSerializer, CartSerializer, CartItemSerializer, CartItemCreateSerializer, CartBatchSerializer,
+    ProductVariantSerializer, LowStockVariantSerializer
 )
 from .permissions import IsAdminUserOrReadOnly, IsOwnerOrAdmin
-from .filters import ProductFilter
+from .filters import ProductFilter, ProductOrderingFilter
+from .idempotency import IdempotencyMixin
+from .ingestion import ingest_orders
+from .carts import (
+    GuestCart, apply_changes, apply_operations, claim_guest_cart, fold_operations, get_cart_store, line_id
+)
+from .inventory import InsufficientStock
+from .lifecycle import transition_orders
+from .cache import (
+    CatalogCacheMixin, ConditionalGetMixin, PRODUCTS, CATEGORIES,
+    get_generation, get_last_modified, product_namespace
+)
+from .pagination import ProductCursorPagination
+from .search import ProductSearchFilter
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 12
@@ -50,27 +69,73 @@ class UserViewSet(viewsets.ModelViewSet):
 # -------------------
 # CATEGORY
 # -------------------
-class CategoryViewSet(viewsets.ModelViewSet):
-    queryset = Category.objects.all()
+class CategoryViewSet(ConditionalGetMixin, CatalogCacheMixin, viewsets.ModelViewSet):
+    queryset = Category.objects.annotate(
+        product_count=Count('products', filter=Q(products__status='active'))
+    )
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAdminUserOrReadOnly]
     lookup_field = 'slug'
+    cache_namespace = CATEGORIES
+
+    def get_resource_version(self, request, kwargs):
+        # Every category write and product status change bumps the generation
+        return get_generation(CATEGORIES), get_last_modified(CATEGORIES)
 
 # -------------------
 # PRODUCT
 # -------------------
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = Product.objects.filter(status='active').prefetch_related(
         'variants', 'images', 'category'
     )
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAdminUserOrReadOnly]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, ProductOrderingFilter]
     filterset_class = ProductFilter
-    search_fields = ['name', 'description']
     ordering_fields = ['created_at', 'name']
     ordering = ['-created_at']
     pagination_class = StandardResultsSetPagination
     lookup_field = 'slug'
+    cache_namespace = PRODUCTS
+    cache_query_params = CatalogCacheMixin.cache_query_params + ['cursor', 'pagination']
+
+    def get_resource_version(self, request, kwargs):
+        if self.action == 'list':
+            return get_generation(PRODUCTS), get_last_modified(PRODUCTS)
+
+        # Detail: one row with the newest timestamp of everything it embeds
+        row = Product.objects.filter(status='active', slug=kwargs.get('slug')).annotate(
+            last_review=Max('reviews__updated_at')
+        ).values_list(
+            'updated_at', 'summary__updated_at', 'category__updated_at', 'last_review',
+            *Product.RATING_COUNT_FIELDS
+        ).first()
+        if row is None:
+            return None
+        # Stock and holds change through set-based updates that touch no
+        # timestamp here; they bump the product's own namespace instead
+        namespace = product_namespace(kwargs.get('slug'))
+        last_modified = max(
+            [timestamp for timestamp in row[:4] if timestamp is not None] + [get_last_modified(namespace)]
+        )
+        # Nested category product counts move with the categories generation
+        return (row, get_generation(CATEGORIES), get_generation(namespace)), last_modified
+
+    def get_cache_generation(self, kwargs):
+        generation = super().get_cache_generation(kwargs)
+        if self.action == 'retrieve':
+            return f"{generation}.{get_generation(product_namespace(kwargs.get('slug')))}"
+        return generation
+
+    @property
+    def paginator(self):
+        """Keyset pagination when the client asks for it, page numbers otherwise"""
+        if not hasattr(self, '_paginator'):
+            if ProductCursorPagination.is_requested(self.request):
+                self._paginator = ProductCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
     
     def get_serializer_class(self):
         if self.action == 'retrieve':
@@ -79,19 +144,18 @@ class ProductViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         queryset = super().get_queryset()
-        
-        # Custom ordering by price
-        ordering = self.request.query_params.get('ordering')
-        if ordering == 'price':
-            queryset = queryset.annotate(
-                min_price=models.Min('variants__price')
-            ).order_by('min_price')
-        elif ordering == '-price':
-            queryset = queryset.annotate(
-                max_price=models.Max('variants__price')
-            ).order_by('-max_price')
-            
-        return queryset.distinct()
+        if self.action == 'list':
+            queryset = self.get_list_queryset(queryset)
+        # Price ordering is handled by ProductOrderingFilter via ProductSummary;
+        # filters use EXISTS subqueries, so rows are never duplicated
+        return queryset
+
+    def get_list_queryset(self, queryset):
+        """
+        Read list fields from the product summary row so a page costs a fixed
+        number of queries; nested categories come from the category map.
+        """
+        return queryset.prefetch_related(None).select_related('summary')
     
     @action(detail=True, methods=['get'])
     def variants(self, request, slug=None):
@@ -101,57 +165,164 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer = ProductVariantSerializer(variants, many=True)
         return Response(serializer.data)
 
+    # (label, lower bound, upper bound) on the lowest in-stock price
+    facet_price_buckets = [
+        ('0-25', 0, 25),
+        ('25-50', 25, 50),
+        ('50-100', 50, 100),
+        ('100-200', 100, 200),
+        ('200+', 200, None),
+    ]
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Category, size, price bucket and stock counts for the current filters"""
+        return self.cached_response(self.get_facets, request)
+
+    def get_facets(self, request):
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None).order_by()
+
+        price_bucket = Case(
+            *[
+                When(summary__min_price__gte=lower, then=Value(label)) if upper is None
+                else When(summary__min_price__lt=upper, then=Value(label))
+                for label, lower, upper in self.facet_price_buckets
+            ],
+            default=Value(None),
+            output_field=CharField(),
+        )
+        size_counts = {
+            f'size_{size}': Count('pk', distinct=True, filter=Q(Exists(
+                ProductVariant.objects.filter(product=OuterRef('pk'), size=size)
+            )))
+            for size, _ in ProductVariant.SIZE_CHOICES
+        }
+        # One grouped query; each row is a (category, stock, bucket) cell
+        rows = queryset.values(
+            'category__slug', 'category__name', 'summary__in_stock', price_bucket=price_bucket
+        ).annotate(count=Count('pk', distinct=True), **size_counts)
+
+        total = in_stock = 0
+        categories, sizes, buckets = {}, {}, {}
+        for row in rows:
+            total += row['count']
+            if row['summary__in_stock']:
+                in_stock += row['count']
+            category = categories.setdefault(
+                row['category__slug'],
+                {'slug': row['category__slug'], 'name': row['category__name'], 'count': 0}
+            )
+            category['count'] += row['count']
+            if row['price_bucket'] is not None:
+                buckets[row['price_bucket']] = buckets.get(row['price_bucket'], 0) + row['count']
+            for size, _ in ProductVariant.SIZE_CHOICES:
+                sizes[size] = sizes.get(size, 0) + row[f'size_{size}']
+
+        return Response({
+            'total': total,
+            'in_stock': in_stock,
+            'categories': sorted(categories.values(), key=lambda c: -c['count']),
+            'sizes': [
+                {'size': size, 'count': sizes.get(size, 0)}
+                for size, _ in ProductVariant.SIZE_CHOICES if sizes.get(size)
+            ],
+            'price_buckets': [
+                {'key': label, 'min': lower, 'max': upper, 'count': buckets.get(label, 0)}
+                for label, lower, upper in self.facet_price_buckets
+            ],
+        })
+
 class ProductImageViewSet(viewsets.ModelViewSet):
     queryset = ProductImage.objects.all()
     serializer_class = ProductImageSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAdminUserOrReadOnly]
 
-class ProductReviewViewSet(viewsets.ModelViewSet):
+class ProductReviewViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = ProductReviewSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     filter_backends = [filters.OrderingFilter, DjangoFilterBackend]
     filterset_fields = ['rating']
     ordering = ['-created_at']
+    pagination_class = StandardResultsSetPagination
 
     def get_queryset(self):
-        product_pk = self.kwargs['product_pk']
-        return ProductReview.objects.filter(product_id=product_pk)
+        # Nested under products/{slug}/, so the router passes the product slug
+        product_slug = self.kwargs['product_slug']
+        return ProductReview.objects.filter(product__slug=product_slug).select_related('user')
+
+    def get_resource_version(self, request, kwargs):
+        if self.action == 'retrieve':
+            updated_at = ProductReview.objects.filter(
+                pk=kwargs.get('pk'), product__slug=kwargs.get('product_slug')
+            ).values_list('updated_at', flat=True).first()
+            return None if updated_at is None else (updated_at, updated_at)
+
+        # Review deletes move the product's updated_at with its star counters
+        row = Product.objects.filter(slug=kwargs.get('product_slug')).annotate(
+            last_review=Max('reviews__updated_at'), review_total=Count('reviews')
+        ).values_list('updated_at', 'last_review', 'review_total').first()
+        if row is None:
+            return None
+        updated_at, last_review, review_total = row
+        return row, max(updated_at, last_review or updated_at)
 
     def perform_create(self, serializer):
-        product_pk = self.kwargs['product_pk']
+        product = get_object_or_404(Product, slug=self.kwargs['product_slug'])
         
         if ProductReview.objects.filter(
-            product_id=product_pk, 
+            product=product, 
             user=self.request.user
         ).exists():
             raise serializers.ValidationError("You have already reviewed this product")
         
         serializer.save(
             user=self.request.user,
-            product_id=product_pk
+            product=product
         )
 
 # -------------------
 # ORDER
 # -------------------
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(IdempotencyMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrAdmin]
     pagination_class = StandardResultsSetPagination
     authentication_classes = [JWTAuthentication]
+    bulk_max_orders = 5000
 
     def get_serializer_class(self):
         if self.action == 'create':
             return OrderCreateSerializer
+        if self.action == 'list':
+            return OrderListSerializer
         return OrderSerializer
 
     def get_queryset(self):
         user = self.request.user
         if user.is_staff or user.is_superuser:
-            return Order.objects.all()
-        return Order.objects.filter(user=user)
+            queryset = Order.objects.all()
+        else:
+            queryset = Order.objects.filter(user=user)
+
+        if self.action == 'list':
+            # Per-order subqueries keep the page at a fixed number of queries
+            items = OrderItem.objects.filter(order=OuterRef('pk')).order_by()
+            counts = items.values('order')
+            lead_item = items.order_by('-price', 'id')
+            return queryset.select_related('user').annotate(
+                item_count=Coalesce(Subquery(counts.annotate(n=Count('pk')).values('n')), 0),
+                unit_count=Coalesce(Subquery(counts.annotate(n=Sum('quantity')).values('n')), 0),
+                lead_item_name=Subquery(lead_item.values('variant__product__name')[:1]),
+                lead_item_image=Subquery(lead_item.values('variant__product__summary__main_image')[:1]),
+            )
+        return queryset.select_related('user').prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('variant__product'))
+        )
 
     def create(self, request, *args, **kwargs):
-        """Create order from cart items"""
+        """Create order from cart items (retries with an Idempotency-Key replay)"""
+        return self.idempotent_response(self.create_order, request, *args, **kwargs)
+
+    def create_order(self, request, *args, **kwargs):
         # Check if user wants to create from cart
         from_cart = request.data.get('from_cart', False)
         
@@ -163,58 +334,128 @@ class OrderViewSet(viewsets.ModelViewSet):
     
     def create_order_from_cart(self, request):
         """Create an order from the user's cart items"""
-        try:
-            cart = Cart.objects.get(user=request.user)
-            cart_items = cart.items.all()
-            
-            if not cart_items.exists():
+        # One read of the lines, their variants and products (from whichever
+        # cart store is active); reused for pricing, stock checks and the response
+        store = get_cart_store()
+        cart_items = [item for item in store.items(request.user) if item.quantity]
+        if not cart_items:
+            if not store.exists(request.user):
+                return Response(
+                    {'error': 'Cart not found'}, 
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            return Response(
+                {'error': 'Cart is empty'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        for cart_item in cart_items:
+            if cart_item.variant.price is None:
                 return Response(
-                    {'error': 'Cart is empty'}, 
+                    {'error': f'Price not set for {cart_item.variant.product.name}'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            
-            # Prepare order data
-            order_data = {
-                'shipping_address': request.data.get('shipping_address'),
-                'phone': request.data.get('phone'),
-                'items': []
-            }
-            
-            # Convert cart items to order items
-            for cart_item in cart_items:
-                if cart_item.quantity is None or cart_item.quantity <= 0:
-                    continue
-                    
-                if cart_item.variant.price is None:
-                    return Response(
-                        {'error': f'Price not set for {cart_item.variant.product.name}'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                order_data['items'].append({
-                    'variant_id': str(cart_item.variant.id),
-                    'quantity': cart_item.quantity
-                })
-            
-            # Validate and create order
-            serializer = self.get_serializer(data=order_data)
-            serializer.is_valid(raise_exception=True)
-            order = serializer.save(user=request.user)
-            
-            # Clear the cart after successful order creation
-            cart.items.all().delete()
-            
+
+        # Only the database store holds stock for its lines
+        cart = cart_items[0].cart if store.holds_stock else None
+        serializer = self.get_serializer(data={
+            'shipping_address': request.data.get('shipping_address'),
+            'phone': request.data.get('phone'),
+            'payment_method': request.data.get('payment_method', 'card'),
+            'items': [
+                {'variant_id': str(cart_item.variant_id), 'quantity': cart_item.quantity}
+                for cart_item in cart_items
+            ],
+        })
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            # The cart's stock reservations are converted into the sale. The
+            # variants are re-read under lock so stock checks, the sold-out
+            # refresh and the response see the post-sale values
+            order = serializer.save(user=request.user, cart=cart)
+
+            # Clear the cart after successful order creation (its holds were consumed)
+            store.checked_out(request.user)
+
+        # The order, its user and items are all in memory already
+        return Response(
+            OrderSerializer(order, context={'request': request}).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def bulk(self, request):
+        """
+        Import many orders at once (staff only).
+
+        Body: {"orders": [{shipping_address, phone, items, reference?,
+        customer_email?}, ...]}. Orders are created in batches, one
+        transaction each; the response reports every order's outcome.
+        """
+        orders = request.data.get('orders')
+        if not isinstance(orders, list) or not orders:
             return Response(
-                OrderSerializer(order, context={'request': request}).data,
-                status=status.HTTP_201_CREATED
+                {'error': 'orders must be a non-empty list'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-        except Cart.DoesNotExist:
+        if len(orders) > self.bulk_max_orders:
+            return Response(
+                {'error': f'At most {self.bulk_max_orders} orders per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = ingest_orders(orders, request.user)
+        created = sum(result['status'] == 'created' for result in results)
+        return Response({
+            'created': created,
+            'failed': len(results) - created,
+            'results': results,
+        })
+
+    @action(detail=True, methods=['post'])
+    def transition(self, request, pk=None):
+        """Move one order to a new status; customers may only cancel"""
+        order = self.get_object()
+        serializer = OrderTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        target = serializer.validated_data['status']
+        if not request.user.is_staff and target != 'cancelled':
             return Response(
-                {'error': 'Cart not found'}, 
-                status=status.HTTP_404_NOT_FOUND
+                {'error': 'Only staff can change an order to this status'},
+                status=status.HTTP_403_FORBIDDEN
             )
 
+        result = transition_orders([order.pk], target, actor=request.user, note=serializer.validated_data['note'])
+        if not result.updated:
+            return Response(
+                {'error': f'Cannot change order from {result.ineligible.get(order.pk, order.status)} to {target}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(OrderSerializer(self.get_queryset().get(pk=order.pk), context={'request': request}).data)
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def bulk_transition(self, request):
+        """
+        Move many orders to one status (staff only).
+
+        Body: {"order_ids": [...], "status": "shipped", "note": ""}. Orders
+        whose current status does not allow the change are reported in
+        `ineligible`; unknown ids in `missing`.
+        """
+        serializer = BulkOrderTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = transition_orders(
+            serializer.validated_data['order_ids'], serializer.validated_data['status'],
+            actor=request.user, note=serializer.validated_data['note']
+        )
+        return Response({
+            'updated': result.updated,
+            'ineligible': [
+                {'id': str(order_id), 'status': current} for order_id, current in result.ineligible.items()
+            ],
+            'missing': [str(order_id) for order_id in result.missing],
+        })
+
 class OrderItemViewSet(viewsets.ModelViewSet):
     serializer_class = OrderItemSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrAdmin]
@@ -232,48 +473,99 @@ class PaymentViewSet(viewsets.ModelViewSet):
         return Payment.objects.filter(order__user=self.request.user)
 
 # -------------------
-# CART
+# INVENTORY
 # -------------------
-from django.db import IntegrityError
-from django.shortcuts import get_object_or_404
+class LowStockViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Staff report of variants at or below their low-stock threshold, lowest
+    stock first. Served straight off the partial variant_low_stock_idx.
+    """
+    serializer_class = LowStockVariantSerializer
+    permission_classes = [permissions.IsAdminUser]
+    authentication_classes = [JWTAuthentication]
+    pagination_class = StandardResultsSetPagination
+
+    def get_queryset(self):
+        return ProductVariant.objects.filter(ProductVariant.LOW_STOCK).select_related('product').order_by(
+            'inventory_quantity', 'id'
+        )
 
-class CartViewSet(viewsets.ModelViewSet):
+# -------------------
+# CART
+# -------------------
+class CartViewSet(IdempotencyMixin, viewsets.ModelViewSet):
+    """
+    The user's cart. Anonymous visitors may list, add to, batch and clear a
+    GuestCart held in a signed cookie (or X-Guest-Cart header), which is
+    merged into their cart on the first request after signing in.
+    """
     serializer_class = CartSerializer
     permission_classes = [permissions.IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    guest_actions = ('list', 'add_item', 'batch', 'clear')
+
+    def get_permissions(self):
+        if self.action in self.guest_actions:
+            return [permissions.AllowAny()]
+        return super().get_permissions()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.guest_cart_merged = request.user.is_authenticated and claim_guest_cart(request)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if getattr(self, 'guest_cart_merged', False):
+            response.delete_cookie(GuestCart.COOKIE)
+        return super().finalize_response(request, response, *args, **kwargs)
 
     def get_queryset(self):
         return Cart.objects.filter(user=self.request.user)
 
+    def guest_response(self, request, cart, status_code=status.HTTP_200_OK, **extra):
+        """Render a GuestCart and hand its token back (body and cookie)"""
+        if len(cart.lines) > settings.GUEST_CART_MAX_LINES:
+            # Keep the cookie small; the client still holds the previous token
+            return Response(
+                {'error': f'A guest cart holds at most {settings.GUEST_CART_MAX_LINES} items; sign in to add more'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        token = cart.token
+        response = Response(
+            {**self.get_serializer(cart).data, 'guest_cart': token, **extra}, status=status_code
+        )
+        response.set_cookie(
+            GuestCart.COOKIE, token, max_age=settings.GUEST_CART_MAX_AGE,
+            httponly=True, samesite='Lax', secure=request.is_secure()
+        )
+        return response
+
     def list(self, request):
         """Get user's cart, create if doesn't exist"""
-        try:
-            # Try to get existing cart
-            cart = Cart.objects.get(user=request.user)
-        except Cart.DoesNotExist:
-            # Create new cart if it doesn't exist
-            try:
-                cart = Cart.objects.create(user=request.user)
-            except IntegrityError:
-                # Handle race condition - cart was created by another request
-                cart = Cart.objects.get(user=request.user)
-        
-        serializer = self.get_serializer(cart)
+        if not request.user.is_authenticated:
+            return self.guest_response(request, GuestCart(GuestCart.read(request)))
+        serializer = self.get_serializer(get_cart_store().loaded_cart(request.user))
         return Response(serializer.data)
 
     @action(detail=False, methods=['post'])
     def add_item(self, request):
-        """Add item to cart with proper error handling"""
-        # Get or create cart with proper error handling
-        try:
-            cart = Cart.objects.get(user=request.user)
-        except Cart.DoesNotExist:
-            try:
-                cart = Cart.objects.create(user=request.user)
-            except IntegrityError:
-                # Cart was created by another request between check and create
-                cart = Cart.objects.get(user=request.user)
-        
+        """Add item to cart (retries with an Idempotency-Key replay)"""
+        if not request.user.is_authenticated:
+            # A retried guest add resends the old token, so it is idempotent already
+            return self.add_guest_item(request)
+        return self.idempotent_response(self.add_cart_item, request)
+
+    def add_guest_item(self, request):
+        serializer = CartItemCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        variant_id = serializer.validated_data['variant_id']
+        lines = GuestCart.read(request)
+        lines[variant_id] = lines.get(variant_id, 0) + serializer.validated_data['quantity']
+        return self.guest_response(
+            request, GuestCart(lines), status.HTTP_201_CREATED,
+            message='Item added to cart', cart_item_id=str(line_id('guest', variant_id))
+        )
+
+    def add_cart_item(self, request):
         serializer = CartItemCreateSerializer(data=request.data)
         
         if serializer.is_valid():
@@ -289,16 +581,7 @@ class CartViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_400_BAD_REQUEST
                     )
                 
-                # Check if item already exists in cart
-                cart_item, created = CartItem.objects.get_or_create(
-                    cart=cart,
-                    variant=variant,
-                    defaults={'quantity': quantity}
-                )
-                
-                if not created:
-                    cart_item.quantity += quantity
-                    cart_item.save()
+                cart_item = get_cart_store().add(request.user, variant, quantity)
                 
                 return Response(
                     {'message': 'Item added to cart', 'cart_item_id': str(cart_item.id)},
@@ -310,14 +593,68 @@ class CartViewSet(viewsets.ModelViewSet):
                     {'error': 'Product variant does not exist'},
                     status=status.HTTP_404_NOT_FOUND
                 )
+            except InsufficientStock as exc:
+                return Response(
+                    {'error': 'Not enough stock available', 'available': exc.available},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Apply many line changes at once (retries with an Idempotency-Key replay).
+
+        Body: {"operations": [{"op": "add" | "set" | "remove", "variant_id",
+        "quantity"}, ...]}, applied in order. Responds with the updated cart
+        and the ids of unknown variants that were skipped.
+        """
+        if not request.user.is_authenticated:
+            return self.apply_guest_batch(request)
+        return self.idempotent_response(self.apply_batch, request)
+
+    def apply_guest_batch(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        changes = fold_operations([
+            (operation['op'], operation['variant_id'], operation['quantity'])
+            for operation in serializer.validated_data['operations']
+        ])
+        lines = GuestCart.read(request)
+        # One query prices the whole cart, changed lines included
+        variants = ProductVariant.objects.select_related('product').in_bulk(list({*lines, *changes}))
+        skipped = [variant_id for variant_id in changes if variant_id not in variants]
+        lines = apply_changes(lines, {
+            variant_id: change for variant_id, change in changes.items() if variant_id in variants
+        })
+        return self.guest_response(
+            request, GuestCart(lines, variants), skipped=[str(variant_id) for variant_id in skipped]
+        )
+
+    def apply_batch(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            skipped = apply_operations(request.user, [
+                (operation['op'], operation['variant_id'], operation['quantity'])
+                for operation in serializer.validated_data['operations']
+            ])
+        except InsufficientStock as exc:
+            return Response(
+                {'error': 'Not enough stock available', 'variant_id': str(exc.variant.pk), 'available': exc.available},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        data = self.get_serializer(get_cart_store().loaded_cart(request.user)).data
+        return Response({**data, 'skipped': [str(variant_id) for variant_id in skipped]})
+
     @action(detail=False, methods=['post'])
     def clear(self, request):
         """Clear user's cart"""
-        cart = get_object_or_404(Cart, user=request.user)
-        cart.items.all().delete()
+        if not request.user.is_authenticated:
+            return self.guest_response(request, GuestCart({}))
+        if not get_cart_store().clear(request.user):
+            raise Http404
         return Response({'message': 'Cart cleared'})
 
 
@@ -327,11 +664,31 @@ class CartItemViewSet(viewsets.ModelViewSet):
     authentication_classes = [JWTAuthentication]
 
     def get_queryset(self):
+        # Rows may lag a cache-backed cart; write it through first
+        get_cart_store().persist(self.request.user)
         return CartItem.objects.filter(cart__user=self.request.user)
 
     def perform_create(self, serializer):
-        cart, created = Cart.objects.get_or_create(user=self.request.user)
-        serializer.save(cart=cart)
+        store = get_cart_store()
+        with transaction.atomic():
+            item = serializer.save(cart=store.cart(self.request.user))
+            self.sync(store, item)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            self.sync(get_cart_store(), serializer.save())
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            get_cart_store().line_removed(self.request.user, instance)
+
+    def sync(self, store, item):
+        """Mirror a written line into the cart store (holding its stock)"""
+        try:
+            store.line_saved(self.request.user, item)
+        except InsufficientStock as exc:
+            raise serializers.ValidationError({'quantity': f'Only {exc.available} available'})
 
 # -------------------
 # WISHLIST